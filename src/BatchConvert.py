@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+Batch conversion of logs with the LogTools exports, one session per process of a
+process pool. Sessions are found by directory or glob pattern ('.blc' and '.npz'
+logs with their '.json' header). A session is skipped if its output is up to date:
+newer than the log and header (default) or, with useHash, converted from a log with
+the same content hash (sha1 of log and header, kept in HASH_FILE in the output dir).
+
+usage: python BatchConvert.py PATH [PATH ...] [-f txt|edf|blc] [-o OUTDIR] [-j WORKERS] [--hash] [--force]
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+
+from ChunkedLog import BLC_SUFFIX
+
+#format: (file extension, LogTools export function)
+EXPORT_FORMATS = {'txt': ('.txt', 'exportTxt'), 'edf': ('.edf', 'exportEdf'), 'blc': (BLC_SUFFIX, 'exportBlc')}
+LOG_SUFFIXES = (BLC_SUFFIX, '.npz')
+HASH_FILE = "BatchConvert_hashes.json"      #output file name: sha1 of the session it was converted from
+HASH_BLOCK_SIZE = 2**20
+
+
+def findSessions(paths):
+    """
+    returns the sorted base names of all sessions in paths (directories, log files or glob patterns)
+    sessions without '.json' header are left out
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for suffix in LOG_SUFFIXES:
+                files.extend(glob.glob(os.path.join(path, "*" + suffix)))
+        else:
+            files.extend(glob.glob(path))
+    
+    baseNames = set()
+    for f in files:
+        (baseName, suffix) = os.path.splitext(f)
+        if suffix in LOG_SUFFIXES and os.path.isfile(baseName + '.json'):
+            baseNames.add(baseName)
+    return sorted(baseNames)
+
+def outputPath(baseName, fmt, outDir=None):
+    return os.path.join(outDir if outDir else os.path.dirname(baseName), os.path.basename(baseName) + EXPORT_FORMATS[fmt][0])
+
+def sessionHash(baseName):
+    """sha1 of the log file and the '.json' header
+    """
+    import LogTools
+    h = hashlib.sha1()
+    for path in (LogTools.logFilePath(baseName), baseName + '.json'):
+        with open(path, 'rb') as f:
+            block = f.read(HASH_BLOCK_SIZE)
+            while block:
+                h.update(block)
+                block = f.read(HASH_BLOCK_SIZE)
+    return h.hexdigest()
+
+def _isUpToDate(baseName, outPath):
+    import LogTools
+    if not os.path.isfile(outPath):
+        return False
+    sourceTime = max(os.path.getmtime(LogTools.logFilePath(baseName)), os.path.getmtime(baseName + '.json'))
+    return os.path.getmtime(outPath) >= sourceTime
+
+def _convertJob(job):
+    """
+    runs in a pool process. job: (base name, format, output path, previous hash or None to compare mtime, force)
+    returns a result dict: baseName, outPath, status ('converted', 'skipped' or 'error'), error, hash, bytes (log size), sec
+    """
+    (baseName, fmt, outPath, previousHash, force) = job
+    import LogTools     #loaded in the pool process
+    t0 = time.time()
+    result = {'baseName': baseName, 'outPath': outPath, 'status': 'converted', 'error': None, 'hash': None, 'bytes': 0, 'sec': 0.0}
+    try:
+        logPath = LogTools.logFilePath(baseName)
+        result['bytes'] = os.path.getsize(logPath)
+        if fmt == 'blc' and logPath.endswith(BLC_SUFFIX) and os.path.abspath(logPath) == os.path.abspath(outPath):
+            result['status'] = 'skipped'    #native format already
+        else:
+            if previousHash is not None:
+                result['hash'] = sessionHash(baseName)
+                upToDate = os.path.isfile(outPath) and result['hash'] == previousHash
+            else:
+                upToDate = _isUpToDate(baseName, outPath)
+            
+            if upToDate and not force:
+                result['status'] = 'skipped'
+            else:
+                getattr(LogTools, EXPORT_FORMATS[fmt][1])(baseName, outPath)
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = str(e)
+    result['sec'] = time.time() - t0
+    return result
+
+def _loadHashes(outDir):
+    try:
+        with open(os.path.join(outDir, HASH_FILE), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def convertAll(paths, fmt, outDir=None, workers=None, useHash=False, force=False, progressFnc=None):
+    """
+    converts all sessions in paths (see findSessions) to fmt (key of EXPORT_FORMATS) on a pool of workers processes
+    (default: one per core). Outputs are written to outDir, next to the logs if None.
+    progressFnc(result dict, sessions done, session count) is called for every finished session.
+    returns a summary dict with the session counts, log bytes and seconds in total
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError("Format must be one of " + ", ".join(sorted(EXPORT_FORMATS)) + ": '" + str(fmt) + "'")
+    if outDir and not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    
+    hashes = {}     #output dir: {output file name: hash}
+    jobs = []
+    for baseName in findSessions(paths):
+        outPath = outputPath(baseName, fmt, outDir)
+        previousHash = None
+        if useHash:
+            dirHashes = hashes.setdefault(os.path.dirname(outPath), _loadHashes(os.path.dirname(outPath)))
+            previousHash = dirHashes.get(os.path.basename(outPath), "")
+        jobs.append((baseName, fmt, outPath, previousHash, force))
+    
+    summary = {'sessions': len(jobs), 'converted': 0, 'skipped': 0, 'errors': 0, 'bytes': 0, 'sec': 0.0, 'workers': workers or mp.cpu_count()}
+    t0 = time.time()
+    if jobs:
+        pool = mp.Pool(min(summary['workers'], len(jobs)))
+        try:
+            for result in pool.imap_unordered(_convertJob, jobs):
+                if result['status'] == 'converted':
+                    summary['converted'] += 1
+                    summary['bytes'] += result['bytes']
+                    if useHash and result['hash']:
+                        hashes[os.path.dirname(result['outPath'])][os.path.basename(result['outPath'])] = result['hash']
+                elif result['status'] == 'skipped':
+                    summary['skipped'] += 1
+                else:
+                    summary['errors'] += 1
+                if progressFnc:
+                    progressFnc(result, summary['converted'] + summary['skipped'] + summary['errors'], len(jobs))
+        finally:
+            pool.close()
+            pool.join()
+    summary['sec'] = time.time() - t0
+    
+    for (d, dirHashes) in hashes.items():
+        with open(os.path.join(d, HASH_FILE), 'w') as f:
+            json.dump(dirHashes, f, indent=2, sort_keys=True)
+    return summary
+
+def resultStr(result, done, total):
+    s = "[" + str(done) + "/" + str(total) + "] " + os.path.basename(result['baseName']) + ": " + result['status']
+    if result['status'] == 'converted':
+        s = s + " (%.1f sec)" % result['sec']
+    elif result['error']:
+        s = s + ": " + result['error']
+    return s
+
+def summaryStr(summary):
+    """aggregate throughput of the converted sessions
+    """
+    s = "Batch conversion: %d converted, %d skipped, %d errors in %.1f sec (%d workers)" % (
+        summary['converted'], summary['skipped'], summary['errors'], summary['sec'], summary['workers'])
+    if summary['converted'] > 0 and summary['sec'] > 0:
+        s = s + ", %.1f MB/s, %.1f sessions/min" % (summary['bytes'] / 1e6 / summary['sec'], summary['converted'] * 60.0 / summary['sec'])
+    return s
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="BioLink batch conversion of logs")
+    parser.add_argument("paths", nargs='+', help="log directories, log files or glob patterns")
+    parser.add_argument("-f", "--format", default='txt', choices=sorted(EXPORT_FORMATS), help="output format (default: %(default)s)")
+    parser.add_argument("-o", "--outdir", help="output directory, default: next to the logs")
+    parser.add_argument("-j", "--workers", type=int, help="processes, default: one per core")
+    parser.add_argument("--hash", action="store_true", help="skip by content hash of the log instead of modification time")
+    parser.add_argument("--force", action="store_true", help="convert all sessions, also if the output is up to date")
+    args = parser.parse_args(argv)
+    
+    def printProgress(result, done, total):
+        print resultStr(result, done, total)
+    
+    try:
+        summary = convertAll(args.paths, args.format, args.outdir, args.workers, args.hash, args.force, printProgress)
+    except (ValueError, OSError) as e:
+        print "Error:", e
+        return 1
+    print summaryStr(summary)
+    return 1 if summary['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+Headless end-to-end benchmark of the acquisition pipeline. Runs experiments
+with the dummy device (see PluxInterface.SyntheticSignals) through ExpController
+for a matrix of sample rate, channel count, live plot, extension and serial port,
+without GTK. The live plot is rendered headless (Agg), the extension is the
+LoadTest extension and serial events are sent through a pseudo terminal.
+
+Reported per run: sustained frames/s, latency from frame due time to logging
+(percentiles), frames lost, serial events lost, CPU time per thread and process
+and peak RSS per process (CPU and RSS from /proc, Linux only).
+Results are written to a json file to compare versions.
+
+usage: python Benchmark.py [--quick] [--duration SEC] [--out FILE] ...
+"""
+
+import matplotlib
+matplotlib.use('Agg')   #no display needed, also inherited by the plot process
+
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import threading
+import argparse
+import platform
+import ctypes
+
+import numpy as np
+
+import MsgLogger
+import ExpController
+from TimeBase import monotonic
+import RealtimePlot
+
+DEFAULT_RATES = (1000, 5000, 10000)
+DEFAULT_CHANNELS = (3, 8)
+SERIAL_EVENT_RATE = 10      #events per second sent through pty
+SAMPLE_INTERVAL = 0.25      #sec, /proc sampling
+WARMUP_SEC = 1.0            #not included in sustained frames/s
+END_TIMEOUT = 30            #sec, max time to wait for the log to be saved
+SEED = 1
+
+_clockTicks = float(os.sysconf('SC_CLK_TCK')) if hasattr(os, 'sysconf') else 100.0
+_procAvailable = os.path.isdir('/proc/self/task')
+
+
+def _gettid():
+    """native thread id of the calling thread (Linux), None elsewhere
+    """
+    try:
+        libc = ctypes.CDLL(None)
+        if hasattr(libc, 'gettid'):
+            return libc.gettid()
+        return libc.syscall(186 if platform.machine() == 'x86_64' else 178)     #SYS_gettid x86_64 / aarch64
+    except Exception:
+        return None
+
+def _readCpuSec(statPath):
+    """utime + stime [sec] of a process or thread
+    """
+    with open(statPath) as f:
+        fields = f.read().rsplit(')', 1)[1].split()     #comm may contain spaces
+    return (int(fields[11]) + int(fields[12])) / _clockTicks
+
+def _readPeakRssKb(pid):
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return None
+
+
+class ProcSampler:
+    """
+    Samples CPU time of all threads of this process and of registered child processes
+    plus peak RSS of all processes. Values of processes that ended are kept from the last sample.
+    CPU time is reported relative to start(), the counters of /proc include earlier runs.
+    Threads can be given names with nameThread from within the thread.
+    """
+    def __init__(self):
+        self.threadNames = {}       #native tid: name
+        self.threadCpu = {}         #native tid: cpu sec
+        self.processes = {'main': os.getpid()}
+        self.processCpu = {}
+        self.processRss = {}
+        self.threadCpuBase = {}     #counters at start(), threads started later begin at 0
+        self.processCpuBase = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.setDaemon(True)
+    
+    def nameThread(self, name):
+        tid = _gettid()
+        if tid is not None:
+            self.threadNames[tid] = name
+    
+    def addProcess(self, name, pid):
+        self.processes[name] = pid
+        
+    def start(self):
+        if _procAvailable:
+            self._sample()
+            self.threadCpuBase = dict(self.threadCpu)
+            self.processCpuBase = dict(self.processCpu)
+            self._thread.start()
+        
+    def stop(self):
+        if _procAvailable:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+    
+    def _sample(self):
+        for tid in os.listdir('/proc/self/task'):
+            try:
+                self.threadCpu[int(tid)] = _readCpuSec('/proc/self/task/%s/stat' % tid)
+            except (IOError, OSError):
+                pass    #thread ended
+        for (name, pid) in self.processes.items():
+            try:
+                self.processCpu[name] = _readCpuSec('/proc/%d/stat' % pid)
+                rss = _readPeakRssKb(pid)
+                if rss is not None:     #no VmHWM after the process exited, keep the last value
+                    self.processRss[name] = rss
+            except (IOError, OSError):
+                pass    #process ended
+                
+    def _loop(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self._sample()
+    
+    def result(self):
+        threads = {}
+        for (tid, cpu) in self.threadCpu.items():
+            name = self.threadNames.get(tid, 'other')
+            threads[name] = threads.get(name, 0.0) + cpu - self.threadCpuBase.get(tid, 0.0)
+        threads = dict((name, round(cpu, 2)) for (name, cpu) in threads.items())     #counters are clock ticks, no float noise
+        processes = dict((name, round(cpu - self.processCpuBase.get(name, 0.0), 2)) for (name, cpu) in self.processCpu.items())
+        return {'cpu_sec': {'threads': threads, 'processes': processes}, 'peakRss_kB': self.processRss}
+
+
+class SerialEventSender:
+    """writes serial events to the master side of a pseudo terminal, ExpController opens the slave side
+    """
+    def __init__(self, rate):
+        import pty
+        self.master, self.slave = pty.openpty()
+        self.portName = os.ttyname(self.slave)
+        self.period = 1.0 / rate
+        self.sent = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.setDaemon(True)
+        
+    def start(self):
+        self._thread.start()
+    
+    def _loop(self):
+        while not self._stop.wait(self.period):
+            os.write(self.master, "bench" + str(self.sent) + "\n")
+            self.sent += 1
+    
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def _percentiles(values):
+    if len(values) == 0:
+        return None
+    p = np.percentile(values, [50, 90, 99, 99.9])
+    return {'p50': p[0], 'p90': p[1], 'p99': p[2], 'p99.9': p[3], 'max': float(np.max(values))}
+
+def _readExtensionStats(logFileNameBase):
+    """last row of the LoadTest extension log as dict, None if not found
+    """
+    from Extensions.LoadTest.loadtest import ExtensionLoadTest
+    fileName = logFileNameBase + "_" + ExtensionLoadTest.extensionName + ".txt"
+    try:
+        with open(fileName) as f:
+            rows = [l.strip() for l in f if l.strip() and not l.startswith('#')]
+    except IOError:
+        return None
+    if len(rows) == 0:
+        return None
+    return dict(zip(ExtensionLoadTest.logColumnHeader, [int(v) for v in rows[-1].split('\t')]))
+
+
+def runOnce(fs, channelCnt, plot, extension, serialPort, duration, logDir):
+    """runs one experiment, returns dict with results
+    """
+    config = {'fs': fs, 'channels': channelCnt, 'plot': plot, 'extension': extension, 'serial': serialPort}
+    print "Benchmark run:", config
+    
+    sampler = ProcSampler()
+    latencies = []
+    expEnded = threading.Event()
+    serialSender = None
+    
+    ExpController.pluxMac = "dummy:" + str(SEED)
+    ExpController.fs = fs
+    ExpController.configChannels(tuple("ch" + str(i+1) for i in range(channelCnt)))
+    ExpController.setMaxDuration(int(duration / 60) + 1)
+    ExpController.logDir = logDir
+    ExpController.experimentId = "bench"
+    ExpController.useLifePlot = plot
+    ExpController.reopenLifePlot = False
+    ExpController.headlessPlot = True
+    ExpController.useSerial = serialPort
+    ExpController.extensionName = "loadtest" if extension else "None"
+    ExpController.notifyExpEndFnc = expEnded.set
+    
+    ExpController.pluxOpenDevice()
+    device = ExpController.pluxDevices[0]
+    
+    if serialPort:
+        serialSender = SerialEventSender(SERIAL_EVENT_RATE)
+        ExpController.serialPort = serialSender.portName
+        ExpController.serialOpen(True)
+    
+    #name threads started by ExpController, looked up by threading.Thread when started
+    origDeviceLoop = ExpController.pluxStartDeviceLoop
+    origControlLoop = ExpController._expControlLoop
+    def deviceLoop(*args):
+        sampler.nameThread('device')
+        origDeviceLoop(*args)
+    def controlLoop(*args):
+        sampler.nameThread('logging')
+        origControlLoop(*args)
+    def blockMonitor(frameNrArr):
+        latencies.append(monotonic() - (device.tStart + frameNrArr / float(fs)))
+    ExpController.pluxStartDeviceLoop = deviceLoop
+    ExpController._expControlLoop = controlLoop
+    ExpController.blockMonitorFnc = blockMonitor
+    sampler.nameThread('main')
+    
+    try:
+        ExpController.startExperiment("b%d_%d_%d%d%d" % (fs, channelCnt, plot, extension, serialPort))
+        logFileNameBase = ExpController.logFileNameBase
+        ExpController.extensionStart()
+        
+        if plot and RealtimePlot.proc:
+            sampler.addProcess('plot', RealtimePlot.proc.pid)
+        if extension and ExpController.extInterface and ExpController.extInterface.extProcess:
+            sampler.addProcess('extension', ExpController.extInterface.extProcess.pid)
+        sampler.start()
+        if serialSender:
+            serialSender.start()
+        
+        time.sleep(WARMUP_SEC)
+        (t0, frames0) = (time.time(), ExpController.frameCnt)
+        time.sleep(duration)
+        (t1, frames1) = (time.time(), ExpController.frameCnt)
+        
+        if serialSender:
+            serialSender.stop()
+            time.sleep(0.2)     #events in transit
+        
+        ExpController.stopExperiment()
+        tStop = time.time()
+        ended = expEnded.wait(END_TIMEOUT)
+        endSec = time.time() - tStop
+        ExpController.waitForLogSaved(END_TIMEOUT)
+        saveSec = time.time() - tStop
+        
+        extProcess = ExpController.extInterface.extProcess if ExpController.extInterface else None
+        feedStats = ExpController.extInterface.bioDataFeedStats() if ExpController.extInterface else None
+        ExpController.extensionEnd()
+        if extProcess:
+            extProcess.join(10)
+        if RealtimePlot.proc:
+            RealtimePlot.proc.join(10)
+        sampler.stop()
+    finally:
+        ExpController.pluxStartDeviceLoop = origDeviceLoop
+        ExpController._expControlLoop = origControlLoop
+        ExpController.blockMonitorFnc = None
+        ExpController.serialClose()
+        ExpController.closePlot()
+        ExpController.pluxCloseDevice()
+        if serialSender:
+            serialSender.close()
+    
+    latencyArr = np.concatenate(latencies) * 1000 if latencies else np.zeros(0)
+    result = dict(config)
+    result.update({'ended': ended,
+                   'framesPerSec': (frames1 - frames0) / (t1 - t0),
+                   'frameCnt': ExpController.frameCnt,
+                   'deviceFrameCnt': device.sampleNr,
+                   'framesAfterStop': device.sampleNr - ExpController.frameCnt,     #produced after the logging thread ended
+                   'latency_ms': _percentiles(latencyArr),
+                   'loggerFramesLost': ExpController.loggerFramesLost + ExpController.gapTracker.missingFrames,    #ring overrun and gaps in the sequence
+                   'plotDroppedFrames': ExpController.plotFeed.droppedFrames if ExpController.plotFeed else 0,
+                   'endTime_sec': endSec,       #until the experiment end is notified, the log is saved in the background
+                   'saveTime_sec': saveSec})
+    if serialSender:
+        logged = len([ev for ev in ExpController.serialEventData if ev[1].startswith("bench")])
+        result['serialEvents'] = {'sent': serialSender.sent, 'logged': logged}
+    if extension:
+        result['extensionStats'] = _readExtensionStats(logFileNameBase)
+        result['extensionEventsLogged'] = len(ExpController.extensionEventData)
+        result['extensionFeed'] = feedStats
+    result.update(sampler.result())
+    return result
+
+
+def _intList(s):
+    return [int(v) for v in s.split(',')]
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="BioLink acquisition benchmark (dummy device, no GUI)")
+    parser.add_argument('--rates', type=_intList, default=list(DEFAULT_RATES), help="sample rates, comma separated")
+    parser.add_argument('--channels', type=_intList, default=list(DEFAULT_CHANNELS), help="channel counts, comma separated")
+    parser.add_argument('--plot', type=_intList, default=[0, 1], help="live plot off/on: 0,1")
+    parser.add_argument('--extension', type=_intList, default=[0, 1], help="LoadTest extension off/on: 0,1")
+    parser.add_argument('--serial', type=_intList, default=[0, 1], help="serial events off/on: 0,1 (pty, posix only)")
+    parser.add_argument('--duration', type=float, default=10, help="measured seconds per run")
+    parser.add_argument('--quick', action='store_true', help="1000 and 10000 Hz, 8 channels, 5 sec")
+    parser.add_argument('--out', default="benchmark_" + time.strftime("%Y%m%d_%H%M") + ".json", help="result file")
+    parser.add_argument('--keep-logs', action='store_true', help="keep the log files of the runs")
+    args = parser.parse_args(argv)
+    
+    if args.quick:
+        args.rates = [1000, 10000]
+        args.channels = [8]
+        args.duration = 5
+    if os.name != 'posix' and 1 in args.serial:
+        print "Serial runs need a pseudo terminal (posix), skipped."
+        args.serial = [0]
+    
+    logDir = tempfile.mkdtemp(prefix="biolink_bench_") + os.sep
+    MsgLogger.init(os.path.join(logDir, "MsgLog.txt"))
+    
+    results = []
+    try:
+        for fs in args.rates:
+            for channelCnt in args.channels:
+                for plot in args.plot:
+                    for extension in args.extension:
+                        for serialPort in args.serial:
+                            results.append(runOnce(fs, channelCnt, bool(plot), bool(extension), bool(serialPort), args.duration, logDir))
+                            print json.dumps(results[-1], sort_keys=True)
+    finally:
+        MsgLogger.close()
+        if args.keep_logs:
+            print "Logs kept in", logDir
+        else:
+            shutil.rmtree(logDir, True)
+    
+    output = {'version': ExpController.versionStr, 'date': time.strftime("%Y-%m-%d %H:%M"),
+              'platform': platform.platform(), 'python': platform.python_version(),
+              'numpy': np.__version__, 'duration_sec': args.duration, 'results': results}
+    with open(args.out, 'w') as f:
+        json.dump(output, f, indent=1, sort_keys=True)
+    print "Results written to", args.out
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
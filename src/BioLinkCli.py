@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+Headless command-line acquisition without graphical user interface, e.g. for
+unattended recordings or remote machines. The settings are loaded from the settings
+file written by the GUI, the experiment is run by ExpController directly.
+Neither Gtk nor matplotlib are imported: the live plot is disabled and an extension
+(which may use Gtk) only runs if selected with --extension, in its own process.
+Messages are written to the message log file only, use --console to print them too.
+
+usage: python BioLinkCli.py -s SUBJECT [-e EXPERIMENT] [-d MINUTES] [--settings FILE] [--logdir DIR] [--mac MAC] [--extension NAME] [--console]
+
+The experiment ends after the max. duration, on an end request (serial '#END' or
+extension) or on Ctrl+C / SIGTERM. The exit status is one of the EXIT_* codes below.
+"""
+
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+
+import MsgLogger
+import ExpController
+from SettingsModel import settingsModel
+import PreventSleep
+
+SETTINGS_FILE_PATH = "../settings.json"
+LOG_DIR = "../log/"
+versionStr = "BioLink_V1.4"
+EMERGENCY_TIMEOUT_SEC = 11      #experiment is force stopped if it did not end this long after the stop request
+
+EXIT_OK = 0
+EXIT_SETTINGS_ERROR = 1     #invalid arguments or settings file
+EXIT_DEVICE_ERROR = 2       #Plux device could not be opened
+EXIT_EXPERIMENT_ERROR = 3   #experiment ended because of an error or had to be force stopped, the log was saved anyway
+EXIT_INTERRUPTED = 4        #stopped by Ctrl+C or SIGTERM before the max. duration, the log was saved
+
+stopRequest = threading.Event()
+
+
+def _parseArgs(argv):
+    parser = argparse.ArgumentParser(description="BioLink headless acquisition")
+    parser.add_argument("-s", "--subject", required=True, help="subject id, 'nolog' runs without saving a log")
+    parser.add_argument("-e", "--experiment", help="experiment id, default from settings file")
+    parser.add_argument("-d", "--duration", type=float, help="max. duration [min], default from settings file")
+    parser.add_argument("--settings", default=SETTINGS_FILE_PATH, help="settings file written by the GUI (default: %(default)s)")
+    parser.add_argument("--logdir", default=LOG_DIR, help="directory for log files (default: %(default)s)")
+    parser.add_argument("--mac", help="Plux MAC address(es) separated by ';' or 'dummy', default from settings file")
+    parser.add_argument("--extension", default="None", help="extension to run (default: %(default)s)")
+    parser.add_argument("--console", action="store_true", help="print messages to the console too")
+    return parser.parse_args(argv)
+
+def _onSignal(signum, frame):
+    stopRequest.set()
+
+def _loadSettings(args):
+    """
+    loads the settings file and applies the command-line arguments, returns an error message or None
+    """
+    try:
+        with open(args.settings, 'r') as f:
+            settingsModel.loadSettings(f)
+    except (IOError, ValueError) as e:
+        return "Error reading settings file '" + args.settings + "': " + str(e)
+    
+    settingsDict = settingsModel.settingsDict
+    if args.experiment:
+        settingsDict['experimentId'] = args.experiment
+    if args.duration is not None:
+        if args.duration <= 0:
+            return "Error: duration must be > 0 minutes."
+        settingsDict['maxDuration'] = args.duration
+    if args.mac:
+        settingsDict['pluxMac'] = args.mac
+    settingsDict['extension'] = args.extension
+    
+    if len(ExpController.pluxMacList()) == 0:
+        return "Error: no Plux device configured."
+    
+    try:
+        ExpController.applySettings(settingsDict)
+    except ValueError as e:
+        return "Error in settings: " + str(e)
+    ExpController.useLifePlot = False   #no plot window without GUI
+    return None
+
+def runExperiment(args):
+    """returns the exit status
+    """
+    subjectId = args.subject.strip()
+    if subjectId == "":
+        MsgLogger.append("Error: subject id is empty.")
+        return EXIT_SETTINGS_ERROR
+    
+    errorMsg = _loadSettings(args)
+    if errorMsg:
+        MsgLogger.append(errorMsg)
+        return EXIT_SETTINGS_ERROR
+    
+    try:
+        ExpController.pluxOpenDevice()
+    except Exception as e:
+        MsgLogger.append("Error opening Plux device: " + str(e))
+        return EXIT_DEVICE_ERROR
+    
+    PreventSleep.preventSleep()
+    
+    if ExpController.useSerial:
+        try:
+            ExpController.serialOpen(True) 
+        except Exception as e:
+            MsgLogger.append("Error opening serial port: " + str(e))
+    
+    expEnded = threading.Event()
+    ExpController.notifyExpEndFnc = expEnded.set
+    
+    MsgLogger.append("Start experiment with Subject ID: '" + subjectId + "'")
+    ExpController.startExperiment(subjectId)
+    ExpController.extensionStart()
+    
+    #the main thread has to keep running (not blocked in wait without timeout) to receive signals
+    stopTime = None
+    forced = False
+    while not expEnded.wait(0.2):
+        if stopRequest.is_set() and stopTime is None:
+            MsgLogger.append("Stop requested")
+            ExpController.stopExperiment()
+            stopTime = time.time()
+        elif stopTime is not None and time.time() - stopTime > EMERGENCY_TIMEOUT_SEC:
+            MsgLogger.append("Experiment did not end, forcing stop")
+            ExpController.forceStopExperiment()
+            forced = True
+            break
+    
+    ExpController.extensionEnd()
+    ExpController.serialClose()
+    ExpController.pluxCloseDevice()
+    PreventSleep.allowSleep()
+    MsgLogger.append("Experiment ended")
+    
+    ExpController.waitForLogSaved()     #progress is reported by the saver thread
+    
+    if forced or ExpController.expEndError or ExpController.logSaveError:
+        return EXIT_EXPERIMENT_ERROR
+    elif stopTime is not None:
+        return EXIT_INTERRUPTED
+    return EXIT_OK
+
+def main(argv):
+    args = _parseArgs(argv)
+    
+    logDir = os.path.join(args.logdir, "")      #ensure trailing separator, file names are appended
+    if not os.path.exists(logDir):
+        os.makedirs(logDir)
+    
+    ExpController.logDir = logDir
+    ExpController.versionStr = versionStr
+    
+    MsgLogger.printToConsole = args.console
+    MsgLogger.init(logDir + "BioLink_MsgLog_" + time.strftime("%Y%m%d_%H%M") + ".txt")
+    
+    signal.signal(signal.SIGINT, _onSignal)
+    signal.signal(signal.SIGTERM, _onSignal)
+    
+    try:
+        ExpController.recoverJournals(logDir)   #sessions not saved because BioLink crashed
+        status = runExperiment(args)
+    except Exception as e:
+        MsgLogger.append("Error: " + str(e))
+        status = EXIT_EXPERIMENT_ERROR
+    
+    MsgLogger.append("Exit status: " + str(status))
+    MsgLogger.close()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
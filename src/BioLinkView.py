@@ -58,6 +58,15 @@ class Handler:
     def onMenuConvertLog(self, *args):
         Controller.convertLogToTxt()
         
+    def onMenuConvertLogEdf(self, *args):
+        Controller.convertLogToEdf()
+        
+    def onMenuConvertLogBlc(self, *args):
+        Controller.convertLogToBlc()
+        
+    def onMenuBatchConvert(self, *args):
+        Controller.batchConvertLogs()
+        
     def onMenuPlotBioLinkData(self, *args):
         Controller.plotBioLinkData()
 
@@ -106,7 +115,8 @@ class BioLinkView:
         
         #set tooltips for fields with cheats
         self.teSubjectId.set_tooltip_text("Subject ID\nTESTING: enter 'nolog' to not save a log")
-        self.tePluxMac.set_tooltip_text("MAC address of format: xx:xx:xx:xx:xx:xx\nTESTING: enter 'dummy' for dummy data")
+        self.tePluxMac.set_tooltip_text("MAC address of format: xx:xx:xx:xx:xx:xx\nSeveral devices: separate MAC addresses by ';'\nTESTING: enter 'dummy' or 'dummy:<seed>' for synthetic data (up to 10 kHz)")
+        self.teChannelNames.set_tooltip_text("Channel nr and name, e.g. 1:ECG, 2:EDA\nSeveral devices: separate channel groups by ';' in the order of the MAC addresses")
         
         #test
 #         self.teSerialPort.set_text("Com 1")
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+Native BioLink log format ('.blc'). Bio data is stored in chunks of a fixed number of
+frames, every chunk compressed on its own (zlib), so a reader can seek to any time
+range and decompresses only the chunks it needs. Event tables and other arrays are
+stored as compressed '.npy' blobs.
+
+File layout:
+    preamble: magic, offset and length of the header (uint64 each)
+    chunks and arrays, in the order written
+    header: json with frame count, channel count, chunk size and the position of every
+            array; the chunk index ('chunkIndex': offset, length, frame count per chunk)
+            is one of the arrays
+The header is written last, a file without header (writer not closed) is not readable.
+"""
+
+import io
+import json
+import multiprocessing as mp
+import struct
+import zlib
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+BLC_SUFFIX = ".blc"
+BLC_MAGIC = "BLC\x00\x00\x00\x00\x01"    #version in last byte
+CHUNK_SEC = 10                          #default duration of a chunk
+COMPRESS_LEVEL = 6                      #zlib level, same as np.savez_compressed
+COMPRESS_WORKERS = mp.cpu_count()       #threads compressing chunks in writeLog, zlib releases the GIL
+CACHED_CHUNKS = 4                       #decompressed chunks kept by the reader
+
+_preambleStruct = struct.Struct('<8sQQ')
+
+
+def _packArray(arr):
+    buf = io.BytesIO()
+    np.save(buf, np.asanyarray(arr), allow_pickle=False)
+    return zlib.compress(buf.getvalue(), COMPRESS_LEVEL)
+
+def _unpackArray(blob):
+    return np.load(io.BytesIO(zlib.decompress(blob)), allow_pickle=False)
+
+def compressChunk(dataBlock):
+    """returns the compressed bytes of a chunk of frames (uint16, little endian)
+    """
+    return zlib.compress(np.ascontiguousarray(dataBlock, '<u2').tostring(), COMPRESS_LEVEL)
+
+
+class ChunkedLogWriter:
+    """
+    Frames are appended in order with writeFrames(), blocks of any size. A chunk is compressed and
+    written as soon as it is full, the last chunk may be shorter. close() writes the header.
+    """
+    def __init__(self, path, channelCnt, chunkFrames):
+        self.path = path
+        self.channelCnt = channelCnt
+        self.chunkFrames = int(chunkFrames)
+        self.frameCnt = 0
+        self._chunkIndex = []       #(offset, length, frame count)
+        self._arrays = {}           #name: (offset, length)
+        self._pending = []          #blocks of the chunk not full yet
+        self._pendingFrames = 0
+
+        self._file = open(path, 'wb')
+        self._file.write(_preambleStruct.pack(BLC_MAGIC, 0, 0))
+
+    def _write(self, blob):
+        offset = self._file.tell()
+        self._file.write(blob)
+        return (offset, len(blob))
+
+    def writeFrames(self, dataBlock):
+        """dataBlock: array of shape (frames, channelCnt), views and memmaps can be passed
+        """
+        pos = 0
+        while pos < len(dataBlock):
+            n = min(len(dataBlock) - pos, self.chunkFrames - self._pendingFrames)
+            self._pending.append(np.array(dataBlock[pos:pos+n], np.uint16))
+            self._pendingFrames += n
+            pos += n
+            if self._pendingFrames == self.chunkFrames:
+                self._flushChunk()
+
+    def _flushChunk(self):
+        if self._pendingFrames > 0:
+            self.writeChunk(compressChunk(np.concatenate(self._pending)), self._pendingFrames)
+            self._pending = []
+            self._pendingFrames = 0
+
+    def writeChunk(self, compressedChunk, frameCnt):
+        """appends a chunk compressed by compressChunk, e.g. in a worker thread. Not to be mixed with writeFrames.
+        """
+        (offset, length) = self._write(compressedChunk)
+        self._chunkIndex.append((offset, length, frameCnt))
+        self.frameCnt += frameCnt
+
+    def writeArray(self, name, arr):
+        self._arrays[name] = self._write(_packArray(arr))
+
+    def abort(self):
+        """closes the file without header, it is not readable
+        """
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        """writes the last chunk and the header
+        returns the file path
+        """
+        if self._file:
+            self._flushChunk()
+            self.writeArray('chunkIndex', np.array(self._chunkIndex, np.int64).reshape((-1, 3)))
+            hdr = json.dumps({'frameCnt': self.frameCnt, 'channelCnt': self.channelCnt,
+                              'chunkFrames': self.chunkFrames, 'arrays': self._arrays})
+            (offset, length) = self._write(hdr)
+            self._file.seek(0)
+            self._file.write(_preambleStruct.pack(BLC_MAGIC, offset, length))
+            self._file.close()
+            self._file = None
+        return self.path
+
+
+def writeLog(path, bioData, arrays, chunkFrames, progressFnc=None):
+    """
+    writes bioData (frames x channels, e.g. memory-mapped) and the named arrays to a new '.blc' file
+    Chunks are compressed in parallel by COMPRESS_WORKERS threads and written in order.
+    progressFnc(chunks written, chunk count) is called after every chunk
+    returns the file path
+    """
+    writer = ChunkedLogWriter(path, bioData.shape[1], chunkFrames)
+    chunkFrames = writer.chunkFrames
+    chunkStarts = range(0, bioData.shape[0], chunkFrames)
+    pool = ThreadPool(COMPRESS_WORKERS)
+    try:
+        compressed = pool.imap(lambda start: compressChunk(bioData[start:start + chunkFrames]), chunkStarts)
+        for (i, blob) in enumerate(compressed):
+            writer.writeChunk(blob, min(chunkFrames, bioData.shape[0] - chunkStarts[i]))
+            if progressFnc:
+                progressFnc(i + 1, len(chunkStarts))
+        for (name, arr) in arrays.items():
+            writer.writeArray(name, arr)
+    except:
+        writer.abort()
+        raise
+    finally:
+        pool.close()
+        pool.join()
+    writer.close()
+    return path
+
+
+class ChunkedLogReader:
+    """
+    Reads a '.blc' file like np.load reads a '.npz': files lists the array names, reader[name] returns an array.
+    bioData is a ChunkedArray, only the header is read on opening.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            (magic, hdrOffset, hdrLength) = _preambleStruct.unpack(f.read(_preambleStruct.size))
+            if magic != BLC_MAGIC:
+                raise IOError("'" + path + "' is not a BioLink chunked log")
+            if hdrOffset == 0:
+                raise IOError("'" + path + "' has no header, it was not closed properly")
+            f.seek(hdrOffset)
+            hdr = json.loads(f.read(hdrLength))
+        self.frameCnt = hdr['frameCnt']
+        self.channelCnt = hdr['channelCnt']
+        self.chunkFrames = hdr['chunkFrames']
+        self._arrays = dict((str(name), tuple(pos)) for (name, pos) in hdr['arrays'].items())
+        self.files = [name for name in self._arrays if name != 'chunkIndex']
+        self.chunkIndex = self._readArray('chunkIndex')
+        self.bioData = ChunkedArray(self)
+        self._chunkCache = []       #(chunk nr, frames), most recent last
+
+    def _readBlob(self, offset, length):
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def _readArray(self, name):
+        return _unpackArray(self._readBlob(*self._arrays[name]))
+
+    def __getitem__(self, name):
+        if name not in self.files:
+            raise KeyError(name + " is not a file in the archive")
+        return self._readArray(name)
+
+    def chunk(self, chunkNr):
+        """returns the frames of chunk chunkNr (frames x channels, uint16)
+        """
+        for (nr, frames) in self._chunkCache:
+            if nr == chunkNr:
+                return frames
+        (offset, length, frameCnt) = self.chunkIndex[chunkNr]
+        frames = np.frombuffer(zlib.decompress(self._readBlob(offset, length)), '<u2').reshape((frameCnt, self.channelCnt))
+        self._chunkCache = self._chunkCache[-(CACHED_CHUNKS-1):] + [(chunkNr, frames)]
+        return frames
+
+    def readFrames(self, startFrame, endFrame):
+        """returns frames startFrame ... endFrame-1, only the chunks needed are decompressed
+        """
+        startFrame = max(startFrame, 0)
+        endFrame = min(endFrame, self.frameCnt)
+        if endFrame <= startFrame:
+            return np.zeros((0, self.channelCnt), np.uint16)
+        firstChunk = startFrame // self.chunkFrames
+        lastChunk = (endFrame - 1) // self.chunkFrames
+        parts = [self.chunk(i) for i in range(firstChunk, lastChunk + 1)]
+        frames = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        start = startFrame - firstChunk * self.chunkFrames
+        return frames[start:start + endFrame - startFrame]
+
+
+class ChunkedArray:
+    """
+    Bio data of a ChunkedLogReader, can be sliced like an array of shape (frames, channels).
+    Supported keys: int, slice, or a tuple of one of these and a channel index.
+    """
+    def __init__(self, reader):
+        self.reader = reader
+        self.shape = (reader.frameCnt, reader.channelCnt)
+        self.dtype = np.dtype(np.uint16)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        channelKey = None
+        if isinstance(key, tuple):
+            (key, channelKey) = (key[0], key[1:])
+        if isinstance(key, slice):
+            (start, stop, step) = key.indices(self.shape[0])
+            if step > 0:
+                frames = self.reader.readFrames(start, stop)[::step]
+            else:
+                frames = self.reader.readFrames(stop + 1, start + 1)[::-1][::-step]
+        else:
+            i = int(key)
+            if i < 0:
+                i += self.shape[0]
+            if not 0 <= i < self.shape[0]:
+                raise IndexError("index " + str(key) + " is out of bounds for " + str(self.shape[0]) + " frames")
+            frames = self.reader.readFrames(i, i + 1)[0]
+        if channelKey:
+            frames = frames[channelKey] if frames.ndim == 1 else frames[(slice(None),) + channelKey]
+        return frames
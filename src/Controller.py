@@ -31,7 +31,6 @@ import PluxInterface
 import MsgLogger
 import ExpController
 from SettingsModel import settingsModel
-import LogTools
 import ExtensionInterface as ei
 import PreventSleep
 
@@ -41,6 +40,7 @@ subjectId = ""
 extNameList = None
 
 _emergencyTimeoutId = None
+_quitAfterSave = False      #window was closed while a log was saved, quit when it is written
 
 
 def init(): 
@@ -59,14 +59,25 @@ def init():
     setViewSettingsFromModel()
     
     ExpController.notifyExpEndFnc = _endExperimentCallback
+    ExpController.notifyLogSavedFnc = _logSavedCallback
+    
+    #rebuild sessions that were not saved because BioLink crashed
+    ExpController.recoverJournals(ExpController.logDir)
        
 
   
 def onDeleteWindow():
+    global _quitAfterSave
+    
     #check experiments running
     if isExperimentRunning == True:
         warningDialog("Please end the current experiment before closing.")
         return True     #stops window from being destroyed
+    elif ExpController.isSavingLog():
+        _quitAfterSave = True
+        view.window.set_sensitive(False)
+        MsgLogger.append("Closing BioLink when the log is saved...")
+        return True     #closed by _logSaved
     else:
         #save settings
         updateModelWithSettings()
@@ -86,16 +97,11 @@ def startExperiment():
     if updateModelWithSettings():
         subjectId = view.teSubjectId.get_text().strip()
         
-        ExpController.configChannels(settingsModel.settingsDict['channelNames'])
-        ExpController.serialPort = settingsModel.settingsDict['serialPort']
-        ExpController.experimentId = settingsModel.settingsDict['experimentId']
-        ExpController.pluxMac = settingsModel.settingsDict['pluxMac']
-        ExpController.fs = settingsModel.settingsDict['sampleRate']     #must be set before setMaxDuration
-        ExpController.setMaxDuration( settingsModel.settingsDict['maxDuration'] )
-        ExpController.useSerial = settingsModel.settingsDict['useSerial']
-        ExpController.useLifePlot = settingsModel.settingsDict['useLifePlot'] 
-        ExpController.reopenLifePlot = settingsModel.settingsDict['reopenLifePlot']
-        ExpController.extensionName = settingsModel.settingsDict['extension']
+        try:
+            ExpController.applySettings(settingsModel.settingsDict)
+        except ValueError as e:
+            warningDialog(str(e))
+            return
         
         #open plux, abort on failure
         try:
@@ -179,6 +185,14 @@ def _endExperiment():
     
     PreventSleep.allowSleep()
     
+def _logSavedCallback(baseName, error):     #called by ExpController saver thread when the log is written
+    GLib.idle_add(_logSaved)
+    
+def _logSaved():
+    if _quitAfterSave and not ExpController.isSavingLog():
+        onDeleteWindow()
+    return False    #not executed another time
+    
 def _endExperimentDetectEmergency():
     if isExperimentRunning:     #check whether experiment has been ended, otherwise force it (recover log)
         ExpController.forceStopExperiment()
@@ -233,6 +247,17 @@ def findPluxDevices():
     MsgLogger.append(msg)
     
 def convertLogToTxt():
+    _convertLog('.txt', "Text files", 'exportTxt')
+    
+def convertLogToEdf():
+    _convertLog('.edf', "EDF+ files", 'exportEdf')
+    
+def convertLogToBlc():
+    _convertLog('.blc', "BioLink chunked logs", 'exportBlc')
+    
+def _convertLog(fileExt, fileTypeName, exportFncName):
+    """asks for a log and the destination file, the log is converted by LogTools.<exportFncName> in a separate thread
+    """
     #choose file to load
     openDialog = Gtk.FileChooserDialog("Please choose a log file", view.window,
             Gtk.FileChooserAction.OPEN,
@@ -240,7 +265,8 @@ def convertLogToTxt():
              Gtk.STOCK_OPEN, Gtk.ResponseType.OK))
     
     openFilter = Gtk.FileFilter()
-    openFilter.set_name("npz files")
+    openFilter.set_name("BioLink logs")
+    openFilter.add_pattern("*.blc")
     openFilter.add_pattern("*.npz")
     openDialog.add_filter(openFilter)
     
@@ -252,23 +278,23 @@ def convertLogToTxt():
     
     if response == Gtk.ResponseType.OK:
         openFile = openDialog.get_filename()
-        baseName = openFile[:-4]    #cut '.npz' at end
+        baseName = openFile[:-4]    #cut '.blc' or '.npz' at end
         
     openDialog.destroy()
     
     if baseName:
-        saveDialog = Gtk.FileChooserDialog("Choose location for txt file", view.window,
+        saveDialog = Gtk.FileChooserDialog("Choose location for " + fileExt[1:] + " file", view.window,
             Gtk.FileChooserAction.SAVE,
             (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
              Gtk.STOCK_SAVE, Gtk.ResponseType.OK))
         
         saveFilter = Gtk.FileFilter()
-        saveFilter.set_name("Text files")
-        saveFilter.add_pattern("*.txt")
+        saveFilter.set_name(fileTypeName)
+        saveFilter.add_pattern("*" + fileExt)
         saveDialog.add_filter(saveFilter)
         
         saveDialog.set_current_folder(ExpController.logDir)
-        saveDialog.set_current_name(os.path.basename(baseName) + '.txt')
+        saveDialog.set_current_name(os.path.basename(baseName) + fileExt)
         
         response = saveDialog.run()
         
@@ -276,19 +302,64 @@ def convertLogToTxt():
         if response == Gtk.ResponseType.OK:
             saveFile = saveDialog.get_filename()
             
-            if not saveFile[-4:] == '.txt':     #ensure name ends with '.txt'
-                saveFile = saveFile + '.txt'
+            if not saveFile[-4:] == fileExt:     #ensure name ends with fileExt
+                saveFile = saveFile + fileExt
                 
         saveDialog.destroy()
         
         if saveFile:
-            converter = threading.Thread(target=_converterThread,args=(baseName, saveFile))
+            converter = threading.Thread(target=_converterThread,args=(baseName, saveFile, exportFncName))
             converter.setDaemon(True)
             converter.start()
         
-def _converterThread(baseName, saveFile):
-    LogTools.exportTxt(baseName, saveFile)
-    MsgLogger.append("Converted '" + baseName + ".npz' to '" + saveFile + "'")
+def _converterThread(baseName, saveFile, exportFncName):
+    import LogTools     #loaded on first use, not needed at startup
+    try:
+        getattr(LogTools, exportFncName)(baseName, saveFile)
+        MsgLogger.append("Converted '" + baseName + "' to '" + saveFile + "'")
+    except Exception as e:
+        MsgLogger.append("Error converting '" + baseName + "': " + str(e))
+    
+def batchConvertLogs():
+    """asks for a log directory and the output format, all sessions in it are converted by BatchConvert in a separate thread
+    """
+    import BatchConvert
+    
+    dialog = Gtk.FileChooserDialog("Please choose a log directory", view.window,
+            Gtk.FileChooserAction.SELECT_FOLDER,
+            (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+             Gtk.STOCK_OPEN, Gtk.ResponseType.OK))
+    dialog.set_current_folder(ExpController.logDir)
+    
+    formatBox = Gtk.ComboBoxText()
+    for fmt in sorted(BatchConvert.EXPORT_FORMATS):
+        formatBox.append(fmt, "Convert to " + fmt)
+    formatBox.set_active_id('txt')
+    dialog.set_extra_widget(formatBox)
+    
+    logDir = None
+    if dialog.run() == Gtk.ResponseType.OK:
+        logDir = dialog.get_filename()
+        fmt = formatBox.get_active_id()
+    dialog.destroy()
+    
+    if logDir:
+        converter = threading.Thread(target=_batchConverterThread, args=(logDir, fmt))
+        converter.setDaemon(True)
+        converter.start()
+        
+def _batchConverterThread(logDir, fmt):
+    import BatchConvert
+    
+    def progress(result, done, total):
+        MsgLogger.append(BatchConvert.resultStr(result, done, total))
+    
+    MsgLogger.append("Batch conversion of '" + logDir + "' to " + fmt + " started")
+    try:
+        summary = BatchConvert.convertAll([logDir], fmt, progressFnc=progress)
+        MsgLogger.append(BatchConvert.summaryStr(summary))
+    except Exception as e:
+        MsgLogger.append("Error in batch conversion: " + str(e))
     
 def plotBioLinkData():
     openDialog = Gtk.FileChooserDialog("Please choose a log file", view.window,
@@ -297,7 +368,8 @@ def plotBioLinkData():
              Gtk.STOCK_OPEN, Gtk.ResponseType.OK))
     
     openFilter = Gtk.FileFilter()
-    openFilter.set_name("npz files")
+    openFilter.set_name("BioLink logs")
+    openFilter.add_pattern("*.blc")
     openFilter.add_pattern("*.npz")
     openDialog.add_filter(openFilter)
     
@@ -309,11 +381,12 @@ def plotBioLinkData():
     
     if response == Gtk.ResponseType.OK:
         openFile = openDialog.get_filename()
-        baseName = openFile[:-4]    #cut '.npz' at end
+        baseName = openFile[:-4]    #cut '.blc' or '.npz' at end
         
     openDialog.destroy()
     
     if baseName:
+        import LogTools
         LogTools.plotBioLinkData(baseName)
     
 def updateModelWithSettings():
@@ -339,6 +412,9 @@ def updateModelWithSettings():
     if success:
         if len(settingsModel.settingsDict['channelNames']) == 0:
             success = False
+        for chNames in settingsModel.settingsDict['extraChannelNames']:     #additional devices
+            if len(chNames) == 0:
+                success = False
             
     if not success:
         warningDialog("Invalid Channel Names. Please review settings.")
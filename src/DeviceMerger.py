@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+The DeviceMerger combines the frames of several Plux devices acquiring at the same
+sample rate into one stream. Every device gets its own group of channels, frames
+are aligned by their frame nr (shared timeline, all devices are started together).
+Merged frames are written to the frame sink (FrameRingBuffer) as soon as all devices
+delivered them. A device lagging more than maxLagFrames behind the others is not
+waited for, its missing frames are left zero and counted as dropped.
+The frame nr each device reached is sampled once per second together with the host
+time, so drift between devices can be estimated and corrected.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+SYNC_LOG_INTERVAL = 1.0     #sec
+
+
+class _DeviceInput:
+    """frame sink handed to a single device, see FrameBlockStager
+    """
+    def __init__(self, merger, deviceIndex):
+        self.merger = merger
+        self.deviceIndex = deviceIndex
+
+    def writeFrames(self, frameNrArr, dataBlock):
+        self.merger.writeFrames(self.deviceIndex, frameNrArr, dataBlock)
+
+    def close(self):
+        self.merger.deviceEnded(self.deviceIndex)
+
+
+class DeviceMerger:
+    def __init__(self, frameSink, channelCnts, maxLagFrames):
+        """
+        frameSink gets the merged frames, channelCnts is a list with the channel count of every device
+        """
+        self.frameSink = frameSink
+        self.channelCnts = list(channelCnts)
+        self.channelOffsets = [sum(self.channelCnts[:i]) for i in range(len(self.channelCnts))]
+        self.totalChannelCnt = sum(self.channelCnts)
+        self.maxLagFrames = maxLagFrames
+        deviceCnt = len(self.channelCnts)
+
+        self._lock = threading.Lock()
+        self._pending = [[] for i in range(deviceCnt)]     #blocks received but not merged yet
+        self._latest = [-1] * deviceCnt        #highest frame nr received per device
+        self._running = [True] * deviceCnt
+        self._merged = 0                        #frames written to frameSink
+
+        #statistics
+        self.droppedFrames = [0] * deviceCnt    #frames left zero in merged stream
+        self.lateFrames = [0] * deviceCnt       #frames arriving after they were merged already
+        self.maxLag = [0] * deviceCnt           #max frames behind the leading device
+        self.firstFrameTime = [None] * deviceCnt
+        self.syncLog = []       #rows of (host time, latest frame nr of every device)
+        self._lastSyncLogTime = 0.0
+
+    def deviceSink(self, deviceIndex):
+        return _DeviceInput(self, deviceIndex)
+
+    def writeFrames(self, deviceIndex, frameNrArr, dataBlock):
+        now = time.time()
+        with self._lock:
+            #devices reuse their staging block, keep a copy
+            self._pending[deviceIndex].append((frameNrArr.astype(np.int64), dataBlock.copy()))
+            self._latest[deviceIndex] = max(self._latest[deviceIndex], int(frameNrArr[-1]))
+            if self.firstFrameTime[deviceIndex] is None:
+                self.firstFrameTime[deviceIndex] = now
+
+            leader = max(self._latest)
+            for i in range(len(self._latest)):
+                self.maxLag[i] = max(self.maxLag[i], leader - self._latest[i])
+
+            if min(self._latest) >= 0 and now - self._lastSyncLogTime >= SYNC_LOG_INTERVAL:     #all devices started
+                self.syncLog.append([now] + self._latest)
+                self._lastSyncLogTime = now
+
+            self._mergeAvailable()
+
+    def deviceEnded(self, deviceIndex):
+        """device delivers no more frames, it is not waited for anymore. The frame sink is closed after the last device ended.
+        """
+        with self._lock:
+            self._running[deviceIndex] = False
+            if not any(self._running):
+                self._merge(max(self._latest) + 1)      #flush everything
+                self.frameSink.close()
+            else:
+                self._mergeAvailable()
+
+    def _mergeAvailable(self):
+        leader = max(self._latest)
+        waitFor = [self._latest[i] for i in range(len(self._latest))
+                   if self._running[i] and leader - self._latest[i] <= self.maxLagFrames]
+        self._merge(min(waitFor) + 1 if waitFor else leader + 1)
+
+    def _merge(self, endFrameNr):
+        """writes merged frames up to endFrameNr (exclusive) to the frame sink
+        """
+        n = endFrameNr - self._merged
+        if n <= 0:
+            return
+
+        merged = np.zeros((n, self.totalChannelCnt), np.uint16)
+        for i in range(len(self._pending)):
+            received = np.zeros(n, bool)
+            chStart = self.channelOffsets[i]
+            chEnd = chStart + self.channelCnts[i]
+            keep = []
+            for (frameNrArr, dataBlock) in self._pending[i]:
+                late = frameNrArr < self._merged
+                now = (frameNrArr < endFrameNr) & ~late
+                self.lateFrames[i] += int(np.count_nonzero(late))
+
+                rows = frameNrArr[now] - self._merged
+                merged[rows, chStart:chEnd] = dataBlock[now]
+                received[rows] = True
+
+                later = frameNrArr >= endFrameNr
+                if later.any():
+                    keep.append((frameNrArr[later], dataBlock[later]))
+            self._pending[i] = keep
+            self.droppedFrames[i] += n - int(np.count_nonzero(received))
+
+        self.frameSink.writeFrames(np.arange(self._merged, endFrameNr, dtype=np.uint32), merged)
+        self._merged = endFrameNr
+
+    def syncLogArray(self):
+        """returns the sync log as array with one row per sample: host time, frame nr of every device
+        """
+        with self._lock:
+            return np.array(self.syncLog, np.float64).reshape((-1, 1 + len(self.channelCnts)))
+
+    def summary(self, deviceNames):
+        """returns a list with one dict per device for the log header
+        """
+        syncLog = self.syncLogArray()
+        t0 = self.firstFrameTime[0]
+        summ = []
+        for i in range(len(self.channelCnts)):
+            d = {'device': deviceNames[i], 'channelOffset': self.channelOffsets[i], 'channelCnt': self.channelCnts[i],
+                 'droppedFrames': self.droppedFrames[i], 'lateFrames': self.lateFrames[i], 'maxLag_frames': self.maxLag[i]}
+            if t0 is not None and self.firstFrameTime[i] is not None:
+                d['firstFrameDelay_sec'] = self.firstFrameTime[i] - t0     #relative to first device
+            if syncLog.shape[0] >= 2 and i > 0:
+                #frames device i is ahead of device 0 grow by this many per second of host time
+                slope = np.polyfit(syncLog[:,0] - syncLog[0,0], syncLog[:,1+i] - syncLog[:,1], 1)[0]
+                d['driftToFirst_framesPerSec'] = float(slope)
+            summ.append(d)
+        return summ
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+EdfWriter streams bio data into an EDF+ file (European Data Format, 16 bit samples,
+see edfplus.info). Data records are formatted and written chunk by chunk, so memory
+does not depend on the length of the recording.
+Raw sample values (0..65535) are stored unscaled: physical range 0..65535 is mapped
+to the digital range -32768..32767. Events are stored as EDF+ annotations in the
+'EDF Annotations' signal, every record starts with its time-keeping annotation.
+"""
+
+import numpy as np
+
+EDF_HEADER_BYTES = 256          #fixed part, plus 256 bytes per signal
+EDF_MAX_RECORD_BYTES = 61440    #recommended max. size of a data record
+RECORD_DURATIONS = (1.0, 0.5, 0.2, 0.1, 0.05, 0.02, 0.01)  #sec, tried in this order
+MIN_ANNOTATION_BYTES = 32       #room for the time-keeping annotation of records without events
+ANNOTATION_LABEL = "EDF Annotations"
+RECORD_CNT_OFFSET = 236         #position of the number of data records in the header
+WRITE_CHUNK_RECORDS = 60        #records formatted and written at once
+
+
+def _field(value, width):
+    """value as left-aligned ASCII field of width characters, cut if too long
+    """
+    s = "".join(c if 32 <= ord(c) < 127 else '_' for c in str(value))
+    return s[:width].ljust(width)
+
+def _subfield(value):
+    """value as EDF+ patient/recording subfield: no spaces, 'X' if unknown
+    """
+    s = str(value).strip().replace(" ", "_") if value is not None else ""
+    return s if s else "X"
+
+def _onsetStr(sec):
+    """onset of an annotation, e.g. '+12.5'
+    """
+    return ("%+.6f" % sec).rstrip('0').rstrip('.')
+
+def _tal(onset, text, duration=None):
+    """time-stamped annotation list with a single annotation
+    """
+    for c in ("\x00", "\x14", "\x15"):
+        text = text.replace(c, "")
+    tal = _onsetStr(onset)
+    if duration is not None:
+        tal = tal + "\x15" + ("%.6f" % duration).rstrip('0').rstrip('.')
+    return tal + "\x14" + text + "\x14\x00"
+
+def _timeKeepingTal(onset):
+    return _onsetStr(onset) + "\x14\x14\x00"
+
+def recordDuration(fs, channelCnt):
+    """longest duration of RECORD_DURATIONS with an integer number of samples per record,
+    shorter durations are used if a record would exceed EDF_MAX_RECORD_BYTES.
+    returns (duration [sec], samples per record)
+    """
+    fitting = []
+    for d in RECORD_DURATIONS:
+        samples = fs * d
+        if samples >= 1 and abs(samples - round(samples)) < 1e-6:
+            fitting.append((d, int(round(samples))))
+    if not fitting:
+        raise ValueError("EDF+: no record duration with an integer number of samples at " + str(fs) + " Hz")
+    for (d, samples) in fitting:
+        if samples * channelCnt * 2 + MIN_ANNOTATION_BYTES <= EDF_MAX_RECORD_BYTES:
+            return (d, samples)
+    return fitting[-1]
+
+
+class EdfWriter:
+    """
+    Writes an EDF+C file (continuous recording, gaps are left in the data and can be annotated).
+    annotations: list of (onset [sec], duration [sec] or None, text), onsets within the data written.
+    writeFrames() takes blocks of any size, close() pads the last record with zeros and writes the record count.
+    """
+    def __init__(self, path, labels, fs, annotations=(), patientId=None, recordingId=None, startTime=None):
+        """startTime: time.struct_time of the recording start, unknown if None
+        """
+        self.path = path
+        self.channelCnt = len(labels)
+        self.fs = fs
+        (self.recordDuration, self.recordSamples) = recordDuration(fs, self.channelCnt)
+        self.recordCnt = 0
+        self._pending = np.zeros((0, self.channelCnt), np.uint16)      #frames not filling a complete record yet
+        
+        #annotations of every record, sorted by onset
+        self._recordTals = {}
+        for (onset, duration, text) in sorted(annotations, key=lambda a: a[0]):
+            recordIndex = max(0, int(onset // self.recordDuration))
+            self._recordTals[recordIndex] = self._recordTals.get(recordIndex, "") + _tal(onset, text, duration)
+        annotationBytes = MIN_ANNOTATION_BYTES
+        for (recordIndex, tals) in self._recordTals.items():
+            annotationBytes = max(annotationBytes, len(_timeKeepingTal(recordIndex * self.recordDuration)) + len(tals))
+        self.annotationSamples = (annotationBytes + 1) // 2     #2 bytes per sample
+        self.dataBytes = self.recordSamples * self.channelCnt * 2
+        self.recordBytes = self.dataBytes + self.annotationSamples * 2
+        
+        self._file = open(path, 'wb')
+        self._file.write(self._header(labels, patientId, recordingId, startTime))
+        
+    def _header(self, labels, patientId, recordingId, startTime):
+        signalCnt = self.channelCnt + 1
+        if startTime is not None and 1985 <= startTime.tm_year <= 2084:
+            startDate = "%02d.%02d.%02d" % (startTime.tm_mday, startTime.tm_mon, startTime.tm_year % 100)
+            startClock = "%02d.%02d.%02d" % (startTime.tm_hour, startTime.tm_min, startTime.tm_sec)
+            recordingDate = "%02d-%s-%04d" % (startTime.tm_mday, ("JAN","FEB","MAR","APR","MAY","JUN","JUL","AUG","SEP","OCT","NOV","DEC")[startTime.tm_mon - 1], startTime.tm_year)
+        else:
+            startDate = "01.01.85"
+            startClock = "00.00.00"
+            recordingDate = "X"
+        
+        hdr = "0".ljust(8)
+        hdr += _field(_subfield(patientId) + " X X X", 80)
+        hdr += _field("Startdate " + recordingDate + " " + _subfield(recordingId) + " X BioLink", 80)
+        hdr += startDate + startClock
+        hdr += _field(EDF_HEADER_BYTES * (signalCnt + 1), 8)
+        hdr += _field("EDF+C", 44)
+        hdr += _field(-1, 8)        #record count, written on close
+        hdr += _field("%g" % self.recordDuration, 8)
+        hdr += _field(signalCnt, 4)
+        
+        allLabels = list(labels) + [ANNOTATION_LABEL]
+        isData = [True] * self.channelCnt + [False]
+        hdr += "".join(_field(label, 16) for label in allLabels)
+        hdr += "".join(_field("", 80) for label in allLabels)                          #transducer
+        hdr += "".join(_field("raw" if d else "", 8) for d in isData)                  #physical dimension
+        hdr += "".join(_field(0 if d else -1, 8) for d in isData)                      #physical min
+        hdr += "".join(_field(65535 if d else 1, 8) for d in isData)                   #physical max
+        hdr += "".join(_field(-32768, 8) for d in isData)                              #digital min
+        hdr += "".join(_field(32767, 8) for d in isData)                               #digital max
+        hdr += "".join(_field("", 80) for label in allLabels)                          #prefiltering
+        hdr += "".join(_field(self.recordSamples if d else self.annotationSamples, 8) for d in isData)
+        hdr += "".join(_field("", 32) for label in allLabels)                          #reserved
+        return hdr
+    
+    def writeFrames(self, dataBlock):
+        """dataBlock: uint16 array of shape (frames, channelCnt), views and memmaps can be passed
+        """
+        if len(self._pending):
+            dataBlock = np.concatenate((self._pending, dataBlock))
+        fullRecords = len(dataBlock) // self.recordSamples
+        for start in range(0, fullRecords, WRITE_CHUNK_RECORDS):
+            end = min(start + WRITE_CHUNK_RECORDS, fullRecords)
+            self._writeRecords(dataBlock[start*self.recordSamples:end*self.recordSamples])
+        self._pending = np.array(dataBlock[fullRecords*self.recordSamples:], np.uint16)
+        
+    def _writeRecords(self, dataBlock):
+        """dataBlock contains complete records only
+        """
+        n = len(dataBlock) // self.recordSamples
+        records = np.zeros((n, self.recordBytes), np.uint8)
+        
+        #samples are stored signal by signal within a record
+        samples = (dataBlock.astype(np.int32) - 32768).astype('<i2')
+        samples = samples.reshape((n, self.recordSamples, self.channelCnt)).transpose(0, 2, 1)
+        records[:, :self.dataBytes] = np.ascontiguousarray(samples).view(np.uint8).reshape((n, self.dataBytes))
+        
+        for i in range(n):
+            recordIndex = self.recordCnt + i
+            tals = _timeKeepingTal(recordIndex * self.recordDuration) + self._recordTals.get(recordIndex, "")
+            records[i, self.dataBytes:self.dataBytes+len(tals)] = np.frombuffer(tals, np.uint8)
+        
+        self._file.write(records.tostring())
+        self.recordCnt += n
+        
+    def close(self):
+        """writes the last (padded) record and the final record count
+        """
+        if self._file:
+            if len(self._pending):
+                padded = np.zeros((self.recordSamples, self.channelCnt), np.uint16)
+                padded[:len(self._pending)] = self._pending
+                self._writeRecords(padded)
+                self._pending = self._pending[:0]
+            self._file.seek(RECORD_CNT_OFFSET)
+            self._file.write(_field(self.recordCnt, 8))
+            self._file.close()
+            self._file = None
+        return self.path
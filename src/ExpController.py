@@ -26,19 +26,28 @@ or the serial interface.
 import numpy as np
 
 import threading
-from multiprocessing import Pipe
 import time
 import csv
 #import winsound
 import serial
 import serial.tools.list_ports
 import os
+import sys
 import json
+import Queue
 from random import randint
 
 import PluxInterface
-import RealtimePlot
 import MsgLogger
+from TimeBase import monotonic, SampleClockModel
+import SerialFraming
+from FrameRingBuffer import FrameRingBuffer
+from DeviceMerger import DeviceMerger
+from FrameGaps import GapTracker
+from StreamRecording import StreamRecording
+import ChunkedLog
+import SessionJournal
+import SessionCatalog
 from ExtensionInterface import ExtensionInterfaceFrontend
 
 
@@ -46,7 +55,7 @@ from ExtensionInterface import ExtensionInterfaceFrontend
 versionStr = "V1.1"
 
 #plux configuration
-pluxMac = "00:07:80:79:6F:E0"   # MAC address of device
+pluxMac = "00:07:80:79:6F:E0"   # MAC address of device, several devices separated by ';' 
 fs = 1000
 
 maxDurationFrames = 3600 * fs   #init value: 1hr
@@ -58,15 +67,35 @@ MAX_EXTENSION_EVENT_STR_LEN = 32
 
 channelHeader = ["ecg","eda","bvp"]
 channelMask = 0x07  #only channels 1,2,3
+channelGroups = [0x07]  #channel mask per device, channelHeader contains the channels of all devices in this order
+MAX_DEVICE_LAG_SEC = 2  #several devices: frames of a device lagging more are not waited for
 
 bitsResolution = 16
 
+#frame blocks written by device thread to the ring buffer shared with logging thread, plot and extension
+frameBlockSize = 50         #frames per block
+frameBlockMaxDelay = 0.05   #sec, max delay until a partially filled block is written
+RING_BUFFER_SEC = 30        #consumers may lag this long behind the device before frames are lost
+
+#stream recording: bio data is written to a memory-mapped file during the experiment
+STREAM_CHUNK_SEC = 60       #file grows by chunks of this duration
+STREAM_FILE_SUFFIX = "_bioData.npy"
+
+#log file format: "blc" (ChunkedLog, chunks compressed independently) or "npz" (np.savez_compressed)
+LOG_FORMATS = ("blc", "npz")
+
+#journal: crash-safe append-only copy of frames and events, deleted when the log was saved
+JOURNAL_RECOVERED_SUFFIX = "_recovered"
+
 #serial port
 if os.name == 'nt':
     serialPort = "COM1"     #"\\\\.\\COM1"  #on Windows
 else:
     serialPort = '/dev/ttyUSB0'    #on mac OS X / Linux
 serialBaud = 115200
+SERIAL_READ_TIMEOUT = 0.1       #sec, serial reader thread checks for stop requests in this interval
+SERIAL_RECONNECT_INTERVAL = 1.0 #sec
+SERIAL_EVENT_QUEUE_SIZE = 1000  #events received but not logged yet
 
 #plot
 PLOT_RANGE_SEC = 10   #seconds
@@ -74,12 +103,20 @@ plotRefreshRate = 1 #per seconds
 
 
 #global variables
-pluxDevice = None
+pluxDevices = []    #one opened device per MAC address in pluxMac
+pluxDevicesLock = threading.Lock()
+deviceMerger = None     #merges frames of several devices
+gapTracker = None       #detects frames missing in the sequence received
+loggerFramesLost = 0    #frames the logging thread lost because it fell behind the device (ring buffer overrun)
+clockModel = None       #host time to frame nr, fed with block arrival times
 logRawFile = None
 logRawCsvWriter = None
 ser = None
 isSerialOpen = threading.Event()
-stopSerialReconnectThread = threading.Event()
+stopSerialReaderThread = threading.Event()
+serialEventQueue = Queue.Queue(SERIAL_EVENT_QUEUE_SIZE)     #(arrival time, event str) from serial reader thread to logging thread
+serialEventsDropped = 0     #events lost because serialEventQueue was full
+acquisitionStartTime = 0.0  #monotonic time of experiment start
 # plotT = None
 # plotEcg = None
 # PlotEda = None
@@ -87,13 +124,23 @@ stopSerialReconnectThread = threading.Event()
 nolog = False
 endLogging = threading.Event()
 notifyExpEndFnc = None    #function to notify gui that logging ended for whatever reason, the function should close serial and plux
-deviceThread = None
+notifyLogSavedFnc = None  #called by the saver thread with (log base name, error message or None) when the log is written
+deviceThreads = []
 logThread = None
-serialReconnectThread = None
-tmpEventStr = ""
+serialReaderThread = None
+serialFraming = SerialFraming.DelimitedFraming(None, "\n")    #parser for serial events, see setSerialFraming
+serialSubjectIdFraming = SerialFraming.DelimitedFraming("#ID:", "\n")
+frameRing = None
+plotFeed = None     #min/max envelopes to the live plot process, see RealtimePlot.PlotFeed
 startTime = None
 logFileNameBase = None
 extInterface = None
+journal = None
+saverThreads = []       #background threads writing logs of ended experiments, see _safeLog
+logSaveError = None     #error message of the last log that could not be saved, None if all were saved
+_saveLock = threading.Lock()
+_sessionSaved = False   #log of the current session was handed to a saver thread already
+SAVE_PROGRESS_INTERVAL = 2.0    #sec between progress messages of the saver thread
 
 #to be set from other module
 versionStr = ""     
@@ -103,21 +150,31 @@ experimentId = ""
 useSerial = True
 useLifePlot = True
 reopenLifePlot = True
+headlessPlot = False    #live plot without window, see RealtimePlot.PlotConfig.headless
+streamToDisk = False
+logFormat = "blc"
+useJournal = True
+journalFsyncInterval = 1.0  #sec
 extensionName = "None"
+blockMonitorFnc = None      #called by the logging thread with the frame nr array of every logged block, e.g. by Benchmark
+expEndError = None          #message of the error that ended the last experiment, None if it ended regularly
 
 
 #logged data
-bioData = None     #np.array preallocated for max duration
-serialEventData = None    #list of tuples with frame nr and event string (serial events)
+bioData = None     #np.array preallocated for max duration or StreamRecording
+serialEventData = None    #list of tuples with frame nr, event string, fractional frame nr and arrival time [sec since acquisitionStartTime] (serial events)
 extensionEventData = None   #list of tuples with frame nr and event string
 frameCnt = 0
 
 
+def pluxMacList():
+    return [mac.strip() for mac in pluxMac.split(';') if mac.strip() != ""]
+
 def pluxOpenDevice():
     """Raises exception on failure
-    openes plux device unless device with same mac address is already open
+    openes all plux devices in pluxMac, one channel group (see configChannels) is needed per device
     """
-    global pluxDevice,pluxMac
+    global pluxDevices
     
     pluxCloseDevice()
     
@@ -125,47 +182,76 @@ def pluxOpenDevice():
     closePlot()     #close old plot if any
     time.sleep(0.1) #dirty: quick sleep to wait for plot process to be cleaned up
     
-    pluxDevice = PluxInterface.openDevice(pluxMac)    # MAC address of device
-    props = pluxDevice.getProperties()
-    MsgLogger.append('Plux Device: ' + str(props))
-    MsgLogger.append("Plux Device Battery: " + pluxDevice.getBatteryStr())
+    macList = pluxMacList()
+    if len(macList) != len(channelGroups):
+        raise Exception(str(len(macList)) + " Plux device(s) but " + str(len(channelGroups)) + " channel group(s) configured.")
+    
+    try:
+        for mac in macList:
+            device = PluxInterface.openDevice(mac)    # MAC address of device
+            pluxDevices.append(device)
+            props = device.getProperties()
+            MsgLogger.append('Plux Device: ' + str(props))
+            MsgLogger.append("Plux Device Battery: " + device.getBatteryStr())
+    except:
+        pluxCloseDevice()   #do not keep some of the devices open
+        raise
 
 
-def pluxStartDeviceLoop(pipeEnd):
-    global pluxDevice
-#     print pipeEnd
-    pluxDevice.stopRequest.clear()
-    pluxDevice.pipeConn = pipeEnd
-    pluxDevice.start(fs, channelMask, bitsResolution)   # 1000 Hz, ports 1-8, 16 bits                
-    pluxDevice.loop()   #blocks 
+def pluxStartDeviceLoop(device, frameSink, deviceChannelMask):
+    """runs in its own thread for every device
+    """
+    device.frameSink = frameSink
+    device.blockSize = frameBlockSize
+    device.blockMaxDelay = frameBlockMaxDelay
+    device.start(fs, deviceChannelMask, bitsResolution)   # 1000 Hz, ports 1-8, 16 bits                
+    device.loop()   #blocks 
+    frameSink.close()
     print "Plux device loop terminated"
-    pluxDevice.stop()
-    pluxCloseDevice()
+    device.stop()
+    _pluxCloseOneDevice(device)
+    
+def _pluxCloseOneDevice(device):
+    with pluxDevicesLock:
+        if device in pluxDevices:
+            pluxDevices.remove(device)
+            MsgLogger.append("Plux Device Battery: " + device.getBatteryStr())
+            device.close()
     
 def pluxCloseDevice():
-    global pluxDevice
-    if pluxDevice:
-        MsgLogger.append("Plux Device Battery: " + pluxDevice.getBatteryStr())
-        pluxDevice.close()
-        del pluxDevice
-    pluxDevice = None
-    
-def configChannels(channelNames):
+    """closes all opened devices
+    """
+    for device in list(pluxDevices):
+        _pluxCloseOneDevice(device)
+        
+def pluxEndAquisition():
+    for device in list(pluxDevices):
+        device.endAquisition()
+    
+def configChannels(channelNames, extraChannelNames=()):
     """tuple of channel names for used channels, "" for unused channels
+    extraChannelNames contains one such tuple for every additional device
     """
     global channelHeader
     global channelMask
+    global channelGroups
     
     channelHeader = []
-    channelMask = 0
-    index = 0
+    channelGroups = []
     
-    for name in channelNames:
-        if name != "":
-            channelHeader.append(name)
-            channelMask |= 0x01 << index
+    for deviceChannelNames in [channelNames] + list(extraChannelNames):
+        mask = 0
+        index = 0
+        
+        for name in deviceChannelNames:
+            if name != "":
+                channelHeader.append(name)
+                mask |= 0x01 << index
+            
+            index += 1
+        channelGroups.append(mask)
         
-        index += 1
+    channelMask = channelGroups[0]
 
 def serialOpen(exceptionOnError):
     """returns True on success
@@ -187,109 +273,142 @@ def serialOpen(exceptionOnError):
         return False
         
 def serialClose():
-    global ser,isSerialOpen,tmpEventStr
+    global ser,isSerialOpen
     if ser:
         ser.close()
         ser = None
-        tmpEventStr = ""
+        serialFraming.reset()     #partially received events are discarded
+        serialSubjectIdFraming.reset()
         isSerialOpen.clear()
         
+def setSerialFraming(spec):
+    """sets the framing of serial events, see SerialFraming.FRAMING_HELP. Raises ValueError if spec is invalid.
+    """
+    global serialFraming
+    serialFraming = SerialFraming.createFraming(spec)
+        
 def serialEnumPorts():
     l = list( serial.tools.list_ports.comports() )
     l.sort()
     return l
 
-def _serialReconnectLoop():
-    global stopSerialReconnectThread
-    while not stopSerialReconnectThread.is_set():
-        if not isSerialOpen.is_set():
-            serialOpen(False)
-        time.sleep(1)       #check every second
-
-def serialStartReconnectThread():
-    global stopSerialReconnectThread,serialReconnectThread
-    stopSerialReconnectThread.clear()
-    serialReconnectThread = threading.Thread(target=_serialReconnectLoop)
-    serialReconnectThread.start()
-    
-
-def _serialAssembleEvent(buf,startSeq=None,endSeq="\n"):
-    """assemble event string parts until \n received
-    to be called iteratively with received buffers
-    returns None unless a event is found in between startSeq and endSeq
-    event string is returned not containing startSeq or endSeq
+def _serialQueueEvent(event, arrivalTime):
+    global serialEventsDropped
+    try:
+        serialEventQueue.put((arrivalTime, event), False)   #not blocking
+    except Queue.Full:
+        serialEventsDropped += 1
+        
+def _serialReaderLoop():
     """
-    global tmpEventStr
-    startIndex = 0
-    startStrLen = 0
-    retval = None
-    
-    tmpEventStr = tmpEventStr + buf
-    print "tmpEventStr before: '" + repr(tmpEventStr) + "'" 
+    runs in its own thread during the experiment, blocks on the serial port and
+    passes received events with their arrival time (monotonic) to the logging thread through serialEventQueue.
+    Reconnects if the port was lost, "#noconn" and "#reconn" are passed as events.
+    """
+    connected = True    #assume serial is connected, produces #noconn event on first failure otherwise
+    configuredPort = None
     
-    if startSeq:
-        startStrLen = len(startSeq)
-        startIndex = tmpEventStr.find(startSeq)
-        
-    if startIndex >= 0:     #not -1, start found
-        endIndex = tmpEventStr.find(endSeq,startIndex)
-        print "startIndex", startIndex
+    while not stopSerialReaderThread.is_set():
+        port = ser
+        if not isSerialOpen.is_set() or port is None:
+            if serialOpen(False):
+                if not connected:
+                    MsgLogger.append("Serial port reconnected.")
+                    _serialQueueEvent("#reconn", monotonic())
+                    connected = True
+            else:
+                stopSerialReaderThread.wait(SERIAL_RECONNECT_INTERVAL)
+            continue
         
-        if endIndex >= 0:   #not -1, end found
-            print "endIndex", endIndex
-            retval = tmpEventStr[startIndex+startStrLen:endIndex]     #event string without start or end sequence
-            if len(retval) > MAX_SERIAL_EVENT_STR_LEN:
-                retval = retval[0:MAX_SERIAL_EVENT_STR_LEN-1]      #truncate string if too long
-            tmpEventStr = tmpEventStr[endIndex+len(endSeq) :]        #remove current event but safe rest (if there was more in buf)
-    print "tmpEventStr after: '" + repr(tmpEventStr) + "'" 
+        try:
+            if port is not configuredPort:
+                port.timeout = SERIAL_READ_TIMEOUT
+                configuredPort = port
+            buf = port.read(max(1, port.inWaiting()))     #blocks until data arrived or timeout
+            arrivalTime = monotonic()
+            
+            for event in serialFraming.feed(buf):     #all events completed
+                if event:   #empty events are ignored
+                    _serialQueueEvent(_serialTruncateEvent(event), arrivalTime)
+        except Exception:
+            if stopSerialReaderThread.is_set():
+                break       #port closed at experiment end
+            MsgLogger.append("No connection to serial port.")
+            #append comment to log, also when reconnected
+            _serialQueueEvent("#noconn", monotonic())
+            serialClose()
+            connected = False
     
-    return retval
+    if configuredPort is not None and configuredPort is ser:
+        try:
+            configuredPort.timeout = 0      #non-blocking again, serialReceiveSubjectId is polled from the GUI main loop
+        except Exception:
+            pass    #port lost, reopened with timeout=0 by serialOpen
+    
+def _serialStartReaderThread():
+    global serialReaderThread
+    stopSerialReaderThread.clear()
+    serialReaderThread = threading.Thread(target=_serialReaderLoop)
+    serialReaderThread.setDaemon(True)
+    serialReaderThread.start()
+    
+def _serialStopReaderThread():
+    stopSerialReaderThread.set()
+    if serialReaderThread:
+        serialReaderThread.join(2 * SERIAL_READ_TIMEOUT + 1)
+    
+
+def _serialTruncateEvent(event):
+    if len(event) > MAX_SERIAL_EVENT_STR_LEN:
+        event = event[0:MAX_SERIAL_EVENT_STR_LEN-1]      #truncate string if too long
+    return event
 
 def _serialHandleSpecialEvents(event):
     if event == "#END":
         stopExperiment()
 
+def _appendSerialEvent(frameNr, event, framePos, arrivalSec):
+    serialEventData.append((frameNr, event, framePos, arrivalSec))
+    if journal:
+        journal.appendSerialEvent(frameNr, event)
+        
+def _appendExtensionEvent(frameNr, event):
+    extensionEventData.append((frameNr, event))
+    if journal:
+        journal.appendExtensionEvent(frameNr, event)
+
 def serialCheckEvent(curFrameNr):
-    """detects serial events of the structure "test message\n". messages should always be terminated by '\n'
+    """logs the serial events received by the serial reader thread since the last call at curFrameNr.
+        events have the structure "test message\n". messages should always be terminated by '\n'
         supported commands:
         "#END\n"
         
+        no serial I/O is done here, see _serialReaderLoop
         returns True on detected event
     """
-    #assemble event strings, save start position, end event: call stopExperiment
-    global ser,isSerialOpen,serialEventData
-    
     retval = False
     
-    if isSerialOpen.is_set():     #serial interface initialized
-        if not serialCheckEvent.oldIsSerialOpen:
-            MsgLogger.append("Serial port reconnected.")
-            serialEventData.append((curFrameNr, "#reconn"))
-            serialCheckEvent.oldIsSerialOpen = True
+    while True:     #get all events queued
         try:
-            buf = ser.read(50)      #read max 50 bytes
-            if len(buf) > 0:    #anything new arrived
-                while True:     #get all events available
-                    event = _serialAssembleEvent(buf)
-                    if event:   #not None
-                        serialEventData.append((curFrameNr, event))
-                        MsgLogger.append("Serial event at frame nr " + str(curFrameNr) + ": '" + event + "'")
-                        _serialHandleSpecialEvents(event)
-                        retval = True
-                        buf = ""        #empty buf so it is not appended again in next loop cycle
-                    else:
-                        break   #break when no more events available
-        except:
-            MsgLogger.append("No connection to serial port.")
-            #append comment to log, also when reconnected
-            serialEventData.append((curFrameNr, "#noconn"))
-            serialClose()
-            serialCheckEvent.oldIsSerialOpen = False    #so reconnect can be detected
+            (arrivalTime, event) = serialEventQueue.get(False)     #not blocking
+        except Queue.Empty:
+            break
+        
+        #frame arriving at the same time as the event, curFrameNr until enough blocks arrived for the clock model
+        arrivalSec = arrivalTime - acquisitionStartTime
+        framePos = clockModel.frameAt(arrivalSec)
+        if framePos is None:
+            framePos = float(curFrameNr)
+        frameNr = max(0, int(round(framePos)))
+        
+        _appendSerialEvent(frameNr, event, framePos, arrivalSec)
+        if not event.startswith("#") or event == "#END":      #connection state is reported by the reader thread
+            MsgLogger.append("Serial event at frame nr " + str(frameNr) + ": '" + event + "'")
+        _serialHandleSpecialEvents(event)
+        retval = True
             
     return retval
 
-serialCheckEvent.oldIsSerialOpen = True
-
 def serialReceiveSubjectId():
     """ to be called in a loop until return value is not ""
         subject id should be transmitted in format:
@@ -303,27 +422,25 @@ def serialReceiveSubjectId():
         buf = ser.read(20)  #read max 20 bytes
         
         if len(buf) > 0:
-            sId = _serialAssembleEvent(buf,"#ID:","\n")
-            if sId:
-                return sId
+            for sId in serialSubjectIdFraming.feed(buf):
+                if sId:
+                    return _serialTruncateEvent(sId)
          
     return ""
     
 serialReceiveSubjectId.iterCnt = 0
 
 def _serialTest():
+    _serialStartReaderThread()
     while True:
-        event = serialCheckEvent()
-        if event != '-':
-            print "Event: " + event
-        
-        time.sleep(0.1)
+        (arrivalTime, event) = serialEventQueue.get()
+        print "Event at " + str(arrivalTime) + ": " + event
         
 def extensionStart():
     global extInterface
     
     #init ExtensionInterface and open extension
-    extInterface = ExtensionInterfaceFrontend(subjectId, experimentId, logDir, startTime, logFileNameBase, channelHeader, fs, nolog)
+    extInterface = ExtensionInterfaceFrontend(subjectId, experimentId, logDir, startTime, logFileNameBase, channelHeader, fs, nolog, frameRing)
     if extInterface.selectExtensionByName(extensionName):
         extInterface.extensionStart()
     else:
@@ -354,80 +471,335 @@ def extensionCheckEvent(curFrameNr):
                     if len(e) > MAX_EXTENSION_EVENT_STR_LEN:
                         e = e[0:MAX_EXTENSION_EVENT_STR_LEN-1]      #truncate string if too long
                         
-                    extensionEventData.append((frameNr, e))     #the list is not necessarily sorted for frameNr. needs to be sorted after experiment ended!
+                    _appendExtensionEvent(frameNr, e)     #the list is not necessarily sorted for frameNr. needs to be sorted after experiment ended!
                     
                     MsgLogger.append("Extension event at frame nr " + str(frameNr) + ": '" + e + "'")
 #                 print "Real frame: " + str(curFrameNr)
  
+def applySettings(settingsDict):
+    """
+    configures the next experiment from SettingsModel.settingsDict (subject id excluded)
+    raises ValueError for an invalid serial framing or log format
+    """
+    global serialPort,experimentId,pluxMac,fs,useSerial,useLifePlot,reopenLifePlot,streamToDisk,logFormat,useJournal,journalFsyncInterval,extensionName
+    
+    configChannels(settingsDict['channelNames'], settingsDict['extraChannelNames'])
+    serialPort = settingsDict['serialPort']
+    experimentId = settingsDict['experimentId']
+    pluxMac = settingsDict['pluxMac']
+    fs = settingsDict['sampleRate']     #must be set before setMaxDuration
+    setMaxDuration( settingsDict['maxDuration'] )
+    setFrameBlock( settingsDict['frameBlockSize'], settingsDict['frameBlockMaxDelayMs'] )
+    useSerial = settingsDict['useSerial']
+    useLifePlot = settingsDict['useLifePlot'] 
+    reopenLifePlot = settingsDict['reopenLifePlot']
+    streamToDisk = settingsDict['streamToDisk']
+    if settingsDict['logFormat'] not in LOG_FORMATS:
+        raise ValueError("Log format must be one of " + ", ".join(LOG_FORMATS) + ": '" + str(settingsDict['logFormat']) + "'")
+    logFormat = settingsDict['logFormat']
+    useJournal = settingsDict['useJournal']
+    journalFsyncInterval = settingsDict['journalFsyncSec']
+    extensionName = settingsDict['extension']
+    setSerialFraming( settingsDict['serialFraming'] )
+    
 def setMaxDuration(minutes):
     """to be called after setting fs
     """
     global maxDurationFrames
-    maxDurationFrames = minutes * 60 * fs
+    maxDurationFrames = int(minutes * 60 * fs)
+    
+def setFrameBlock(blockSize, maxDelayMs):
+    """frames per block sent by the device thread and max delay [ms] until a partially filled block is sent
+    """
+    global frameBlockSize,frameBlockMaxDelay
+    frameBlockSize = max(1, int(blockSize))
+    frameBlockMaxDelay = max(0, int(maxDelayMs)) / 1000.0
         
 def _expEnded():    #save log, etc.
-    global stopSerialReconnectThread,tmpEventStr,notifyExpEndFnc,deviceThread
+    global notifyExpEndFnc,deviceThreads
     
-    stopSerialReconnectThread.set()
-    tmpEventStr = ""
+    _serialStopReaderThread()
+    if plotFeed:
+        plotFeed.close()    #plot shows the last frames and knows that the experiment ended
     
     _safeLog()
     
-    deviceThread.join(timeout=5)
+    for t in deviceThreads:
+        t.join(timeout=5)
     
     if notifyExpEndFnc:     #not None
         notifyExpEndFnc()
     
+def _logHeaderDict():
+    """log header entries known at experiment start
+    """
+    dateStr = time.strftime("%d/%m/%Y %H:%M",startTime)
+    return {'version':versionStr,'dateStr':dateStr,'experimentId':experimentId,'subjectId':subjectId,'fs':fs,
+            'channels':channelHeader, 'pluxMac':pluxMac, 'extension':extensionName}
+    
 def _safeLog(appendToFileName=""):
-    global serialEventData,bioData,extensionEventData,channelHeader
+    """
+    hands the log of the current session to a background saver thread, only once per session
+    (forceStopExperiment does not save again). The caller is not blocked by sorting and compression.
+    returns the saver thread, None if nothing is saved
+    """
+    global journal,_sessionSaved
+    
+    with _saveLock:
+        if nolog or _sessionSaved:
+            return None
+        _sessionSaved = True
+    
+    hdrDict = _logHeaderDict()
+    extraArrays = {}
+    if deviceMerger:
+        hdrDict['devices'] = deviceMerger.summary(pluxMacList())
+        extraArrays['deviceSyncData'] = deviceMerger.syncLogArray()
+    _addGapInfo(gapTracker, hdrDict, extraArrays)
+    hdrDict['clockModel'] = clockModel.summary()
+    extraArrays['clockSyncData'] = clockModel.dataArray()
+    if serialEventsDropped > 0:
+        hdrDict['serialEventsDropped'] = serialEventsDropped
+        MsgLogger.append("Serial events dropped (queue full): " + str(serialEventsDropped))
+    if extInterface and extInterface.extProcess:
+        feedStats = extInterface.bioDataFeedStats()
+        if feedStats['blocks'] > 0 or feedStats['framesLost'] > 0:     #extension requested bio data
+            hdrDict['extensionFeed'] = feedStats
+            if feedStats['framesLost'] > 0:
+                MsgLogger.append("Extension fell behind, bio data frames lost: " + str(feedStats['framesLost']) + 
+                                 ", max. lag: " + str(feedStats['maxLag_frames']) + " frames")
+    
+    #lists are copied, the logging thread may still be running after forceStopExperiment
+    saver = threading.Thread(target=_saverThreadFnc, args=(logFileNameBase + appendToFileName, hdrDict, list(channelHeader), bioData, frameCnt,
+                                                             list(serialEventData), list(extensionEventData), extraArrays, journal))
+    saver.setDaemon(False)      #program exit waits for the log to be written
+    journal = None
+    saverThreads[:] = [t for t in saverThreads if t.is_alive()] + [saver]
+    saver.start()
+    return saver
+    
+def _saverThreadFnc(baseName, hdrDict, channelHeader, bioData, frameCnt, serialEventData, extensionEventData, extraArrays, sessionJournal):
+    global logSaveError
+    
+    error = None
+    try:
+        _writeLogFiles(baseName, hdrDict, channelHeader, bioData, frameCnt, serialEventData, extensionEventData, extraArrays,
+                       _SaveProgress(baseName))
+        if sessionJournal:     #log is saved, journal not needed anymore
+            sessionJournal.close(delete=True)
+    except Exception as e:
+        error = str(e)
+        logSaveError = error
+        MsgLogger.append("Error saving log '" + baseName + "': " + error)
+        if sessionJournal:     #kept, the session can be recovered from it
+            sessionJournal.close()
+    
+    if error is None:
+        try:
+            SessionCatalog.catalogSession(baseName)
+        except Exception as e:
+            MsgLogger.append("Error adding '" + baseName + "' to the session catalog: " + str(e))
     
-    if not nolog:
-        npzPath = logFileNameBase + appendToFileName + ".npz"
-        jsonPath = logFileNameBase + appendToFileName + ".json"
+    if notifyLogSavedFnc:
+        notifyLogSavedFnc(baseName, error)
+    
+class _SaveProgress:
+    """progress function for ChunkedLog.writeLog, logs the progress every SAVE_PROGRESS_INTERVAL seconds
+    """
+    def __init__(self, baseName):
+        self.name = os.path.basename(baseName)
+        self.lastMsgTime = time.time()
         
-        logChannelHeader = np.array(channelHeader)
+    def __call__(self, done, total):
+        if time.time() - self.lastMsgTime >= SAVE_PROGRESS_INTERVAL and done < total:
+            MsgLogger.append("Saving '" + self.name + "': " + str(100 * done // total) + " %")
+            self.lastMsgTime = time.time()
+    
+def isSavingLog():
+    """True while a saver thread is writing a log
+    """
+    return any(t.is_alive() for t in saverThreads)
+
+def waitForLogSaved(timeout=None):
+    """blocks until all logs are written or timeout [sec] passed, returns True if all are written
+    """
+    tEnd = None if timeout is None else time.time() + timeout
+    for t in list(saverThreads):
+        t.join(None if tEnd is None else max(tEnd - time.time(), 0))
+    return not isSavingLog()
+            
+def _addGapInfo(tracker, hdrDict, extraArrays):
+    """adds the gap summary to the log header and the gap index ('gapData') to the npz arrays
+    """
+    hdrDict['gaps'] = tracker.summary()
+    extraArrays['gapData'] = tracker.gapArray()
+    if tracker.missingFrames > 0 or tracker.duplicateFrames > 0:
+        MsgLogger.append("Frames missing: " + str(tracker.missingFrames) + " in " + str(hdrDict['gaps']['gapCnt']) + 
+                         " gap(s), duplicated frames: " + str(tracker.duplicateFrames))
+    
+def _writeLogFiles(baseName, hdrDict, channelHeader, bioData, frameCnt, serialEventData, extensionEventData, extraArrays={}, progressFnc=None):
+    """writes 'baseName.blc' or 'baseName.npz' (see logFormat) and 'baseName.json'
+    extraArrays: dict of additional arrays to store in the log
+    progressFnc: see ChunkedLog.writeLog, not called for '.npz'
+    returns bioData shortened to frameCnt
+    """
+    npzPath = baseName + ".npz"
+    blcPath = baseName + ChunkedLog.BLC_SUFFIX
+    jsonPath = baseName + ".json"
+    
+    logChannelHeader = np.array(channelHeader)
+    #events from journal have no fractional frame nr and arrival time
+    serialEventData = [ev if len(ev) == 4 else (ev[0], ev[1], float(ev[0]), np.nan) for ev in serialEventData]
+    serialEventData.sort(key = lambda l:l[2])   #sort according to fractional frame nr, the clock model is updated while events arrive
+    serialEventDataArr = np.array( serialEventData, np.dtype( [('frame_nr',np.uint32),('event_str','S' + str(MAX_SERIAL_EVENT_STR_LEN)),
+                                                              ('frame_pos',np.float64),('arrival_sec',np.float64)] ) )      #generate event array
+    
+    extensionEventData.sort(key = lambda l:l[0])    #sort according to first tuple entry of every list entry ( frameNr )
+    extensionEventDataArr = np.array( extensionEventData, np.dtype( [('frame_nr',np.uint32),('event_str','S' + str(MAX_EXTENSION_EVENT_STR_LEN))] ) )      #generate event array
+    
+    if logFormat == "blc":
+        logPath = blcPath
+        arrays = dict(extraArrays, channelHeader = logChannelHeader, serialEventData = serialEventDataArr, extensionEventData = extensionEventDataArr)
+        if isinstance(bioData, StreamRecording):
+            #chunks are read from the stream file, it is not needed anymore afterwards
+            streamPath = bioData.finalize(frameCnt)
+            streamData = np.load(streamPath, mmap_mode='r')
+            ChunkedLog.writeLog(blcPath, streamData, arrays, ChunkedLog.CHUNK_SEC * hdrDict['fs'], progressFnc)
+            del streamData      #unmap before deleting
+            os.remove(streamPath)
+        else:
+            bioData = bioData[:frameCnt]      #shorten data array to actual size (delete pending zeros)
+            ChunkedLog.writeLog(blcPath, bioData, arrays, ChunkedLog.CHUNK_SEC * hdrDict['fs'], progressFnc)
+    elif isinstance(bioData, StreamRecording):
+        #bio data is on disk already, only the file end and header need to be fixed
+        logPath = npzPath
+        bioData.finalize(frameCnt)
+        np.savez_compressed(npzPath, channelHeader = logChannelHeader, bioDataFile = np.array(bioData.fileName()), serialEventData = serialEventDataArr, extensionEventData = extensionEventDataArr, **extraArrays)
+        hdrDict['bioDataFile'] = bioData.fileName()
+    else:
+        logPath = npzPath
         bioData = bioData[:frameCnt]      #shorten data array to actual size (delete pending zeros)
-        serialEventDataArr = np.array( serialEventData, np.dtype( [('frame_nr',np.uint32),('event_str','S' + str(MAX_SERIAL_EVENT_STR_LEN))] ) )      #generate event array
+        np.savez_compressed(npzPath, channelHeader = logChannelHeader, bioData = bioData, serialEventData = serialEventDataArr, extensionEventData = extensionEventDataArr, **extraArrays)
+    MsgLogger.append("Data saved to '" + logPath + "'")
+    
+    #complete header
+    hdrDict['frameCnt'] = frameCnt
+    hdrDict['duration_sec'] = float(frameCnt)/hdrDict['fs']
+    with open(jsonPath,'w') as f:
+        json.dump(hdrDict, f, indent=2, )
         
-        extensionEventData.sort(key = lambda l:l[0])    #sort according to first tuple entry of every list entry ( frameNr )
-        extensionEventDataArr = np.array( extensionEventData, np.dtype( [('frame_nr',np.uint32),('event_str','S' + str(MAX_EXTENSION_EVENT_STR_LEN))] ) )      #generate event array
+    return bioData
+    
+def recoverJournal(journalPath):
+    """
+    rebuilds '<base>_recovered.blc' or '<base>_recovered.npz' (see logFormat) and '<base>_recovered.json' from the journal of a session that was not saved
+    the journal is renamed to '<journal>.recovered' afterwards
+    returns True on success
+    """
+    baseName = journalPath[:-len(SessionJournal.JOURNAL_SUFFIX)] + JOURNAL_RECOVERED_SUFFIX
+    hdrDict = None
+    recBioData = None
+    recGapTracker = GapTracker()
+    recFrameCnt = 0
+    recSerialEventData = []
+    recExtensionEventData = []
+    
+    try:
+        for (recType, content) in SessionJournal.readJournal(journalPath):
+            if recType == SessionJournal.REC_HEADER:
+                hdrDict = content
+                hdrDict['channels'] = [str(ch) for ch in hdrDict['channels']]
+                #frames are copied to a stream recording, memory usage does not depend on session length
+                recBioData = StreamRecording(baseName + STREAM_FILE_SUFFIX, len(hdrDict['channels']), STREAM_CHUNK_SEC * hdrDict['fs'])
+            elif recBioData is None:
+                break   #no header, not a valid journal
+            elif recType == SessionJournal.REC_FRAMES:
+                (frameNrArr, dataBlock) = content
+                recBioData[frameNrArr] = dataBlock
+                recGapTracker.update(frameNrArr)
+                recFrameCnt = max(recFrameCnt, int(frameNrArr.max()) + 1)
+            elif recType == SessionJournal.REC_SERIAL_EVENT:
+                recSerialEventData.append(content)
+            elif recType == SessionJournal.REC_EXT_EVENT:
+                recExtensionEventData.append(content)
         
-        np.savez_compressed(npzPath, channelHeader = logChannelHeader, bioData = bioData, serialEventData = serialEventDataArr, extensionEventData = extensionEventDataArr)
-        MsgLogger.append("Data saved to '" + npzPath + "'")
+        if recBioData is None:
+            MsgLogger.append("Error recovering '" + journalPath + "': no valid journal header.")
+            return False
         
-        #construct header
-        dateStr = time.strftime("%d/%m/%Y %H:%M",startTime)
-        duration_sec = float(frameCnt)/fs
-        hdrDict = {'version':versionStr,'dateStr':dateStr,'experimentId':experimentId,'subjectId':subjectId,'fs':fs,
-                   'frameCnt':frameCnt,'duration_sec':duration_sec, 'channels':channelHeader, 'pluxMac':pluxMac,
-                   'extension':extensionName}
-        with open(jsonPath,'w') as f:
-            json.dump(hdrDict, f, indent=2, )
+        hdrDict['recoveredFromJournal'] = True
+        extraArrays = {}
+        _addGapInfo(recGapTracker, hdrDict, extraArrays)
+        _writeLogFiles(baseName, hdrDict, hdrDict['channels'], recBioData, recFrameCnt, recSerialEventData, recExtensionEventData, extraArrays)
+        os.rename(journalPath, journalPath + ".recovered")
+    except Exception as e:
+        MsgLogger.append("Error recovering '" + journalPath + "': " + str(e))
+        return False
+    
+    return True
+
+def recoverJournals(logDir):
+    """recovers all sessions in logDir that have a journal left, i.e. were not saved because of a crash
+    """
+    for journalPath in SessionJournal.findJournals(logDir):
+        MsgLogger.append("Found journal of unsaved session: '" + journalPath + "'. Recovering...")
+        recoverJournal(journalPath)
     
     
-def _expControlLoop(pipeConn):
-    global bioData,serialEventData,frameCnt,endLogging
+def _updateClockModel(frameNrArr, arrivalTimes):
+    """adds the last frame of every block in frameNrArr with its arrival time to the clock model
+    """
+    blockEnds = np.flatnonzero(np.diff(arrivalTimes))
+    for i in blockEnds.tolist() + [len(frameNrArr) - 1]:
+        clockModel.update(int(frameNrArr[i]), arrivalTimes[i] - acquisitionStartTime)
+    
+def _expControlLoop(ringReader):
+    global bioData,serialEventData,frameCnt,endLogging,expEndError,loggerFramesLost
     
     try:
         while not endLogging.is_set():
-            if pipeConn.poll(5):     #block 5 sec max
-                (curFrameNr, dataTup) = pipeConn.recv()      #curFrameNr is 0 based
+            if ringReader.wait(5):     #block 5 sec max
+                (frameNrArr, dataBlock) = ringReader.read()      #views into ring buffer, frame nrs are 0 based, dataBlock has one row per frame
+                arrivalTimes = ringReader.lastReadArrivalTimes()
                 
-                if curFrameNr >= maxDurationFrames:
-                    break       #end experiment after max duration
+                #copies are checked before they are passed on, the device may be overwriting the views already
+                (frameNrArr, dataBlock, arrivalTimes) = (frameNrArr.copy(), dataBlock.copy(), arrivalTimes.copy())
+                readValid = ringReader.lastReadValid()
+                if ringReader.overrunFrames > 0 or not readValid:
+                    loggerFramesLost = ringReader.overrunFrames + (0 if readValid else len(frameNrArr))
+                    expEndError = "Error: logging fell behind the Plux device thread. Frames lost: " + str(loggerFramesLost)
+                    MsgLogger.append(expEndError)
+                    break
+                
+                maxDurationReached = frameNrArr[-1] >= maxDurationFrames
+                if maxDurationReached:
+                    inRange = frameNrArr < maxDurationFrames
+                    frameNrArr = frameNrArr[inRange]
+                    dataBlock = dataBlock[inRange]
+                    arrivalTimes = arrivalTimes[inRange]
+                    if len(frameNrArr) == 0:
+                        break       #end experiment after max duration
+                
+                curFrameNr = int(frameNrArr[-1])    #events are assigned to the latest frame received
+                gapTracker.update(frameNrArr)       #missing frames stay zero in bioData
+                _updateClockModel(frameNrArr, arrivalTimes)
     
                 serEv = serialCheckEvent(curFrameNr)
                 extensionCheckEvent(curFrameNr)
                 
-                bioData[curFrameNr] = dataTup
-                frameCnt = curFrameNr + 1
+                bioData[frameNrArr] = dataBlock
+                frameCnt = gapTracker.nextFrameNr  #highest frame nr + 1, also if frames arrived out of order
+                if journal:
+                    journal.appendFrames(frameNrArr, dataBlock)
+                if plotFeed:
+                    plotFeed.writeFrames(frameNrArr, dataBlock)
+                if blockMonitorFnc:
+                    blockMonitorFnc(frameNrArr)
                 
-                if extInterface:    #not None, sometimes gets initialized after first run
-                    extInterface.putBioData(curFrameNr, dataTup)
+                #extension reads from the ring buffer itself
                 
-    #             logRaw(frameCnt, data, serEv)
-                if useLifePlot:
-                    RealtimePlot.plotDataFrame(float(curFrameNr)/fs, dataTup)
+                if maxDurationReached:
+                    break       #end experiment after max duration
                 
 #                 #report every sec or on event on console
 #                 if curFrameNr % fs == 0:
@@ -436,20 +808,22 @@ def _expControlLoop(pipeConn):
 #                     print "frame #", curFrameNr, "\tecg:", dataTup[0], "\teda:", dataTup[1], "\tbvp:", dataTup[2], "\tserial-event:", serialEventData[-1][1]     #string of last serialEventData element
 #              
             else:
-                MsgLogger.append("Error: no data from Plux device thread. Connection to Plux device lost.")
+                expEndError = "Error: no data from Plux device thread. Connection to Plux device lost."
+                MsgLogger.append(expEndError)
                 break
     except Exception as e:      #all exceptions caught here. this ensures that _expEnded is called in any case and the log is saved
+        expEndError = "Error in _expControlLoop: " + str(e)
         MsgLogger.append("Error in _expControlLoop. Ending experiment.")
         print e
 
-    pluxDevice.endAquisition() 
+    pluxEndAquisition()
     _expEnded()
         
 def startExperiment(subjectIdStr):
-    global bioData,serialEventData,frameQueue,endLogging,frameCnt,deviceThread,logThread,tmpEventStr,startTime,subjectId,logFileNameBase,extensionEventData,nolog
+    global bioData,serialEventData,serialEventsDropped,acquisitionStartTime,frameRing,endLogging,frameCnt,deviceThreads,deviceMerger,gapTracker,clockModel,logThread,startTime,subjectId,logFileNameBase,extensionEventData,nolog,journal,expEndError,plotFeed,_sessionSaved,loggerFramesLost
     
     #check plux opened?
-    if pluxDevice == None:
+    if len(pluxDevices) == 0:
         raise Exception("Error in startExperiment: Plux not opened.")
     
     subjectId = subjectIdStr
@@ -458,44 +832,63 @@ def startExperiment(subjectIdStr):
     else:
         nolog = False
     
+    #init logging
+    startTime = time.localtime()
+    logFileNameBase = logDir + experimentId + "_" + subjectId + "_" + time.strftime("%Y%m%d_%H%M",startTime)
+    
+    if useJournal and not nolog:
+        journal = SessionJournal.SessionJournal(logFileNameBase + SessionJournal.JOURNAL_SUFFIX, _logHeaderDict(), journalFsyncInterval)
+    
     #init log arrays
     channelCnt = len(channelHeader)
-    bioData = np.zeros((maxDurationFrames,channelCnt),np.uint16)
+    if streamToDisk and not nolog:
+        bioData = StreamRecording(logFileNameBase + STREAM_FILE_SUFFIX, channelCnt, STREAM_CHUNK_SEC * fs)
+    else:
+        bioData = np.zeros((maxDurationFrames,channelCnt),np.uint16)
     serialEventData = []
     extensionEventData = []
     frameCnt = 0
-    tmpEventStr = ""
+    gapTracker = GapTracker()
+    clockModel = SampleClockModel(fs)
+    
+    #events left from serial port of last experiment are discarded
+    while not serialEventQueue.empty():
+        serialEventQueue.get()
+    serialEventsDropped = 0
 
-    #prepare interface
-    loggerConn, pluxConn = Pipe()
+    #prepare ring buffer shared by device thread (producer), logging thread, plot and extension (consumers)
+    frameRing = FrameRingBuffer(RING_BUFFER_SEC * fs, channelCnt)
+    loggerReader = frameRing.reader()
     endLogging.clear()
-    serialCheckEvent.oldIsSerialOpen = True     #assume serial is connected, produces message and #noconn event with first frame otherwise
+    expEndError = None
+    loggerFramesLost = 0
+    _sessionSaved = False
     
-    #init plot
-    cfg = RealtimePlot.PlotConfig()
-    cfg.channelCnt = channelCnt
-    cfg.channelLabels = channelHeader  
-    cfg.xLabel = "Seconds"
-    cfg.xRange = PLOT_RANGE_SEC    #display last 10 seconds
-    cfg.yMin = 0
-    cfg.yMax = 2**bitsResolution
-    cfg.reopenPlotOnClose = reopenLifePlot
+    #every device runs in its own thread, frames of several devices are merged before they are written to the ring buffer
+    if len(pluxDevices) == 1:
+        deviceMerger = None
+        frameSinks = [frameRing]
+    else:
+        deviceMerger = DeviceMerger(frameRing, [bin(m).count("1") for m in channelGroups], MAX_DEVICE_LAG_SEC * fs)
+        frameSinks = [deviceMerger.deviceSink(i) for i in range(len(pluxDevices))]
     
-    deviceThread = threading.Thread(target=pluxStartDeviceLoop,args=(pluxConn,))
-    logThread = threading.Thread(target=_expControlLoop,args=(loggerConn,))
-    
-    #init logging
-    startTime = time.localtime()
-    logFileNameBase = logDir + experimentId + "_" + subjectId + "_" + time.strftime("%Y%m%d_%H%M",startTime)
+    deviceThreads = []
+    for i in range(len(pluxDevices)):
+        pluxDevices[i].stopRequest.clear()
+        deviceThreads.append( threading.Thread(target=pluxStartDeviceLoop,args=(pluxDevices[i],frameSinks[i],channelGroups[i])) )
+    logThread = threading.Thread(target=_expControlLoop,args=(loggerReader,))
     
     
     #start
-    deviceThread.start()
+    acquisitionStartTime = monotonic()
+    for t in deviceThreads:
+        t.start()
+    plotFeed = None
     if useLifePlot:
-        RealtimePlot.startPlotProcess(cfg)
+        plotFeed = _startPlot(channelCnt)
     logThread.start()
     if useSerial:
-        serialStartReconnectThread()
+        _serialStartReaderThread()
         
     
 def stopExperiment():
@@ -508,13 +901,11 @@ def forceStopExperiment():
     Finally, the notify function is called.
     This function should not be needed normally! It should not be called less than 11 seconds after stopExperiment was called.
     """
-    global stopSerialReconnectThread,tmpEventStr,notifyExpEndFnc,deviceThread
+    global notifyExpEndFnc
     
     endLogging.set()
-    pluxDevice.endAquisition()
-    stopSerialReconnectThread.set()
-    
-    tmpEventStr = ""
+    pluxEndAquisition()
+    _serialStopReaderThread()
     
     _safeLog("_forcedsave")
     
@@ -523,8 +914,26 @@ def forceStopExperiment():
     if notifyExpEndFnc:     #not None
         notifyExpEndFnc()
     
+def _startPlot(channelCnt):
+    import RealtimePlot     #loaded on first use, matplotlib is imported by the plot process only
+    
+    cfg = RealtimePlot.PlotConfig()
+    cfg.channelCnt = channelCnt
+    cfg.channelLabels = channelHeader  
+    cfg.xLabel = "Seconds"
+    cfg.fs = fs
+    cfg.xRange = PLOT_RANGE_SEC    #display last 10 seconds
+    cfg.yMin = 0
+    cfg.yMax = 2**bitsResolution
+    cfg.reopenPlotOnClose = reopenLifePlot
+    cfg.headless = headlessPlot
+    
+    return RealtimePlot.startPlotProcess(cfg)
+    
 def closePlot():
-    RealtimePlot.terminatePlotProcess()
+    RealtimePlot = sys.modules.get('RealtimePlot')
+    if RealtimePlot:    #plot was started before
+        RealtimePlot.terminatePlotProcess()
 
 
 if __name__ == '__main__':
@@ -562,19 +971,6 @@ if __name__ == '__main__':
 #     print a.dtype.names
 #     print b
     
-#     startStr = None
-#     endStr = "\n"
-#     print _serialAssembleEvent("haha", startStr, endStr)
-#     print _serialAssembleEvent("#T", startStr, endStr)
-#     print _serialAssembleEvent("h", startStr, endStr)
-#     print _serialAssembleEvent("a", startStr, endStr)
-#     print _serialAssembleEvent("l", startStr, endStr)
-#     print _serialAssembleEvent("l", startStr, endStr)
-#     print _serialAssembleEvent("o\n#Tw", startStr, endStr)
-#      
-#     print _serialAssembleEvent("", startStr, endStr)
-#     print _serialAssembleEvent("", startStr, endStr)
-#     print _serialAssembleEvent("elt\n", startStr, endStr)
     
 #     try:
 #         pluxOpenDevice()
@@ -22,28 +22,45 @@ This module is the interface between ExpController and extensions.
 
 import ctypes
 import threading
+import time
 from multiprocessing import Process, Event, Queue, Value, Pipe
+from multiprocessing.sharedctypes import RawArray
 from Queue import Full,Empty
 
 import MsgLogger
 
 try:
-    import Extensions
-    extensionClasses = Extensions.extensionClasses
+    import Extensions   #reads manifests only, extension modules are imported by the extension process
 except ImportError:
-    extensionClasses = []   #empty list if no directory / package called Extensions
+    Extensions = None
     print "Extensions module not found"
+
+def _findExtensions():
+    if Extensions:
+        return Extensions.findExtensions()
+    else:
+        return []   #empty list if no directory / package called Extensions
     
 
 EVENT_QUEUE_IS_PIPE = False      #was implemented for performance test Pipe vs Queue. Queues have some latency (not constant)
 
+#bio data feed statistics, written by the extension process, see ExtensionInterfaceFrontend.bioDataFeedStats
+FEED_STATS = ('blocks', 'frames', 'framesLost', 'lag_frames', 'maxLag_frames')
+_FEED_BLOCKS, _FEED_FRAMES, _FEED_LOST, _FEED_LAG, _FEED_MAX_LAG = range(len(FEED_STATS))
+FEED_OVERRUN_KEEP = 0.5     #part of the ring buffer kept to read after an overrun, the rest is skipped as margin to the device
+
 
-def extProcessFnc(extensionClass, expConstants, _curFrameNr, consoleMsgQueue, eventQueue, bioDataQueue, requestBioData, requestEndExtention):
+def extProcessFnc(extensionManifest, expConstants, _curFrameNr, consoleMsgQueue, eventQueue, bioDataRing, feedStats, requestBioData, requestEndExtention):
 #     print "extProcessFnc start"
     #instantiate backend
-    backend = ExtensionInterfaceBackend(expConstants, _curFrameNr, consoleMsgQueue, eventQueue, bioDataQueue, requestBioData, requestEndExtention)
+    backend = ExtensionInterfaceBackend(expConstants, _curFrameNr, consoleMsgQueue, eventQueue, bioDataRing, feedStats, requestBioData, requestEndExtention)
     
-    #instantiate extension class
+    #import and instantiate extension class, only the selected extension is loaded
+    try:
+        extensionClass = Extensions.loadExtensionClass(extensionManifest)
+    except Exception as e:
+        backend.consoleMessage("Error loading extension '" + extensionManifest['name'] + "': " + str(e))
+        return
     extInstnace = extensionClass(backend,expConstants)
     
     #run extension
@@ -56,14 +73,17 @@ class ExtensionInterfaceFrontend:
     """
     This is the frontend side and is instantiated by ExpController
     """
-    def __init__(self, subjectId, experimentId, logDir, startTime, logFileNameBase, channelHeader, sampleFreq, nolog = False):
+    def __init__(self, subjectId, experimentId, logDir, startTime, logFileNameBase, channelHeader, sampleFreq, nolog = False, bioDataRing = None):
+        """
+        bioDataRing is the FrameRingBuffer the extension reads bio data from, None if no bio data is available
+        """
         
         #experiment variables, need to be updated by ExpController
         self._curFrameNr = Value(ctypes.c_int64,-1)   
         
         #experiment constants
         self.expConstants = ExperimentConstants(subjectId, experimentId, logDir, startTime, logFileNameBase, channelHeader, sampleFreq, nolog)
-        self.extensionClass = None
+        self.extensionManifest = None
         
         #instances for the current run
         self.consoleMsgQueue = Queue(maxsize=1000)    #not infinite size, better to detect errors
@@ -74,7 +94,8 @@ class ExtensionInterfaceFrontend:
         else:
             self.eventQueue = Queue(maxsize=1000)    #not infinite size, better to detect errors
             
-        self.bioDataQueue = Queue(maxsize=1000)    #not infinite size, better to detect errors 
+        self.bioDataRing = bioDataRing
+        self.feedStats = RawArray(ctypes.c_long, len(FEED_STATS))     #native word size, single writer, so stores are atomic
         self.requestBioData = Event()
         self.requestEndExtention = Event()      #for ExpController to request for extension to end
         
@@ -84,6 +105,14 @@ class ExtensionInterfaceFrontend:
     def setCurrentFramenr(self,frameNr):
         self._curFrameNr.value = frameNr
     
+    def bioDataFeedStats(self):
+        """
+        returns a dict with the statistics of the bio data feed to the extension, see FEED_STATS:
+        blocks and frames delivered, frames lost because the extension fell behind more than the ring buffer,
+        frames waiting at the last read and max. of it
+        """
+        return dict(zip(FEED_STATS, self.feedStats[:]))
+    
     def checkEvents(self,curFrameNr):
         """
         returns a list of tuples with (frameNr, event strings), empty list if no events
@@ -109,37 +138,26 @@ class ExtensionInterfaceFrontend:
         
         return ev
     
-    def putBioData(self, curFrameNr, bioDataTup):
-        """
-        To be used by ExpController to provide the current bio data to the extension.
-        Bio data is only provided to the extension if the requestBioData was set by the extension: requestBioData(True)
-        """
-        if self.requestBioData.is_set():
-            try:
-                self.bioDataQueue.put((curFrameNr, bioDataTup))  #not blocking, ensure type str
-            except Full:
-                print "ExtensionInterface.putBioData: bioDataQueue full"
-    
     def selectExtensionByName(self, extName):
         """
         Returns True on success
         """
         success = False
         
-        self.extensionClass = None
+        self.extensionManifest = None
         
         if extName == "None":
             success = True
         else:
-            for c in extensionClasses:
-                if c.extensionName == extName:
-                    self.extensionClass = c    #just pass class, instance will be instantiated by extension process
+            for m in _findExtensions():
+                if m['name'] == extName:
+                    self.extensionManifest = m    #just pass manifest, class is imported and instantiated by extension process
                     success = True
                     break             
         return success
     
     def extensionStart(self):
-        if self.extensionClass != None:     #any extension selected (not None)
+        if self.extensionManifest != None:     #any extension selected (not None)
             #start console msg handling thread
             if self.consoleMsgThread == None:   #thread not started yet
                 self.consoleMsgThread = threading.Thread(target=self._consoleMsgLoop)
@@ -154,8 +172,8 @@ class ExtensionInterfaceFrontend:
             else:
                 evQueue = self.eventQueue
             #all shared ressources have to be explicit arguments, not nested within a class or list
-            self.extProcess = Process(target=extProcessFnc,args=(self.extensionClass, self.expConstants, self._curFrameNr, self.consoleMsgQueue, evQueue, self.bioDataQueue, 
-                                                                 self.requestBioData, self.requestEndExtention))
+            self.extProcess = Process(target=extProcessFnc,args=(self.extensionManifest, self.expConstants, self._curFrameNr, self.consoleMsgQueue, evQueue, self.bioDataRing, 
+                                                                 self.feedStats, self.requestBioData, self.requestEndExtention))
             self.extProcess.start()
 
     def extensionEnd(self):
@@ -173,7 +191,7 @@ class ExtensionInterfaceBackend:
     """
     This is the backend side and is instantiated within the extension process. It is used by the extension class.
     """
-    def __init__(self,expConstants, _curFrameNr, consoleMsgQueue, eventQueue, bioDataQueue, requestBioData, requestEndExtention):
+    def __init__(self,expConstants, _curFrameNr, consoleMsgQueue, eventQueue, bioDataRing, feedStats, requestBioData, requestEndExtention):
         self.expConstants = expConstants
         self._curFrameNr = _curFrameNr
         self.consoleMsgQueue = consoleMsgQueue
@@ -183,7 +201,11 @@ class ExtensionInterfaceBackend:
         else:
             self.eventQueue = eventQueue
             
-        self.bioDataQueue = bioDataQueue
+        self.bioDataRing = bioDataRing
+        self._bioDataReader = None      #created on first request, reads from the newest frame on
+        self._pendingBlock = (None, None)   #block currently handed out frame by frame by getBioData
+        self._pendingIndex = 0
+        self.feedStats = feedStats
         self.requestBioData = requestBioData
         self.requestEndExtention = requestEndExtention      #for ExpController to request extension to end
         
@@ -220,6 +242,8 @@ class ExtensionInterfaceBackend:
     
     def setRequestBioData(self,request):
         if request:
+            if self._bioDataReader is None and self.bioDataRing is not None:
+                self._bioDataReader = self.bioDataRing.reader(startAtNewest=True)
             self.requestBioData.set()
         else:
             self.requestBioData.clear()
@@ -229,12 +253,83 @@ class ExtensionInterfaceBackend:
         To be used by the extension. Should run in a separate data processing thread.
         Returns a tuple of (frameNr, (channel data tuple) ) or (None, None) if there was no new data within timeout [sec]
         """
-        try:
-            retval = self.bioDataQueue.get(block, timeout)
-        except Empty:
-            retval = (None, None)
-            
-        return retval
+        frameNrArr, bioDataBlock = self._pendingBlock
+        while frameNrArr is None or self._pendingIndex >= len(frameNrArr):
+            frameNrArr, bioDataBlock = self.getBioDataBlock(block, timeout)
+            if frameNrArr is None:
+                return (None, None)
+            frameNrArr, bioDataBlock = (frameNrArr.copy(), bioDataBlock.copy())     #views would be overwritten while handed out frame by frame
+            if not self._bioDataReader.lastReadValid():     #overwritten while copying
+                self._countLostFrames(len(frameNrArr))
+                frameNrArr = None
+                continue
+            self._pendingBlock = (frameNrArr, bioDataBlock)
+            self._pendingIndex = 0
+        
+        i = self._pendingIndex
+        self._pendingIndex += 1
+        return ( int(frameNrArr[i]), tuple(bioDataBlock[i].tolist()) )
+    
+    def getBioDataBlock(self, block=True, timeout=10):
+        """
+        To be used by the extension. Should run in a separate data processing thread.
+        Returns a tuple of (frame nr array, data block) or (None, None) if there was no new data within timeout [sec]
+        The data block has one row per frame and one column per channel.
+        Both arrays are views into shared memory and valid until the device wraps around the ring buffer
+        (ExpController.RING_BUFFER_SEC). Copy them if they are needed for longer.
+        If the extension fell behind more than the ring buffer, frames are skipped and counted as lost (see bioDataFeedStats).
+        Do not mix with getBioData, frames handed out by getBioData are not returned again.
+        """
+        if self._bioDataReader is None:
+            if block:
+                time.sleep(timeout)     #no bio data requested or available
+            return (None, None)
+        
+        if block:
+            tStart = time.time()
+            if not self._bioDataReader.wait(timeout):
+                if self.bioDataRing.isClosed():     #no more data, do not return earlier than without data
+                    time.sleep(max(timeout - (time.time() - tStart), 0))
+                return (None, None)
+        
+        reader = self._bioDataReader
+        stats = self.feedStats
+        lostBefore = reader.overrunFrames
+        lag = reader.available()        #counts overrun frames
+        stats[_FEED_LAG] = lag
+        stats[_FEED_MAX_LAG] = max(stats[_FEED_MAX_LAG], lag)
+        if reader.overrunFrames > lostBefore:
+            #the oldest slots are the ones the device writes next, resume with a margin
+            cursor = reader.cursor
+            reader.skipToNewest(int(self.bioDataRing.capacity * FEED_OVERRUN_KEEP))
+            reader.overrunFrames += reader.cursor - cursor
+        
+        while True:
+            (frameNrArr, bioDataBlock) = reader.read()
+            if frameNrArr is None or reader.lastReadValid():
+                break
+            reader.overrunFrames += len(frameNrArr)     #overwritten while reading, the next read continues with newer frames
+        
+        if reader.overrunFrames > lostBefore:
+            self._countLostFrames(0)
+        if frameNrArr is not None:
+            stats[_FEED_BLOCKS] += 1
+            stats[_FEED_FRAMES] += len(frameNrArr)
+        return (frameNrArr, bioDataBlock)
+    
+    def _countLostFrames(self, frameCnt):
+        """adds frameCnt to the lost frames of the reader, publishes them and reports the frames lost since last report
+        """
+        reader = self._bioDataReader
+        reader.overrunFrames += frameCnt
+        stats = self.feedStats
+        self.consoleMessage("Extension fell behind the bio data feed, frames lost: " + str(reader.overrunFrames - stats[_FEED_LOST]))
+        stats[_FEED_LOST] = reader.overrunFrames
+    
+    def bioDataFeedStats(self):
+        """see ExtensionInterfaceFrontend.bioDataFeedStats
+        """
+        return dict(zip(FEED_STATS, self.feedStats[:]))
     
     def endExperiment(self):
         """
@@ -263,8 +358,8 @@ class ExperimentConstants:
 
 def enumerateExtensionNames():
     names = []
-    for c in extensionClasses:
-        names.append(c.extensionName) 
+    for m in _findExtensions():
+        names.append(m['name']) 
     
     return names
     
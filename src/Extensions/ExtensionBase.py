@@ -87,7 +87,7 @@ class ExtensionBase:
         
     def _logOpen(self):
         if not self.extConstants.nolog:
-            fileName = self.extConstants.logDir + self.extConstants.logFileNameBase + "_" + self.extensionName + ".txt"
+            fileName = self.extConstants.logFileNameBase + "_" + self.extensionName + ".txt"     #logFileNameBase contains logDir
             try:
                 self.logfile = open(fileName,"wb")
                 self.logCsvWriter = csv.writer(self.logfile,delimiter='\t')
@@ -145,9 +145,9 @@ class ExtensionBase:
         
     def _bioDataProcessingLoop(self):
         while not self.dataProcessingEndRequest.is_set():
-            (frameNr, bioDataTup) = self.eib.getBioData(block=True,timeout=10)
-            if frameNr != None:     #not None, there is new data
-                self.onBioDataFrame(frameNr, bioDataTup)
+            (frameNrArr, bioDataBlock) = self.eib.getBioDataBlock(block=True,timeout=10)
+            if frameNrArr is not None:     #not None, there is new data
+                self.onBioDataBlock(frameNrArr, bioDataBlock)
             else:
                 if not self.dataProcessingEndRequest.is_set():
                     print "ExtensionBase._bioDataProcessingLoop: no data"
@@ -162,11 +162,27 @@ class ExtensionBase:
     def stopBioDataProcessing(self):
         self.eib.setRequestBioData(False)
         self.dataProcessingEndRequest.set()
+    
+    def bioDataFeedStats(self):
+        """
+        Can be used by extension to check if it keeps up with the bio data.
+        returns dict with blocks and frames received, framesLost, lag_frames (frames waiting at the last read) and maxLag_frames
+        """
+        return self.eib.bioDataFeedStats()
+        
+    def onBioDataBlock(self,frameNrArr,bioDataBlock):
+        """
+        Can be overridden by extension to process a whole block of frames at once (numpy arrays).
+        bioDataBlock has one row per frame nr in frameNrArr and one column per channel.
+        Calls onBioDataFrame for every frame by default.
+        """
+        for frameNr, row in zip(frameNrArr.tolist(), bioDataBlock.tolist()):
+            self.onBioDataFrame(frameNr, tuple(row))
         
     def onBioDataFrame(self,frameNr,bioDataTup):
         """
         To be overridden by extension.
-        Called by pluxDataProcessing thread for every frame; must not block. 
+        Called by pluxDataProcessing thread for every frame (see onBioDataBlock); must not block. 
         bioDataTup contains as many values as there are channels active (see self.extConstants.pluxChannelHeader)
         """
         print "onBioDataFrame: Please override method in your extension class."
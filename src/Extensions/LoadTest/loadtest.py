@@ -0,0 +1,73 @@
+'''
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine, 
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+import threading
+
+import numpy as np
+
+from Extensions.ExtensionBase import ExtensionBase
+
+class ExtensionLoadTest(ExtensionBase):
+    """
+    Headless extension for benchmarks (see Benchmark.py), no GUI.
+    Processes every bio data block, puts an event every second and writes
+    frames received, frames lost and max. lag behind the logging thread to its log at the end.
+    """
+    
+    #to be set by chlid class
+    logColumnHeader = ["framesReceived", "framesLost", "maxLagFrames", "eventsPut"]
+    extensionName = "loadtest"
+    
+    EVENT_INTERVAL = 1.0    #sec
+    
+    def __init__(self, extensionInterfaceBackend, extConstnats):
+        ExtensionBase.__init__(self, extensionInterfaceBackend, extConstnats)
+        self.endRequest = threading.Event()     #created before the end request thread is started by run()
+    
+    def extMainLoop(self):
+        self.framesReceived = 0
+        self.framesLost = 0
+        self.maxLagFrames = 0
+        self.nextFrameNr = None
+        self.eventsPut = 0
+        self.channelSum = np.zeros(len(self.extConstants.channelHeader))
+        
+        self.startBioDataProcessing()
+        
+        while not self.endRequest.wait(self.EVENT_INTERVAL):
+            if self.eib.putEvent("load" + str(self.eventsPut)) >= 0:
+                self.eventsPut += 1
+        
+        self.stopBioDataProcessing()
+        self.logAppendLine([self.framesReceived, self.framesLost, self.maxLagFrames, self.eventsPut])
+        
+    def onBioDataBlock(self,frameNrArr,bioDataBlock):
+        if self.nextFrameNr is not None and frameNrArr[0] > self.nextFrameNr:
+            self.framesLost += int(frameNrArr[0]) - self.nextFrameNr      #skipped by ring buffer overrun
+        self.nextFrameNr = int(frameNrArr[-1]) + 1
+        self.framesReceived += len(frameNrArr)
+        
+        self.channelSum += bioDataBlock.sum(axis=0)     #some work per block
+        
+        lag = self.eib.getCurrentFramenr() - self.nextFrameNr
+        if lag > self.maxLagFrames:
+            self.maxLagFrames = lag
+            
+    def onExtEndRequest(self):
+        self.endRequest.set()
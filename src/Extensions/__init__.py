@@ -1,25 +1,70 @@
-# from template import ExtensionTemplate
-# from MwRandomEvents import ExtensionMwRandomEvents
-# 
-# extensionClasses = [ExtensionTemplate, ExtensionMwRandomEvents] 
+# Every extension is a subfolder (package) with a manifest 'extension.json', e.g.
+# {"name": "template", "module": "template", "class": "ExtensionTemplate"}
+# name: shown in the extension selection, has to match extensionName of the class
+# module, class: entry point, module relative to the extension folder
+#
+# Only the manifests are read to list the extensions. The extension module is imported
+# by loadExtensionClass in the extension process, so its dependencies (e.g. Gtk) are not
+# loaded into the BioLink process.
+# Folders without manifest are still supported, their package is imported to read
+# extensionClass.extensionName (old style, loads the extension into the BioLink process).
 
 import os
+import json
 import importlib
 
-extensionClasses = []   #empty list
+MANIFEST_FILE = "extension.json"
 
-localDir = os.path.dirname(__file__)
-localChilds = os.listdir(localDir)
-subDirs = []
-for f in localChilds:
-    if os.path.isdir(os.path.join(localDir, f)):
-        subDirs.append(f)
+_localDir = os.path.dirname(os.path.abspath(__file__))
+_manifestCache = (None, [])     #(mtime key, manifest list), see findExtensions
 
-for sd in subDirs:
+
+def _mtimeKey():
+    """mtimes of the extensions folder, every subfolder and its manifest. Changes when extensions are added, removed or edited.
+    """
+    key = [os.path.getmtime(_localDir)]
+    for f in sorted(os.listdir(_localDir)):
+        path = os.path.join(_localDir, f)
+        if os.path.isdir(path):
+            manifestPath = os.path.join(path, MANIFEST_FILE)
+            key.append((f, os.path.getmtime(path), os.path.getmtime(manifestPath) if os.path.exists(manifestPath) else None))
+    return key
+
+def _readManifest(subDir):
+    """returns manifest dict with keys name, module (full module name) and class, None if not a valid extension
+    """
+    manifestPath = os.path.join(_localDir, subDir, MANIFEST_FILE)
     try:
-        extPackage = importlib.import_module(__name__ + "." + sd)   #results in module names like Extensions.Template
-        extensionClasses.append( extPackage.extensionClass )
+        if os.path.exists(manifestPath):
+            with open(manifestPath, 'r') as f:
+                m = json.load(f)
+            return {'name': str(m['name']), 'module': __name__ + "." + subDir + "." + str(m['module']), 'class': str(m['class'])}
+        else:
+            extPackage = importlib.import_module(__name__ + "." + subDir)   #old style, results in module names like Extensions.Template
+            print "extension without " + MANIFEST_FILE + ":", subDir
+            return {'name': extPackage.extensionClass.extensionName, 'module': extPackage.__name__, 'class': 'extensionClass'}
     except Exception as e:
-        print "no valid extension package/folder:", sd, e
-        
-del localDir,localChilds,subDirs
+        print "no valid extension package/folder:", subDir, e
+        return None
+
+def findExtensions():
+    """returns the manifests of all extensions, reread only if the extension folders changed
+    """
+    global _manifestCache
+    
+    key = _mtimeKey()
+    if key != _manifestCache[0]:
+        manifests = []
+        for f in sorted(os.listdir(_localDir)):
+            if os.path.isdir(os.path.join(_localDir, f)):
+                m = _readManifest(f)
+                if m:
+                    manifests.append(m)
+        _manifestCache = (key, manifests)
+    return list(_manifestCache[1])
+
+def loadExtensionClass(manifest):
+    """imports the extension module, to be called in the extension process
+    """
+    module = importlib.import_module(manifest['module'])
+    return getattr(module, manifest['class'])
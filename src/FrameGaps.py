@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+Detection of gaps in the frame nr sequence delivered by the device. Frames
+dropped on the Bluetooth link are missing in the sequence, their rows in bio data
+stay zero. The GapTracker counts missing and duplicated frames and keeps a
+run-length index of the gaps: one entry (start frame nr, length) per gap.
+The index is stored as 'gapData' in the '.npz' log, see LogTools.loadGapData.
+"""
+
+import numpy as np
+
+GAP_DTYPE = np.dtype([('start_frame', np.uint32), ('length', np.uint32)])
+
+
+class GapTracker:
+    """
+    update() is called with every block of frame nrs in the order received.
+    The first frame nr expected is 0.
+    """
+    def __init__(self):
+        self.nextFrameNr = 0        #highest frame nr received + 1
+        self.missingFrames = 0
+        self.duplicateFrames = 0    #frame nrs received before (or older than the newest frame)
+        self._gapStarts = []        #arrays of gap start frame nrs, one per block with gaps
+        self._gapLengths = []
+        
+    def update(self, frameNrArr):
+        """returns the number of frames found missing in this block
+        """
+        frameNrArr = frameNrArr.astype(np.int64)
+        
+        #newest frame nr received before each frame
+        prevMax = np.maximum.accumulate(np.concatenate(([self.nextFrameNr - 1], frameNrArr)))[:-1]
+        step = frameNrArr - prevMax
+        
+        self.duplicateFrames += int(np.count_nonzero(step <= 0))
+        
+        isGap = step > 1
+        missing = 0
+        if isGap.any():
+            self._gapStarts.append(prevMax[isGap] + 1)
+            self._gapLengths.append(step[isGap] - 1)
+            missing = int(self._gapLengths[-1].sum())
+            self.missingFrames += missing
+        
+        self.nextFrameNr = max(self.nextFrameNr, int(frameNrArr.max()) + 1)
+        return missing
+    
+    def gapArray(self):
+        """returns the gap index as structured array with fields 'start_frame' and 'length', sorted by start frame
+        """
+        gaps = np.zeros(0, GAP_DTYPE)
+        if self._gapStarts:
+            gaps = np.zeros(sum(len(a) for a in self._gapStarts), GAP_DTYPE)
+            gaps['start_frame'] = np.concatenate(self._gapStarts)
+            gaps['length'] = np.concatenate(self._gapLengths)
+        return gaps
+    
+    def summary(self):
+        """dict for the log header
+        """
+        gaps = self.gapArray()
+        return {'missingFrames': self.missingFrames, 'duplicateFrames': self.duplicateFrames, 'gapCnt': len(gaps),
+                'longestGap_frames': int(gaps['length'].max()) if len(gaps) else 0}
+
+
+def gapMask(gapData, frameCnt):
+    """returns a bool array of frameCnt entries, True for frames missing according to gapData (see GAP_DTYPE)
+    """
+    marks = np.zeros(frameCnt + 1, np.int32)
+    starts = np.minimum(gapData['start_frame'].astype(np.int64), frameCnt)
+    ends = np.minimum(starts + gapData['length'], frameCnt)
+    np.add.at(marks, starts, 1)
+    np.add.at(marks, ends, -1)
+    return np.cumsum(marks[:-1]) > 0
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+This module provides a lock-free ring buffer for data frames in shared memory.
+There is a single producer (the device thread) writing frame blocks and any number
+of consumers (logging thread, live plot process, extension process), each with its
+own read cursor. Consumers get numpy views into the shared memory, nothing is
+copied or pickled.
+The producer never waits for a consumer. A consumer lagging more than the buffer
+capacity loses the oldest frames, which is counted in its overrun counter.
+"""
+
+import ctypes
+import time
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+import numpy as np
+
+from TimeBase import monotonic
+
+POLL_INTERVAL = 0.002   #sec, used by consumers waiting for new frames
+
+
+class FrameRingBuffer:
+    """
+    Shared memory of capacity frames x channelCnt uint16 values plus the frame nr and arrival time (monotonic) of every slot.
+    Can be passed to a multiprocessing.Process as argument.
+    """
+    def __init__(self, capacity, channelCnt):
+        self.capacity = int(capacity)
+        self.channelCnt = channelCnt
+
+        self._rawData = RawArray(ctypes.c_uint16, self.capacity * channelCnt)
+        self._rawFrameNr = RawArray(ctypes.c_uint32, self.capacity)
+        self._rawArrivalTime = RawArray(ctypes.c_double, self.capacity)
+        self._writeCount = RawValue(ctypes.c_long, 0)     #frames written in total, native word size so stores are atomic
+        self._writeBegin = RawValue(ctypes.c_long, 0)     #write count after the write in progress, ahead of _writeCount while copying
+        self._closed = RawValue(ctypes.c_bool, False)
+
+        self._initViews()
+
+    def _initViews(self):
+        self.data = np.frombuffer(self._rawData, np.uint16).reshape((self.capacity, self.channelCnt))
+        self.frameNr = np.frombuffer(self._rawFrameNr, np.uint32)
+        self.arrivalTime = np.frombuffer(self._rawArrivalTime, np.float64)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['data'], state['frameNr'], state['arrivalTime']    #numpy views are recreated in the other process
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._initViews()
+
+    def writeFrames(self, frameNrArr, dataBlock, arrivalTime=None):
+        """
+        To be called by the producer only.
+        The block is copied into the ring and published to the consumers afterwards.
+        arrivalTime: host time (TimeBase.monotonic) the block was received, now if None
+        """
+        if arrivalTime is None:
+            arrivalTime = monotonic()
+        n = len(frameNrArr)
+        if n > self.capacity:      #keep newest frames only
+            frameNrArr = frameNrArr[-self.capacity:]
+            dataBlock = dataBlock[-self.capacity:]
+            n = self.capacity
+
+        pos = self._writeCount.value
+        self._writeBegin.value = pos + n     #announce the slots about to be overwritten, see FrameRingReader.lastReadValid
+        start = pos % self.capacity
+        firstPart = min(n, self.capacity - start)
+
+        self.data[start:start+firstPart] = dataBlock[:firstPart]
+        self.frameNr[start:start+firstPart] = frameNrArr[:firstPart]
+        self.arrivalTime[start:start+firstPart] = arrivalTime
+        if firstPart < n:   #wrap around
+            self.data[:n-firstPart] = dataBlock[firstPart:]
+            self.frameNr[:n-firstPart] = frameNrArr[firstPart:]
+            self.arrivalTime[:n-firstPart] = arrivalTime
+
+        self._writeCount.value = pos + n     #publish
+
+    def writeCount(self):
+        return self._writeCount.value
+
+    def writeBeginCount(self):
+        """write count including a write in progress, equals writeCount() between writes
+        """
+        return self._writeBegin.value
+
+    def close(self):
+        """producer signals that no more frames will be written
+        """
+        self._closed.value = True
+
+    def isClosed(self):
+        return self._closed.value
+
+    def reader(self, startAtNewest=False):
+        """returns a new consumer with its own read cursor
+        """
+        return FrameRingReader(self, startAtNewest)
+
+
+class FrameRingReader:
+    """
+    Consumer side of FrameRingBuffer. Every consumer needs its own reader.
+    """
+    def __init__(self, ring, startAtNewest=False):
+        self.ring = ring
+        self.overrunFrames = 0      #frames lost because the producer overwrote them before they were read
+
+        if startAtNewest:
+            self.cursor = ring.writeCount()
+        else:
+            self.cursor = 0
+        self._lastReadStart = self.cursor
+        self._lastReadCnt = 0
+
+    def available(self):
+        """frames ready to be read, overrun frames are skipped
+        """
+        w = self.ring.writeCount()
+        if w - self.cursor > self.ring.capacity:
+            lost = w - self.cursor - self.ring.capacity
+            self.overrunFrames += lost
+            self.cursor += lost
+        return w - self.cursor
+
+    def wait(self, timeout):
+        """
+        blocks until frames are available, the ring is closed or timeout [sec] passed.
+        returns True if frames are available
+        """
+        tEnd = time.time() + timeout
+        while self.available() == 0:
+            if self.ring.isClosed() or time.time() > tEnd:
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    def read(self, maxFrames=None):
+        """
+        returns (frame nr array, data block) of the next contiguous frames as views into the shared memory,
+        (None, None) if no frames are available. Call repeatedly to get all available frames.
+        The views stay valid until the producer wraps around, see lastReadValid().
+        """
+        n = self.available()
+        if n == 0:
+            return (None, None)
+
+        start = self.cursor % self.ring.capacity
+        n = min(n, self.ring.capacity - start)
+        if maxFrames:
+            n = min(n, maxFrames)
+
+        self._lastReadStart = self.cursor
+        self._lastReadCnt = n
+        self.cursor += n
+
+        return (self.ring.frameNr[start:start+n], self.ring.data[start:start+n])
+
+    def lastReadArrivalTimes(self):
+        """arrival times of the frames returned by the last read (view, see read), frames of one block share the same time
+        """
+        start = self._lastReadStart % self.ring.capacity
+        return self.ring.arrivalTime[start:start+self._lastReadCnt]
+    
+    def skipToNewest(self, keepFrames=0):
+        """moves the cursor forward so that at most keepFrames are left to read, skipped frames are not counted as overrun
+        """
+        w = self.ring.writeCount()
+        self.cursor = max(self.cursor, w - keepFrames)
+
+    def lastReadValid(self):
+        """False if the producer may have overwritten the views returned by the last read,
+        also while it is copying into them (the write is announced before the slots are touched)
+        """
+        return self.ring.writeBeginCount() - self._lastReadStart <= self.ring.capacity
+
+    def lag(self):
+        """frames written but not read yet
+        """
+        return self.ring.writeCount() - self.cursor
@@ -26,42 +26,65 @@ from __future__ import division     #so integer division results in float
 import numpy as np
 import json
 import csv
-from matplotlib import pyplot as plt
-from matplotlib.backend_bases import MouseEvent
-import matplotlib.animation as animation
+import io
 import multiprocessing as mp
 import os
+import zipfile
 import MsgLogger
+from FrameGaps import GAP_DTYPE, gapMask
+from PlotDecimation import buildPyramid, loadPyramid
+from ChunkedLog import BLC_SUFFIX, CHUNK_SEC, ChunkedLogReader, writeLog
 
 plotProc = None
+EXPORT_CHUNK_FRAMES = 65536     #frames formatted and written at once
+CSV_LINE_END = "\r\n"          #csv.writer default
+NO_EVENT_TAIL = "\t-\t-" + CSV_LINE_END    #end of rows without events
+LOD_CACHE_SUFFIX = ".lod"      #min/max pyramid of the viewer, stored next to the log
+plt = None          #matplotlib is imported by the plot process on first use, exporting does not need it
+MouseEvent = None
+
+def _importMatplotlib():
+    global plt, MouseEvent
+    if plt is None:
+        from matplotlib import pyplot
+        from matplotlib.backend_bases import MouseEvent as mouseEventClass
+        plt = pyplot
+        MouseEvent = mouseEventClass
 
 class BioLinkRawDataPlot():
     vLineX = 0.0
     vLineXold = 0.0 #so animation function can detect change
     axVLines = []
     
-    def __init__(self,windowName,channelHeader,fs,data,serialEventData,extEventData):
+    def __init__(self,windowName,channelHeader,fs,data,serialEventData,extEventData,gapData=None,lodPyramid=None):
+        """lodPyramid: min/max pyramid of data (see loadLodPyramid), built if None
+        """
+        _importMatplotlib()
         channelCnt = len(channelHeader)
         frameCnt = data.shape[0]
         self.fs = fs
+        self.data = data
+        self.lod = lodPyramid if lodPyramid is not None else buildPyramid(data)
         xLabel = "time [s]"
         
         durationSec = frameCnt/fs
 #         print "durationSec:", durationSec
         
-        xData = np.arange(0.0,durationSec,1.0/fs)
-        
-        
         plt.ioff()      #interactive mode off, so plt.show() blocks until plot window is closed
         
         self.fig, self.axArr = plt.subplots(channelCnt+1,1,sharex=True)   #one plot more for events
         self.fig.canvas.set_window_title(windowName)
          
+        #lines show the min/max envelope of the visible range, see _updateLines
+        self.dataLines = []
         for i in range(channelCnt):
-            self.axArr[i].plot(xData,data[:,i])
+            self.dataLines.extend( self.axArr[i].plot([],[]) )
             self.axArr[i].set_ylabel(channelHeader[i])
             self.axVLines.append( self.axArr[i].axvline(self.vLineX,color='g',linestyle='dashed') )
         
+        if gapData is not None:
+            self._drawGaps(gapData)
+        
         
         self._drawEvents(serialEventData, 'b')   #blue        #TODO: legend
         self._drawEvents(extEventData,'k')       #black
@@ -70,20 +93,74 @@ class BioLinkRawDataPlot():
                  
         plt.xlabel(xLabel)                                      
         plt.tight_layout()
-        plt.xlim(0,xData[-1])
+        self._updateLines(0, durationSec)
+        for ax in self.axArr[:-1]:
+            ax.relim()
+            ax.autoscale_view()     #y range of the whole recording
+        plt.xlim(0,(frameCnt-1)/fs)
         
         plt.connect('button_press_event', self.onMouseClick)
+        self.axArr[0].callbacks.connect('xlim_changed', self.onXlimChanged)    #x axis is shared, called on every zoom and pan
+        plt.connect('resize_event', self.onResize)
         
 #         plt.connect('motion_notify_event', self.onMouseMove)
 #         self.cursorAni = animation.FuncAnimation(self.fig, self._updateCursor, frames=None,
 #                                     interval=100, blit=False)      #blit=True is much faster but zoom does not work anymore
 
+    def _updateLines(self, tStart, tEnd):
+        """
+        sets the line data to the visible range tStart ... tEnd [sec]: the pyramid level with about one bucket
+        per pixel, full resolution samples when zoomed in further
+        """
+        frameCnt = self.data.shape[0]
+        startFrame = max(int(tStart*self.fs) - 1, 0)
+        endFrame = min(int(tEnd*self.fs) + 2, frameCnt)
+        if endFrame <= startFrame:
+            return
+        pixelWidth = max(self.axArr[0].bbox.width, 1)
+        level = self.lod.levelFor((endFrame - startFrame) / pixelWidth)
+        
+        if level is None:
+            xData = np.arange(startFrame, endFrame) / self.fs
+            yBlock = self.data[startFrame:endFrame]
+        else:
+            (starts, mins, maxs) = self.lod.envelope(level, startFrame, endFrame)
+            #line through min and max of every bucket, both at the bucket center
+            xData = np.repeat((starts + self.lod.bucketFrames[level]/2) / self.fs, 2)
+            yBlock = np.empty((2*len(starts), mins.shape[1]), mins.dtype)
+            yBlock[0::2] = mins
+            yBlock[1::2] = maxs
+        
+        for i in range(len(self.dataLines)):
+            self.dataLines[i].set_data(xData, yBlock[:,i])
+    
+    def onXlimChanged(self, ax):
+        (tStart, tEnd) = ax.get_xlim()
+        self._updateLines(tStart, tEnd)
+        self.fig.canvas.draw_idle()
+        
+    def onResize(self, event):
+        self.onXlimChanged(self.axArr[0])
+        
+    def _drawGaps(self,gapData):
+        """shades frames missing in the recording (see FrameGaps) in all channel plots
+        """
+        for gap in gapData:
+            tStart = gap['start_frame']/self.fs
+            tEnd = (gap['start_frame'] + gap['length'])/self.fs
+            for ax in self.axArr[:-1]:
+                ax.axvspan(tStart, tEnd, color='r', alpha=0.3, linewidth=0)
+        
     def _drawEvents(self,eventData, color='k'):
         vlineYtop = 1.0
         textPosY = vlineYtop + 0.2
         eventTimeList = []
-        for ev in eventData:    #ev are tuples of shape (framenr, text)
-            evTime = ev[0]/self.fs
+        hasFramePos = eventData.dtype.names is not None and 'frame_pos' in eventData.dtype.names   #fractional frame nr of serial events
+        for ev in eventData:    #ev are tuples of shape (framenr, text, ...)
+            if hasFramePos:
+                evTime = ev['frame_pos']/self.fs
+            else:
+                evTime = ev[0]/self.fs
             eventTimeList.append(evTime)
             
             self.axArr[-1].text(evTime,textPosY,ev[1], rotation=70, rotation_mode='anchor', color=color, horizontalalignment='left',verticalalignment='center', clip_on=True)
@@ -106,29 +183,153 @@ class BioLinkRawDataPlot():
 
                 self.fig.canvas.draw()
 
-def _plotProcessFnc(windowName, pluxChannelHeader, fs, bioData, serialEventData, extEventData):
+class NpzMemberArray:
+    """
+    Array stored in a '.npz' file, decompressed on first access to its content.
+    shape and dtype are read from the header of the member only.
+    """
+    def __init__(self, npzPath, name):
+        self.npzPath = npzPath
+        self.name = name
+        self._array = None
+        
+        zf = zipfile.ZipFile(npzPath)
+        try:
+            f = zf.open(name + '.npy')
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                (self.shape, fortranOrder, self.dtype) = np.lib.format.read_array_header_1_0(f)
+            else:
+                (self.shape, fortranOrder, self.dtype) = np.lib.format.read_array_header_2_0(f)
+            f.close()
+        finally:
+            zf.close()
+    
+    def load(self):
+        if self._array is None:
+            self._array = np.load(self.npzPath)[self.name]
+        return self._array
+    
+    def __getitem__(self, key):
+        return self.load()[key]
+    
+    def __len__(self):
+        return self.shape[0]
+
+def logFilePath(targetBaseName):
+    """returns 'targetBaseName.blc' if it exists, 'targetBaseName.npz' otherwise
+    """
+    if os.path.isfile(targetBaseName + BLC_SUFFIX):
+        return targetBaseName + BLC_SUFFIX
+    return targetBaseName + '.npz'
+
+def _openLog(targetBaseName):
+    """returns the arrays of the log (ChunkedLogReader or np.load of the '.npz'), files lists their names
+    """
+    path = logFilePath(targetBaseName)
+    if path.endswith(BLC_SUFFIX):
+        return ChunkedLogReader(path)
+    return np.load(path)
+
+def loadBioLinkData(targetBaseName, lazy=False):
+    """
+    returns (channelHeader, bioData, serialEventData, extEventData) of 'targetBaseName.blc' or 'targetBaseName.npz'
+    bio data of a '.blc' is a ChunkedArray, chunks are decompressed when they are accessed
+    bio data recorded with ExpController.streamToDisk is stored in a separate '.npy' file, it is memory-mapped
+    lazy: bio data stored in the '.npz' is returned as NpzMemberArray, decompressed when it is accessed
+    """
+    data = _openLog(targetBaseName)
+    if isinstance(data, ChunkedLogReader):
+        bioData = data.bioData
+    elif 'bioData' in data.files:
+        if lazy:
+            bioData = NpzMemberArray(targetBaseName + '.npz', 'bioData')
+        else:
+            bioData = data['bioData']
+    else:
+        bioDataPath = os.path.join(os.path.dirname(targetBaseName), str(data['bioDataFile']))
+        bioData = np.load(bioDataPath, mmap_mode='r')
+    
+    return (data['channelHeader'], bioData, data['serialEventData'], data['extensionEventData'])
+
+def loadGapData(targetBaseName):
+    """
+    returns the gap index of the log: structured array with one entry (start_frame, length) per gap
+    of frames missing in the recording. Logs without gap index return an empty array.
+    """
+    data = _openLog(targetBaseName)
+    if 'gapData' in data.files:
+        return data['gapData']
+    return np.zeros(0, GAP_DTYPE)
+
+def loadGapMask(targetBaseName, frameCnt):
+    """returns a bool array of frameCnt entries, True for frames missing in the recording (rows are zero)
+    e.g. bioData[~loadGapMask(name, len(bioData))] contains only received frames
+    """
+    return gapMask(loadGapData(targetBaseName), frameCnt)
+
+def loadLodPyramid(targetBaseName, bioData):
+    """
+    returns the min/max pyramid of bioData (see PlotDecimation.MinMaxPyramid) cached in 'targetBaseName.lod'.
+    The cache is built if missing, older than the log or not matching bioData.
+    """
+    cachePath = targetBaseName + LOD_CACHE_SUFFIX
+    try:
+        if os.path.getmtime(cachePath) >= os.path.getmtime(logFilePath(targetBaseName)):
+            lod = loadPyramid(cachePath)
+            if lod.frameCnt == bioData.shape[0] and lod.mins[0].shape[1:] == bioData.shape[1:]:
+                return lod
+    except Exception:
+        pass    #no valid cache
+    
+    lod = buildPyramid(bioData)
+    try:
+        lod.save(cachePath)
+    except (IOError, OSError) as e:
+        print "LOD cache not written:", e     #e.g. read-only log dir, built again next time
+    return lod
+
+def _plotProcessFnc(targetBaseName, fs):
+    """the recording is opened in the plot process only, bio data is loaded when it is accessed (see loadBioLinkData)
+    """
 #     print "_plotProcessFnc"
-    rawPlot = BioLinkRawDataPlot(windowName, pluxChannelHeader, fs, bioData, serialEventData, extEventData)
+    try:
+        (channelHeader, bioData, serialEventData, extEventData) = loadBioLinkData(targetBaseName, lazy=True)
+        gapData = loadGapData(targetBaseName)
+    except Exception as e:
+        print "Error opening log file:", e
+        return
+    
+    lod = loadLodPyramid(targetBaseName, bioData)
+    windowName = os.path.basename(logFilePath(targetBaseName))
+    rawPlot = BioLinkRawDataPlot(windowName, channelHeader, fs, bioData, serialEventData, extEventData, gapData, lod)
     rawPlot.show()
 
 def plotBioLinkData(targetBaseName):
+    """
+    opens the plot window of the log in a separate process, only the base name is passed to it.
+    The GUI process only checks the log files, it does not load the recording.
+    """
     global plotProc
 #     print "plotBioLinkData:",targetBaseName
 
     success = True
 
     try:
-        data = np.load(targetBaseName + '.npz')
-        bioData = data['bioData']
-        serialEventData = data['serialEventData']
-        extEventData = data['extensionEventData']
-        channelHeader = data['channelHeader']
+        if logFilePath(targetBaseName).endswith(BLC_SUFFIX):
+            ChunkedLogReader(logFilePath(targetBaseName))    #reads the header only
+        else:
+            with np.load(targetBaseName + '.npz') as data:     #reads the file list only
+                if 'bioDataFile' in data.files:
+                    bioDataPath = os.path.join(os.path.dirname(targetBaseName), str(data['bioDataFile']))
+                    if not os.path.isfile(bioDataPath):
+                        raise IOError("bio data file '" + bioDataPath + "' not found")
+                elif 'bioData' not in data.files:
+                    raise IOError("no bio data in file")
     except Exception as e:
-        MsgLogger.append("Error opening '.npz' file: " + str(e) )
+        MsgLogger.append("Error opening log file: " + str(e) )
         success = False
     
-    
-    
     try:
         with open(targetBaseName + '.json','r') as f:
             headerDict = json.load(f)
@@ -142,8 +343,7 @@ def plotBioLinkData(targetBaseName):
         success = False
         
     if success:
-        windowName = os.path.basename(targetBaseName) + '.npz'
-        plotProc = mp.Process(target=_plotProcessFnc, args = (windowName, channelHeader, fs, bioData, serialEventData, extEventData))
+        plotProc = mp.Process(target=_plotProcessFnc, args = (targetBaseName, fs))
         plotProc.daemon=True
         plotProc.start()
 
@@ -154,17 +354,13 @@ def terminatePlotProcess():
         plotProc.terminate()
 
 def exportTxt(targetBaseName,destinationName):
-    """targetBaseName to find 'basename.npz' and 'basename.json'
+    """targetBaseName to find 'basename.blc' or 'basename.npz' and 'basename.json'
     destinationName should end in .txt
     
     If multiple event arrived on one were logged on the same frame, the strings are concatenated by semicolons (;).
     """
     
-    data = np.load(targetBaseName + '.npz')
-    bioData = data['bioData']
-    serialEventData = data['serialEventData']
-    extEventData = data['extensionEventData']
-    channelHeader = data['channelHeader']
+    (channelHeader, bioData, serialEventData, extEventData) = loadBioLinkData(targetBaseName)
     
     totalFrameCnt = bioData.shape[0]
     totalSerialEventCnt = serialEventData.shape[0]   
@@ -217,45 +413,177 @@ def exportTxt(targetBaseName,destinationName):
     columnHdr = columnHdr + '\tSerialEvent' + "\tExtensionEvent"
     appendHeaderLine(columnHdr)
         
+    (serialFrames, serialStrs, serialEventIndex) = _eventColumn(serialEventData, totalFrameCnt)
+    (extFrames, extStrs, extEventIndex) = _eventColumn(extEventData, totalFrameCnt)
+    
     with open(destinationName,'wb') as f:
         f.write(exportTxt.header)
-        csvWriter = csv.writer(f,delimiter='\t')
-        
-        serialEventIndex = 0
-        extEventIndex = 0
         
-        for i in range(totalFrameCnt):
-            logRow = [i] + bioData[i].tolist()
-            
-            serEventStr = ""
-            while serialEventIndex < totalSerialEventCnt and serialEventData[serialEventIndex][0] == i:
-                if serEventStr != "":
-                    serEventStr = serEventStr + ";"     #separate different events for same frame nr with ';'
-                serEventStr = serEventStr + serialEventData[serialEventIndex][1]
-                serialEventIndex += 1
-                    
-            if serEventStr != "":
-                logRow.append( serEventStr.replace(" ", "_") )
-            else:
-                logRow.append('-')
-            
-            
-            extEventStr = ""
-            while extEventIndex < totalExtEventCnt and extEventData[extEventIndex][0] == i:     #concatenate all extEvents with this frame nr
-                if extEventStr != "":
-                    extEventStr = extEventStr + ";"     #separate different events for same frame nr with ';'
-                extEventStr = extEventStr + extEventData[extEventIndex][1]
-                extEventIndex += 1
-                
-            if extEventStr != "":
-                logRow.append( extEventStr.replace(" ", "_") )
-            else:
-                logRow.append('-')
-                
-            csvWriter.writerow(logRow)
+        for chunkStart in range(0, totalFrameCnt, EXPORT_CHUNK_FRAMES):
+            chunkEnd = min(chunkStart + EXPORT_CHUNK_FRAMES, totalFrameCnt)
+            f.write(_formatRows(chunkStart, bioData[chunkStart:chunkEnd], serialFrames, serialStrs, extFrames, extStrs))
             
         if serialEventIndex != serialEventData.shape[0]:
             MsgLogger.append( "Some events occured after the latest sample in the data set.: " + str( serialEventData[serialEventIndex] ) )   
+
+def exportEdf(targetBaseName, destinationName):
+    """targetBaseName to find 'basename.blc' or 'basename.npz' and 'basename.json'
+    destinationName should end in .edf
+    
+    Writes an EDF+ file, see EdfWriter. Serial and extension events become annotations ('serial: ...', 'ext: ...'),
+    gaps in the recording become annotations with duration. Bio data is read and written in chunks.
+    """
+    import time
+    from EdfWriter import EdfWriter
+    
+    (channelHeader, bioData, serialEventData, extEventData) = loadBioLinkData(targetBaseName)
+    gapData = loadGapData(targetBaseName)
+    
+    with open(targetBaseName + '.json','r') as f:
+        headerDict = json.load(f)
+    fs = headerDict['fs']
+    
+    startTime = None
+    if 'dateStr' in headerDict:
+        try:
+            startTime = time.strptime(str(headerDict['dateStr']), "%d/%m/%Y %H:%M")
+        except ValueError:
+            pass
+    
+    totalFrameCnt = bioData.shape[0]
+    lastOnset = max(totalFrameCnt - 1, 0) / fs      #events after the latest sample are put on it
+    annotations = []
+    for (eventData, prefix) in ((serialEventData, "serial: "), (extEventData, "ext: ")):
+        if len(eventData) == 0:
+            continue
+        if 'frame_pos' in eventData.dtype.names:
+            onsets = eventData['frame_pos'] / fs
+        else:
+            onsets = eventData[eventData.dtype.names[0]] / fs
+        for (onset, eventStr) in zip(np.clip(onsets, 0, lastOnset), eventData[eventData.dtype.names[1]]):
+            annotations.append((float(onset), None, prefix + str(eventStr)))
+    for gap in gapData:
+        if gap['start_frame'] < totalFrameCnt:
+            annotations.append((gap['start_frame'] / fs, gap['length'] / fs, "gap: " + str(gap['length']) + " frames missing"))
+    
+    writer = EdfWriter(destinationName, [str(h) for h in channelHeader], fs, annotations,
+                       headerDict.get('subjectId'), headerDict.get('experimentId'), startTime)
+    try:
+        for chunkStart in range(0, totalFrameCnt, EXPORT_CHUNK_FRAMES):
+            writer.writeFrames(bioData[chunkStart:chunkStart + EXPORT_CHUNK_FRAMES])
+    finally:
+        writer.close()
+
+def exportBlc(targetBaseName, destinationName):
+    """converts the log to the chunked native format (see ChunkedLog), e.g. an '.npz' log
+    destinationName should end in .blc, 'basename.json' is copied next to it
+    """
+    if os.path.abspath(destinationName) == os.path.abspath(logFilePath(targetBaseName)):
+        raise ValueError("source and destination are the same file")
+    data = _openLog(targetBaseName)
+    (channelHeader, bioData, serialEventData, extEventData) = loadBioLinkData(targetBaseName)
+    with open(targetBaseName + '.json','r') as f:
+        headerDict = json.load(f)
+    
+    arrays = dict((name, data[name]) for name in data.files if name not in ('bioData', 'bioDataFile'))
+    writeLog(destinationName, bioData, arrays, CHUNK_SEC * headerDict['fs'])
+    
+    destinationBaseName = os.path.splitext(destinationName)[0]
+    if os.path.abspath(destinationBaseName) != os.path.abspath(targetBaseName):
+        headerDict.pop('bioDataFile', None)
+        with open(destinationBaseName + '.json','w') as f:
+            json.dump(headerDict, f, indent=2, )
+    
+def _eventColumn(eventData, totalFrameCnt):
+    """
+    returns (frame nrs, cell strings, exported event count) of the frames with events, ascending.
+    Events of one frame are concatenated by ';'. Events are exported in order until the first one with a frame nr
+    lower than its predecessor or outside the data, all following events are left out (as the frame-by-frame export did).
+    """
+    if len(eventData) == 0:
+        return (np.zeros(0, np.int64), [], 0)
+    frameNrs = eventData[eventData.dtype.names[0]].astype(np.int64)
+    eventStrs = eventData[eventData.dtype.names[1]]
+    
+    invalid = (frameNrs < 0) | (frameNrs >= totalFrameCnt)
+    invalid[1:] |= frameNrs[1:] < frameNrs[:-1]
+    exportCnt = np.argmax(invalid) if invalid.any() else len(frameNrs)
+    frameNrs = frameNrs[:exportCnt]
+    
+    (cellFrames, firstIndex) = np.unique(frameNrs, return_index=True)
+    lastIndex = np.append(firstIndex[1:], exportCnt)
+    cells = []
+    for (a, b) in zip(firstIndex, lastIndex):
+        eventStr = ""
+        for e in eventStrs[a:b]:
+            if eventStr != "":
+                eventStr = eventStr + ";"     #separate different events for same frame nr with ';'
+            eventStr = eventStr + e
+        if eventStr != "":
+            cells.append(_csvCell(eventStr.replace(" ", "_")))
+        else:
+            cells.append('-')
+    return (cellFrames, cells, exportCnt)
+
+def _csvCell(s):
+    """s formatted as a tab separated csv field, quoted if needed
+    """
+    buf = io.BytesIO()
+    csv.writer(buf, delimiter='\t').writerow([s])
+    return buf.getvalue()[:-len(CSV_LINE_END)]
+
+def _digits(values, width):
+    """
+    returns uint8 array (len(values), width) with the decimal digits of values (ascii), leading zeros replaced by 0 bytes
+    """
+    values = values.astype(np.int64)
+    digits = np.empty((len(values), width), np.uint8)
+    for k in range(width):
+        power = 10 ** (width - 1 - k)
+        digits[:,k] = values // power % 10 + ord('0')
+        if k < width - 1:
+            digits[values < power, k] = 0   #leading zero
+    return digits
+
+def _formatRows(firstFrameNr, dataBlock, serialFrames, serialStrs, extFrames, extStrs):
+    """
+    returns the text of the rows of dataBlock: frame nr, channels, serial event, extension event, tab separated
+    The rows are built as one byte matrix, 0 bytes (leading zeros) are removed at the end. Rows with events are patched.
+    """
+    frameCnt = dataBlock.shape[0]
+    frameNrs = np.arange(firstFrameNr, firstFrameNr + frameCnt)
+    valueWidth = len(str(np.iinfo(dataBlock.dtype).max))
+    
+    columns = [_digits(frameNrs, len(str(frameNrs[-1])))]
+    for ch in range(dataBlock.shape[1]):
+        columns.append(np.tile(np.uint8(ord('\t')), (frameCnt, 1)))
+        columns.append(_digits(dataBlock[:,ch], valueWidth))
+    columns.append(np.tile(np.fromstring(NO_EVENT_TAIL, np.uint8), (frameCnt, 1)))
+    rows = np.hstack(columns)
+    
+    text = rows[rows != 0].tostring()
+    
+    #rows with events: replace the '-' of the event columns
+    serialRange = np.searchsorted(serialFrames, [firstFrameNr, firstFrameNr + frameCnt])
+    extRange = np.searchsorted(extFrames, [firstFrameNr, firstFrameNr + frameCnt])
+    if serialRange[1] > serialRange[0] or extRange[1] > extRange[0]:
+        rowEnds = np.cumsum(np.count_nonzero(rows, axis=1))
+        eventCells = {}     #frame nr: [serial cell, extension cell]
+        for i in range(serialRange[0], serialRange[1]):
+            eventCells.setdefault(serialFrames[i], ['-', '-'])[0] = serialStrs[i]
+        for i in range(extRange[0], extRange[1]):
+            eventCells.setdefault(extFrames[i], ['-', '-'])[1] = extStrs[i]
+        
+        pieces = []
+        pos = 0
+        for frameNr in sorted(eventCells):
+            rowEnd = rowEnds[frameNr - firstFrameNr]
+            pieces.append(text[pos:rowEnd - len(NO_EVENT_TAIL)])
+            pieces.append("\t" + eventCells[frameNr][0] + "\t" + eventCells[frameNr][1] + CSV_LINE_END)
+            pos = rowEnd
+        pieces.append(text[pos:])
+        text = "".join(pieces)
+    return text
     
     
 if __name__ == '__main__':
@@ -36,6 +36,7 @@ import Queue
 msgLogQueue = Queue.Queue()
 viewAppendFnc = None
 logfilePath = None
+printToConsole = True   #False: messages go to the log file (and view) only
 
 #class MsgLogger(threading.Thread):
 #    
@@ -59,7 +60,8 @@ def msgLoop():
     while True:
         try:
             msg = msgLogQueue.get(True, 0.1)    #blocking, 0.1 sec timeout
-            msg = msg.encode('ascii', 'ignore')
+            if isinstance(msg,unicode):
+                msg = msg.encode('ascii', 'ignore')
 
             if isinstance(msg,str):
                 msgAction(logFile,msg)
@@ -89,7 +91,8 @@ def init(path='log/MsgLog.txt'):
     msgLoggerThread.start()
     
 def msgAction(logFile,msg):
-    print msg
+    if printToConsole:
+        print msg
 
     logFile.write(msg + "\n")
     
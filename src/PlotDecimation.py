@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+This module reduces frames to min/max envelopes for display. Frames are grouped
+into buckets of bucketFrames consecutive frame nrs (bucket i covers frame nrs
+i*bucketFrames ... (i+1)*bucketFrames-1), only the min and max of every channel is
+kept per bucket. Drawn as a line through min and max of every bucket, the envelope
+looks like the full data as long as a bucket is not wider than a pixel.
+MinMaxPyramid keeps the envelopes of a whole recording at several bucket sizes,
+so the offline viewer (LogTools) draws about one bucket per pixel at any zoom level.
+"""
+
+import numpy as np
+
+
+def minMaxReduce(frameNrArr, dataBlock, bucketFrames):
+    """
+    returns (bucket start frame nr array, min block, max block) with one row per bucket present in frameNrArr
+    frames of one bucket have to be consecutive in frameNrArr (e.g. ascending frame nrs)
+    """
+    bucketStart = frameNrArr.astype(np.int64) // bucketFrames * bucketFrames
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucketStart)) + 1))
+    return (bucketStart[starts], np.minimum.reduceat(dataBlock, starts, axis=0), np.maximum.reduceat(dataBlock, starts, axis=0))
+
+
+class MinMaxDecimator:
+    """
+    Reduces a stream of frame blocks to min/max envelopes block by block.
+    A bucket is returned once it is complete, i.e. its last frame or a frame of a later bucket was received.
+    """
+    def __init__(self, channelCnt):
+        self.channelCnt = channelCnt
+        self.bucketFrames = 1
+        self._pending = None    #(bucket start frame nr, min row, max row) of the bucket not complete yet
+
+    def feed(self, frameNrArr, dataBlock, bucketFrames=None):
+        """
+        returns (bucket start frame nr array, min block, max block) of the buckets completed by this block, None if there are none
+        bucketFrames can change from block to block, e.g. when the plot is resized
+        """
+        parts = []
+        if bucketFrames and bucketFrames != self.bucketFrames:
+            parts.append(self._takePending())
+            self.bucketFrames = bucketFrames
+
+        (starts, mins, maxs) = minMaxReduce(frameNrArr, dataBlock, self.bucketFrames)
+        if self._pending is not None:
+            (pStart, pMin, pMax) = self._pending
+            if pStart == starts[0]:      #block continues the pending bucket
+                mins[0] = np.minimum(mins[0], pMin)
+                maxs[0] = np.maximum(maxs[0], pMax)
+                self._pending = None
+            else:
+                parts.append(self._takePending())
+
+        if (int(frameNrArr[-1]) + 1) % self.bucketFrames == 0:     #last bucket complete
+            parts.append((starts, mins, maxs))
+        else:
+            parts.append((starts[:-1], mins[:-1], maxs[:-1]))
+            self._pending = (starts[-1], mins[-1].copy(), maxs[-1].copy())
+        return _joinParts(parts)
+
+    def flush(self):
+        """returns the incomplete last bucket like feed, None if there is none
+        """
+        return _joinParts([self._takePending()])
+
+    def _takePending(self):
+        if self._pending is None:
+            return None
+        (start, pMin, pMax) = self._pending
+        self._pending = None
+        return (np.array([start]), pMin[np.newaxis], pMax[np.newaxis])
+
+
+def _joinParts(parts):
+    parts = [p for p in parts if p is not None and len(p[0]) > 0]
+    if len(parts) == 0:
+        return None
+    return tuple(np.concatenate([p[i] for p in parts]) for i in range(3))
+
+
+PYRAMID_BASE_FRAMES = 16        #bucket size of the finest level
+PYRAMID_FACTOR = 4              #bucket size ratio of consecutive levels
+PYRAMID_MAX_TOP_BUCKETS = 4096  #levels are added until the coarsest one has at most this many buckets
+PYRAMID_CHUNK_FRAMES = 2**20    #frames reduced at once while building, multiple of PYRAMID_BASE_FRAMES
+
+
+class MinMaxPyramid:
+    """
+    Min/max envelopes of a whole recording at several resolutions (levels of detail).
+    Level i has buckets of PYRAMID_BASE_FRAMES * PYRAMID_FACTOR**i frames, bucket j starts at frame nr j*bucketFrames.
+    """
+    def __init__(self, frameCnt, bucketFrames, mins, maxs):
+        """bucketFrames, mins, maxs: one entry per level, finest first
+        """
+        self.frameCnt = frameCnt
+        self.bucketFrames = list(bucketFrames)
+        self.mins = list(mins)
+        self.maxs = list(maxs)
+
+    def levelFor(self, framesPerPixel):
+        """returns the coarsest level with at least one bucket per pixel, None if full resolution is needed
+        """
+        level = None
+        for i in range(len(self.bucketFrames)):
+            if self.bucketFrames[i] <= framesPerPixel:
+                level = i
+        return level
+
+    def envelope(self, level, startFrame, endFrame):
+        """
+        returns (bucket start frame nr array, min block, max block) of the buckets of level
+        overlapping frames startFrame ... endFrame-1
+        """
+        bucketFrames = self.bucketFrames[level]
+        first = max(int(startFrame) // bucketFrames, 0)
+        end = max(min(-(-int(endFrame) // bucketFrames), len(self.mins[level])), first)
+        return (np.arange(first, end, dtype=np.int64) * bucketFrames, self.mins[level][first:end], self.maxs[level][first:end])
+
+    def save(self, path):
+        """writes the pyramid to path, written as is (np.savez to a file object adds no '.npz')
+        """
+        arrays = {'frameCnt': np.array(self.frameCnt), 'bucketFrames': np.array(self.bucketFrames)}
+        for i in range(len(self.bucketFrames)):
+            arrays['mins_' + str(i)] = self.mins[i]
+            arrays['maxs_' + str(i)] = self.maxs[i]
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+
+def loadPyramid(path):
+    data = np.load(path)
+    bucketFrames = [int(b) for b in data['bucketFrames']]
+    return MinMaxPyramid(int(data['frameCnt']), bucketFrames,
+                         [data['mins_' + str(i)] for i in range(len(bucketFrames))],
+                         [data['maxs_' + str(i)] for i in range(len(bucketFrames))])
+
+
+def buildPyramid(data):
+    """
+    returns the MinMaxPyramid of data (frames x channels, e.g. memory-mapped), read in chunks of PYRAMID_CHUNK_FRAMES
+    """
+    frameCnt = data.shape[0]
+    mins = []
+    maxs = []
+    for chunkStart in range(0, frameCnt, PYRAMID_CHUNK_FRAMES):
+        chunk = np.asarray(data[chunkStart:chunkStart + PYRAMID_CHUNK_FRAMES])
+        starts = np.arange(0, len(chunk), PYRAMID_BASE_FRAMES)
+        mins.append(np.minimum.reduceat(chunk, starts, axis=0))
+        maxs.append(np.maximum.reduceat(chunk, starts, axis=0))
+    if frameCnt == 0:
+        mins.append(np.zeros((0,) + data.shape[1:], data.dtype))
+        maxs.append(np.zeros((0,) + data.shape[1:], data.dtype))
+
+    bucketFrames = [PYRAMID_BASE_FRAMES]
+    levelMins = [np.concatenate(mins)]
+    levelMaxs = [np.concatenate(maxs)]
+    while len(levelMins[-1]) > PYRAMID_MAX_TOP_BUCKETS:
+        starts = np.arange(0, len(levelMins[-1]), PYRAMID_FACTOR)
+        levelMins.append(np.minimum.reduceat(levelMins[-1], starts, axis=0))
+        levelMaxs.append(np.maximum.reduceat(levelMaxs[-1], starts, axis=0))
+        bucketFrames.append(bucketFrames[-1] * PYRAMID_FACTOR)
+    return MinMaxPyramid(frameCnt, bucketFrames, levelMins, levelMaxs)
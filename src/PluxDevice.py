@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+This module contains the device class for Plux hardware. It imports the plux driver,
+so it is only imported by PluxInterface when a real device is opened or searched.
+"""
+import sys
+sys.path.append(r"C:\Plux\OpenSignals (r)evolution\resources\app\code\modules\WIN32")     #path of plux library
+try:
+    import plux
+except ImportError:
+    plux = None     #dummy devices can be used without plux library
+import threading
+
+from PluxInterface import FrameBlockStager
+
+
+class Device(plux.MemoryDev if plux else object, FrameBlockStager):
+    """
+        a frame sink has to be assinged to frameSink
+        data frames received from the device are staged and written to the
+        sink in blocks, see FrameBlockStager.
+        reception from device
+    """
+    stopRequest = threading.Event()
+    
+    def start(self, fs, channelMask, bitsResolution):
+        self.initBlock(bin(channelMask).count("1"))     #count '1' in string representation
+        plux.MemoryDev.start(self, fs, channelMask, bitsResolution)
+
+    # callbacks override
+    def onRawFrame(self, nSeq, data):
+        if self.frameSink:    #not None
+            self.stageFrame(nSeq, data)
+        
+            if self.stopRequest.isSet():
+                self.flushBlock()   #send frames staged so far
+                return True
+            else:
+                return False
+        else:
+            print "onRawFrame: ending because no frame sink registered"
+            return True     #ends aquisition
+            
+        return False
+        
+    def endAquisition(self):
+        """ends aquisition, leads loop() method to end
+        """
+        self.stopRequest.set()
+        
+    def getBatteryStr(self):
+        bat = self.getBattery()
+        if bat == -1.0:
+            bat = "charging"
+        else:
+            bat = "%.0f %%" % bat
+        return bat
+
+
+def enumDevices():
+    """ returns ((path string, descpription string),(...))
+    """
+    if plux is None:
+        raise Exception("Plux library not available.")
+    return plux.BaseDev.findDevices()
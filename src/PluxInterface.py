@@ -18,99 +18,182 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 -----------------------------------------------------------------
-This module provides the interface class to communicate with Plux devices.
+This module provides the interface to communicate with Plux devices.
+The plux driver is only loaded when a real device is used, see PluxDevice.
 """
-import sys
-sys.path.append(r"C:\Plux\OpenSignals (r)evolution\resources\app\code\modules\WIN32")     #path of plux library
-import plux
 import threading
 import time
-import math
+import numpy as np
 
+from TimeBase import monotonic
 
 
-class Device(plux.MemoryDev):
+
+class FrameBlockStager:
     """
-        one end of a pipe has to be assinged to pipeConn
-        tuples are sent through the pipe for every data frame received from the
-        device. Tuples: (frame_nr, data_from_all_channels)
-        reception from device
+        Stages single data frames into a preallocated numpy block.
+        The block is written to frameSink as one unit when it is full or when
+        blockMaxDelay [sec] has passed since the first frame of the block was staged.
+        frameSink.writeFrames(frame_nr_array, data_block) is called, data_block has shape (frames, channels)
     """
-    pipeConn = None
-    stopRequest = threading.Event()
-
-    # callbacks override
-    def onRawFrame(self, nSeq, data):
-        tup = (nSeq, data)
-        if self.pipeConn:    #not None
-            self.pipeConn.send(tup)        
-        
-            if self.stopRequest.isSet():
-                return True
-            else:
-                return False
-        else:
-            print "onRawFrame: ending because no pipe registered"
-            return True     #ends aquisition
-            
-        return False
+    frameSink = None    #e.g. FrameRingBuffer
+    blockSize = 50          #frames per block
+    blockMaxDelay = 0.05    #sec, max latency added by staging
+    
+    def initBlock(self, channelCnt):
+        self._blockSeq = np.zeros(self.blockSize, np.uint32)
+        self._blockData = np.zeros((self.blockSize, channelCnt), np.uint16)
+        self._blockFill = 0
+        self._blockStartTime = 0.0
         
-    def endAquisition(self):
-        """ends aquisition, leads loop() method to end
-        """
-        self.stopRequest.set()
+    def stageFrame(self, nSeq, data):
+        if self._blockFill == 0:
+            self._blockStartTime = monotonic()
+        self._blockSeq[self._blockFill] = nSeq
+        self._blockData[self._blockFill] = data
+        self._blockFill += 1
         
-    def getBatteryStr(self):
-        bat = self.getBattery()
-        if bat == -1.0:
-            bat = "charging"
-        else:
-            bat = "%.0f %%" % bat
-        return bat
-      
+        if self._blockFill >= self.blockSize or monotonic() - self._blockStartTime >= self.blockMaxDelay:
+            self.flushBlock()
+            
+    def flushBlock(self):
+        if self._blockFill > 0:
+            #slices are copied by the sink, the staging block can be reused right away
+            self.frameSink.writeFrames(self._blockSeq[:self._blockFill], self._blockData[:self._blockFill])
+            self._blockFill = 0
+            
+
 # pluxDevice.start(fs, channelMask, bitsResolution)   # 1000 Hz, ports 1-8, 16 bits                
 #     pluxDevice.loop()   #blocks 
 #     print "Plux device loop terminated"
 #     pluxDevice.stop()  
 # pluxDevice.close()
 
-class DummyDevice():
-    pipeConn = None
+SYNTHETIC_MAX_FS = 10000      #Hz, max. sample rate of the dummy device
+SCR_MEAN_INTERVAL = 15.0        #sec, mean time between skin conductance responses of the dummy EDA signal
+
+#ECG waves (P,Q,R,S,T): phase relative to R peak, amplitude, width, in cardiac cycles
+ECG_WAVES = ((-0.2, 0.12, 0.025), (-0.03, -0.15, 0.01), (0.0, 1.0, 0.012), (0.03, -0.25, 0.01), (0.3, 0.3, 0.05))
+#BVP pulse: systolic and diastolic peak, delayed to the R peak by the pulse transit time
+BVP_WAVES = ((0.25, 1.0, 0.08), (0.55, 0.4, 0.1))
+
+def isSyntheticAddr(addr):
+    """True for "dummy" and "dummy:<seed>"
+    """
+    return addr == "dummy" or addr.startswith("dummy:")
+
+def _waves(phase, waves):
+    """sum of gaussian waves over the cardiac phase (0..1)
+    """
+    s = np.zeros(len(phase))
+    for (center, amplitude, width) in waves:
+        d = (phase - center + 0.5) % 1.0 - 0.5
+        s += amplitude * np.exp(-d*d / (2*width*width))
+    return s
+
+
+class SyntheticSignals:
+    """
+        Generates ECG, EDA, BVP and noise signals in blocks, one signal type per channel in this order (repeated).
+        All random numbers are drawn from generators seeded with seed, so the data does not depend on
+        the block sizes: same seed, sample rate and channel count give the same data (up to rounding).
+    """
+    def __init__(self, fs, channelCnt, dataMax, seed=None):
+        self.fs = float(fs)
+        self.channelCnt = channelCnt
+        self.dataMax = dataMax
+        
+        self.noiseRandom = np.random.RandomState(seed)
+        self.eventRandom = np.random.RandomState(None if seed is None else seed + 1)
+        self.heartRate = 60 + self.eventRandom.uniform(0, 20)  #bpm
+        
+        self.sampleNr = 0
+        self.cardiacPhase = 0.0
+        self.scrList = []       #(onset time, amplitude) of SCRs still visible
+        self.nextScrTime = self.eventRandom.exponential(SCR_MEAN_INTERVAL)
+        
+    def generate(self, n):
+        """returns the next n frames as uint16 array of shape (n, channelCnt)
+        """
+        t = (self.sampleNr + np.arange(n)) / self.fs
+        
+        #heart rate with respiratory sinus arrhythmia and Mayer waves
+        hr = self.heartRate * (1 + 0.05*np.sin(2*np.pi*0.25*t) + 0.03*np.sin(2*np.pi*0.1*t))
+        phase = self.cardiacPhase + np.cumsum(hr / 60.0 / self.fs)
+        self.cardiacPhase = phase[-1] % 1.0
+        phase %= 1.0
+        
+        #skin conductance: tonic level plus responses with fast rise and slow decay
+        tEnd = t[-1]
+        while self.nextScrTime <= tEnd:
+            self.scrList.append((self.nextScrTime, self.eventRandom.uniform(0.1, 0.5)))
+            self.nextScrTime += self.eventRandom.exponential(SCR_MEAN_INTERVAL)
+        self.scrList = [(onset, amp) for (onset, amp) in self.scrList if t[0] - onset < 30]
+        eda = -0.5 + 0.1*np.sin(2*np.pi*t/60.0)
+        for (onset, amp) in self.scrList:
+            dt = np.maximum(t - onset, 0)
+            eda += amp * (1 - np.exp(-dt/0.7)) * np.exp(-dt/4.0)
+        
+        signals = (_waves(phase, ECG_WAVES) - 0.2, eda, _waves(phase, BVP_WAVES) - 0.5, np.zeros(n))
+        noise = self.noiseRandom.standard_normal((n, self.channelCnt))
+        
+        dataMean = self.dataMax / 2
+        dataAmplitude = self.dataMax / 2 * 0.6
+        block = np.empty((n, self.channelCnt))
+        for ch in range(self.channelCnt):
+            kind = ch % len(signals)
+            noiseLevel = 0.3 if kind == 3 else 0.01
+            block[:,ch] = signals[kind] + noise[:,ch] * noiseLevel
+        block = block * dataAmplitude + dataMean
+        
+        self.sampleNr += n
+        return np.clip(block, 0, self.dataMax).astype(np.uint16)
+
+
+class DummyDevice(FrameBlockStager):
+    """
+        Synthetic device for testing without hardware, see SyntheticSignals.
+        Frames are generated in blocks of blockSize on the wall clock, sample rates up to SYNTHETIC_MAX_FS.
+    """
     stopRequest = threading.Event()
     
+    def __init__(self, seed=None):
+        self.seed = seed
+    
     def getProperties(self):
-        return "Dummy device for testing."           
+        return "Dummy device for testing, seed: " + str(self.seed)
     
     def start(self, fs, channelMask, bitsResolution):
-        self.period = 1.0/fs
+        if fs > SYNTHETIC_MAX_FS:
+            raise Exception("Dummy device: max. sample rate is " + str(SYNTHETIC_MAX_FS) + " Hz")
+        self.fs = fs
         self.channelCnt = bin(channelMask).count("1")     #count '1' in string representation
         self.bitsResolution = bitsResolution
         
         self.sampleNr = 0
         self.dataMax = 2**self.bitsResolution - 1
+        self.signals = SyntheticSignals(fs, self.channelCnt, self.dataMax, self.seed)
         
     def loop(self):
-        period2pi = self.period * 2 * math.pi
-        dataMean = self.dataMax / 2
-        dataAmplitude = self.dataMax / 2
-        tNext = time.clock() + self.period
-        
-        if self.pipeConn:    #not None
+        if self.frameSink:    #not None
+            blockPeriod = min(float(self.blockSize) / self.fs, self.blockMaxDelay)
+            blockPeriod = max(blockPeriod, 1.0 / self.fs)     #at least one frame per block, max delay can be 0
+            self.tStart = monotonic()     #time of frame nr 0 (TimeBase.monotonic), wall clock steps do not affect pacing
+            tNext = self.tStart
+            
             while not self.stopRequest.is_set():
-    #             self.timerEvent.wait(1.0)    #timeout: 1s
-                time.sleep(self.period) #usually sleeps too long
+                tNext += blockPeriod
+                time.sleep(max(tNext - monotonic(), 0))
                 
-                while tNext < time.clock():   #catch up missed frame to keep overall speed
-                    data = int(math.sin(self.sampleNr*period2pi) * dataAmplitude + dataMean)
-                    dataTup = tuple([ data ] * self.channelCnt)
-                    tup = (self.sampleNr,dataTup)
-                    
-                    self.pipeConn.send(tup)
-                    
-                    self.sampleNr += 1
-                    tNext += self.period
+                #all frames due by now, catches up if the thread was delayed
+                dueFrameCnt = int((monotonic() - self.tStart) * self.fs) - self.sampleNr
+                while dueFrameCnt > 0:
+                    n = min(dueFrameCnt, self.blockSize)
+                    self.frameSink.writeFrames(np.arange(self.sampleNr, self.sampleNr + n, dtype=np.uint32), self.signals.generate(n))
+                    self.sampleNr += n
+                    dueFrameCnt -= n
         else:
-            print "DummyDevice.loop: ending because no pipe registered"
+            print "DummyDevice.loop: ending because no frame sink registered"
     
     def stop(self):
         pass
@@ -131,17 +214,24 @@ class DummyDevice():
 def enumDevices():
     """ returns ((path string, descpription string),(...))
     """
-    return plux.BaseDev.findDevices()
+    import PluxDevice   #loads plux driver
+    return PluxDevice.enumDevices()
 
 def openDevice(addr):
     """
     returns class instance for opened device
-    returns dummy device if addr == "dummy"
+    returns dummy device if addr == "dummy" or "dummy:<seed>" (seed: int for reproducible data)
     """
-    if addr != "dummy":
-        return Device(addr)
+    if isSyntheticAddr(addr):
+        if ':' in addr:
+            return DummyDevice(int(addr.split(':')[1]))
+        else:
+            return DummyDevice()
     else:
-        return DummyDevice()    
+        import PluxDevice   #loads plux driver
+        if PluxDevice.plux is None:
+            raise Exception("Plux library not available, only dummy devices can be opened.")
+        return PluxDevice.Device(addr)
     
     
 if __name__ == '__main__':
@@ -28,6 +28,8 @@ ES_SYSTEM_REQUIRED   = 0x00000001
 ES_DISPLAY_REQUIRED  = 0x00000002
 
 def preventSleep():
+    if not hasattr(ctypes, 'windll'):   #not Windows
+        return
     try:
         print "preventSleep"
         ctypes.windll.kernel32.SetThreadExecutionState(ES_CONTINUOUS | ES_SYSTEM_REQUIRED | ES_DISPLAY_REQUIRED)  #@UndefinedVariableError
@@ -36,6 +38,8 @@ def preventSleep():
         
 
 def allowSleep():
+    if not hasattr(ctypes, 'windll'):
+        return
     try:
         ctypes.windll.kernel32.SetThreadExecutionState(ES_CONTINUOUS)   #@UndefinedVariableError
     except Exception as e:
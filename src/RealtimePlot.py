@@ -20,130 +20,220 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 -----------------------------------------------------------------
 This module is used for plotting the measured data life during the experiment.
+The acquisition side (PlotFeed, fed by the logging thread) reduces the frames to
+min/max envelopes with one bucket per pixel of the plot width (see PlotDecimation)
+and sends them to the plot process in a few small messages per second. So the
+work of the plot process does not depend on the sample rate.
+The plot is a sweep display like a patient monitor: the x axis is fixed, new data
+overwrites the oldest at the sweep position, a small gap marks the position.
+Envelopes are written into preallocated circular line buffers, one slot per bucket.
+Only the lines are redrawn on every update (blitting onto the cached background of
+each axis), axes, ticks and labels are drawn only when the window is (re)drawn.
 """
 
 import numpy as np
-from matplotlib import pyplot as plt
-from matplotlib import animation
 
 import multiprocessing as mp
-import Queue
+from multiprocessing.sharedctypes import RawValue
+from Queue import Full, Empty
 
+import ctypes
 import time
 import sys
 
+from PlotDecimation import MinMaxDecimator
+
 class PlotConfig:
     channelCnt = 1
     channelLabels = None
     xLabel = 'Sample Nr'
-    xRange = 1000  #samples
+    fs = 1          #frames per x unit
+    xRange = 1000  #x units
     yMin = -2048
     yMax = 2048
     reopenPlotOnClose = True
+    headless = False    #no window, plot is drawn into memory at refreshRate until the feed is closed (for benchmarks)
     
 
 #constants
-dataQueueBufLen = 10000 #dataframes
 refreshRate = 10     #per second
+FEED_SEND_INTERVAL = 0.05   #sec, envelopes are collected this long before they are sent to the plot process
+FEED_QUEUE_SIZE = 50        #messages, 2.5 sec with FEED_SEND_INTERVAL
+SWEEP_GAP = 0.02            #part of the x range left blank ahead of the sweep position
 
 #global variables within plot process
+plt = None      #matplotlib is imported by the plot process only
 plotCfg = None
 fig = None
 axArr = None
 lineList = None
-anim = None
-dataQueue = None
+timer = None
+envelopeQueue = None
+bucketFrames = None     #shared with PlotFeed
+feedClosed = False
+slotFrames = 1      #frames per slot of the line buffers (bucket size the buffers were allocated for)
+slotCnt = 0         #slots covering the x range
+xBuffer = None      #x of every slot, twice (min and max), never changes
+yBuffers = None     #channels x (2 * slotCnt): min and max of every slot, NaN where no data (not drawn)
+backgrounds = None  #per axis: canvas without lines, see _onDraw
+overrunText = None
 
 #global variables local process
-queueInp = None
 proc = None
 isPlotOpen = mp.Event()
 
-# initialization function: plot the background of each frame
-#def _initFnc():
-#    global fig,axArr,lineList,dataQueue,anim
-##    for i in range(channelCnt):
-##        lineList[i].set_data([x for x in range(-xRange+1,1)], [0 for x in range(xRange)])
-#    
-#    lineList[0].set_data([x for x in range(-plotCfg.xRange+1,1)], [0 for x in range(plotCfg.xRange)])
-#    return lineList[0]
-    
 
-# animation function.  This is called sequentially
-def _animateFnc(i):
-    global fig,axArr,lineList,dataQueue,anim
+class PlotFeed:
+    """
+    Acquisition side of the live plot, used like a frame sink: writeFrames(frameNrArr, dataBlock)
+    Frames are reduced to min/max envelopes and sent to the plot process every FEED_SEND_INTERVAL.
+    If the plot process does not keep up, messages are dropped (never blocks) and counted in droppedFrames.
+    """
+    def __init__(self, channelCnt):
+        self.queue = mp.Queue(FEED_QUEUE_SIZE)
+        self.bucketFrames = RawValue(ctypes.c_int, 1)   #frames per bucket, set by plot process to match its width in pixels
+        self.decimator = MinMaxDecimator(channelCnt)
+        self.droppedFrames = 0
+        self._parts = []
+        self._unsentFrames = 0
+        self._lastSendTime = time.time()
+
+    def writeFrames(self, frameNrArr, dataBlock):
+        envelope = self.decimator.feed(frameNrArr, dataBlock, self.bucketFrames.value)
+        if envelope:
+            self._parts.append(envelope)
+        self._unsentFrames += len(frameNrArr)
+        if time.time() - self._lastSendTime >= FEED_SEND_INTERVAL:
+            self._send()
+
+    def _send(self):
+        self._lastSendTime = time.time()
+        if self._parts:
+            msg = tuple(np.concatenate([p[i] for p in self._parts]) for i in range(3)) + (self.droppedFrames,)
+            try:
+                self.queue.put_nowait(msg)
+            except Full:
+                self.droppedFrames += self._unsentFrames
+            self._parts = []
+            self._unsentFrames = 0
+
+    def close(self):
+        """sends the remaining envelopes and the end of data
+        """
+        envelope = self.decimator.flush()
+        if envelope:
+            self._parts.append(envelope)
+        self._send()
+        try:
+            self.queue.put(None, True, 1.0)
+        except Full:
+            pass
+
+
+def _importMatplotlib(headless):
+    global plt
+    if plt is None:
+        import matplotlib
+        if headless:
+            matplotlib.use('Agg')
+        from matplotlib import pyplot
+        plt = pyplot
+
+def _readEnvelopes():
+    """returns the messages received from PlotFeed since the last call
+    """
+    global feedClosed
+    msgs = []
+    while True:
+        try:
+            msg = envelopeQueue.get_nowait()
+        except Empty:
+            break
+        if msg is None:
+            feedClosed = True
+            break
+        msgs.append(msg)
+    return msgs
+
+def _allocLineBuffers():
+    """(re)allocates the line buffers for the current bucket size, the plot is cleared
+    """
+    global slotFrames, slotCnt, xBuffer, yBuffers
     
-    dataReceived = False
+    slotFrames = bucketFrames.value
+    slotCnt = int(np.ceil(plotCfg.xRange * plotCfg.fs / float(slotFrames)))
+    xBuffer = np.repeat(np.arange(slotCnt) * slotFrames / float(plotCfg.fs), 2)
+    yBuffers = np.empty((plotCfg.channelCnt, 2 * slotCnt))
+    yBuffers.fill(np.nan)
+    for i in range(plotCfg.channelCnt):
+        lineList[i].set_data(xBuffer, yBuffers[i])
 
+def _updateBucketFrames(event=None):
+    """one bucket per pixel of the plot width
+    """
+    widthPx = max(axArr[0].get_window_extent().width, 1)
+    bucketFrames.value = max(1, int(plotCfg.xRange * plotCfg.fs / widthPx))
+    if bucketFrames.value != slotFrames or yBuffers is None:
+        _allocLineBuffers()
+
+def _storeEnvelopes(msgs):
+    """writes the envelopes into the line buffers at their sweep position, work proportional to the new buckets
+    """
+    for (startFrameNrs, mins, maxs, droppedFrames) in msgs:
+        slots = (startFrameNrs // slotFrames) % slotCnt
+        yBuffers[:, 2*slots] = mins.T
+        yBuffers[:, 2*slots+1] = maxs.T
     
-    try:
-        (time, data) = dataQueue.get_nowait()
-        
-        dataReceived = True     #get frame from queue successful, no exception raised
-        
-        timeList = []
-        channelDataList = []
-        for i in range(plotCfg.channelCnt):
-            channelDataList.append( [] )    #initialize with channelCnt empty lists
-        
-        while True:     #until exception Queue.Empty is raised
-            #process data
-            timeList.append(time)
-            for i in range(plotCfg.channelCnt):
-                channelDataList[i].append(data[i])  #append frame data coming in tuple to list for each channel
-        
-            #try whether there is more data in queue
-            (time, data) = dataQueue.get_nowait()      
-        
-    except Queue.Empty:
-        pass
+    #blank the slots ahead of the newest data
+    gapSlots = (slots[-1] + 1 + np.arange(max(1, int(slotCnt * SWEEP_GAP)))) % slotCnt
+    yBuffers[:, 2*gapSlots] = np.nan
+    yBuffers[:, 2*gapSlots+1] = np.nan
     
-    if dataReceived:
-#        print timeList, channelDataList[0]
-#        sys.stdout.flush()  
-        
-        #now all new data in timeList and channelDataList
-        x = lineList[0].get_xdata()                                 #xdata is the same for all lines
-                #cut too old data points
-                
-        #find index of oldest x value to keep
-        oldestFrameNr = timeList[-1] - plotCfg.xRange    #last element - xRange
-        cutIndex = 0
-        for x_val in x:
-            if x_val < oldestFrameNr:
-                cutIndex += 1       #increase cutIndex until oldest x value to keep found
-            else:
-                break
-                
-        newx = np.concatenate((x[cutIndex :], timeList) )      #so process only once
-        
-        for i in range(plotCfg.channelCnt):
-            y = lineList[i].get_ydata()
-            newy = np.concatenate((y[cutIndex :], channelDataList[i]) )
-            
-#            print newy[-1]
-#            sys.stdout.flush()
-            
-            lineList[i].set_data(newx,newy)
-            
-            x_end = newx[0]+plotCfg.xRange 
-#             if x_end < newx[-1]:
-#                 print "plot right xlim too short"
-            axArr[i].set_xlim(newx[0],x_end)
+    if msgs[-1][3] > 0:
+        overrunText.set_text("Plot too slow, frames not shown: " + str(msgs[-1][3]))
 
-    return lineList, axArr  #return all lines and axes
+def _onDraw(event):
+    """the figure was drawn completely (first show, resize, ...), lines are animated and not part of it.
+    the axes are saved as backgrounds for blitting, then the lines are drawn on top.
+    """
+    global backgrounds
+    backgrounds = [fig.canvas.copy_from_bbox(ax.bbox) for ax in axArr]
+    for i in range(plotCfg.channelCnt):
+        _drawLine(i)
+
+def _drawLine(i):
+    lineList[i].set_ydata(yBuffers[i])     #same buffer, marks the line data as changed
+    axArr[i].draw_artist(lineList[i])
+    if i == 0:
+        axArr[0].draw_artist(overrunText)
+
+def _blitLines():
+    """redraws the lines only: restore the background of every axis, draw its line on top
+    """
+    for i in range(plotCfg.channelCnt):
+        fig.canvas.restore_region(backgrounds[i])
+        _drawLine(i)
+        fig.canvas.blit(axArr[i].bbox)
+
+def _update():
+    """called at refreshRate
+    """
+    msgs = _readEnvelopes()
+    if msgs:
+        _storeEnvelopes(msgs)
+        if backgrounds:     #figure drawn once
+            _blitLines()
+    if feedClosed and timer:
+        timer.stop()
 
 def _init():
-    global fig,axArr,lineList,anim
+    global fig,axArr,lineList,timer,overrunText,backgrounds,yBuffers
 
     plt.ioff()      #interactive mode off, so plt.show() blocks until plot window is closed
     
     lineList = []
-#    initX = [x for x in range(- plotCfg.xRange+1,1)]
-    initX = [0]
-#    initY = [0 for x in range(plotCfg.xRange)]
-    initY = [0]
-
+    backgrounds = None
+    yBuffers = None
     
     fig, axArr = plt.subplots(plotCfg.channelCnt,1,sharex=True)
     
@@ -151,40 +241,49 @@ def _init():
         axArr = [axArr]     #make list from single object for compatibility
     
     for i in range(plotCfg.channelCnt):
-#         axArr[i].set_xlim( (- plotCfg.xRange,0) )
         axArr[i].set_xlim( (0,plotCfg.xRange) )
         axArr[i].set_ylim( (plotCfg.yMin, plotCfg.yMax) )
-        line, = axArr[i].plot(initX, initY, linewidth=1)
+        line, = axArr[i].plot([], [], linewidth=1, animated=True)     #animated: not drawn with the figure, see _onDraw
         lineList.append(line)
         if plotCfg.channelLabels:
             axArr[i].set_ylabel(plotCfg.channelLabels[i])
             
     plt.xlabel(plotCfg.xLabel)
-    
-    
-    # call the animator.  blit=True means only re-draw the parts that have changed.
-    anim = animation.FuncAnimation(fig, _animateFnc, #init_func=_initFnc,
-                                   interval = (1000/refreshRate), blit=False)
-    
+    #shows frames the plot could not keep up with, inside an axis so it is redrawn with the lines
+    overrunText = axArr[0].text(0.01, 0.95, "", color='r', transform=axArr[0].transAxes, va='top', animated=True)
                                    
     plt.tight_layout()
+    _updateBucketFrames()
+    fig.canvas.mpl_connect('resize_event', _updateBucketFrames)
+    fig.canvas.mpl_connect('draw_event', _onDraw)
+    
+    timer = fig.canvas.new_timer(interval = (1000/refreshRate))
+    timer.add_callback(_update)
+    timer.start()
 
    
-def _plotProcessFnc(queue,plotConfig,isPlotOpen):
+def _plotProcessFnc(queue,sharedBucketFrames,plotConfig,isPlotOpen):
 #    print "Hello process"
 #    sys.stdout.flush()
     
     #globals need to be reinitialized from parameters in new process...
-    global dataQueue, plotCfg
-    dataQueue = queue
+    global envelopeQueue, bucketFrames, plotCfg
+    envelopeQueue = queue
+    bucketFrames = sharedBucketFrames
     plotCfg = plotConfig
+    _importMatplotlib(plotConfig.headless)
     
+    if plotConfig.headless:
+        _headlessLoop()
+        isPlotOpen.clear()
+        return
     
     while True:
         _init()
         plt.show()
+        timer.stop()
         
-        if plotConfig.reopenPlotOnClose and not dataQueue.empty():
+        if plotConfig.reopenPlotOnClose and not feedClosed:
             print "plot closed, reopening plot"
 #             sys.stdout.flush()   # leads to crash when executed without console (pythonw.exe) 
         else:
@@ -193,27 +292,32 @@ def _plotProcessFnc(queue,plotConfig,isPlotOpen):
         
         
     
+def _headlessLoop():
+    """same work as the timer of the plot window: read envelopes, update lines and blit them
+    """
+    _init()
+    fig.canvas.draw()   #complete figure once, saves backgrounds
+    
+    while not feedClosed:
+        tNext = time.time() + 1.0/refreshRate
+        _update()
+        time.sleep(max(tNext - time.time(), 0))
+    
+    plt.close(fig)
+    
    
 def startPlotProcess(plotConfig):
-    global dataQueue, proc, isPlotOpen
+    """returns the PlotFeed the frames to display have to be written to
+    """
+    global proc, isPlotOpen
     
-    dataQueue = mp.Queue(dataQueueBufLen)    #buffers max dataQueueBufLen elements
     isPlotOpen.set()
+    feed = PlotFeed(plotConfig.channelCnt)
     
     #plotting from a thread does not work, process needed
-    proc = mp.Process(target=_plotProcessFnc, args = (dataQueue,plotConfig,isPlotOpen))
+    proc = mp.Process(target=_plotProcessFnc, args = (feed.queue,feed.bucketFrames,plotConfig,isPlotOpen))
     proc.start()
-    
-def plotDataFrame(time,data):
-    """time as int, data as tuple of channels
-    """
-    global dataQueue, isPlotOpen
-    if isPlotOpen.is_set():
-        tup = (time,data)
-        try:
-            dataQueue.put_nowait(tup)
-        except Queue.Full:
-            print "plotDataFrame: Queue full. Omiting data frame."
+    return feed
 
 def joinPlotProcess():
     global proc
@@ -227,7 +331,7 @@ def terminatePlotProcess():
         proc = None
         
 
-def dummyDataSenderLoop(channelCnt,yMax):
+def dummyDataSenderLoop(feed,channelCnt,yMax):
     fs = 100
     freq = 1
     
@@ -235,11 +339,12 @@ def dummyDataSenderLoop(channelCnt,yMax):
 #        print i
         y = []
         for ch in range(channelCnt):
-            curY = np.sin(2 * np.pi * i * freq/fs + (ch * np.pi * 0.5)) * yMax * 0.9
+            curY = (np.sin(2 * np.pi * i * freq/fs + (ch * np.pi * 0.5)) + 1) * yMax * 0.45
             y.append(curY)
-        plotDataFrame(i,tuple(y))
+        feed.writeFrames(np.array([i]), np.array([y], np.uint16))
         
         time.sleep(1.0/fs)
+    feed.close()
     
     
 if __name__ == '__main__':    
@@ -249,10 +354,13 @@ if __name__ == '__main__':
     cfg = PlotConfig()
     cfg.channelCnt = 3
     cfg.channelLabels = ["ecg","eda","bvp"]
-    
-    startPlotProcess(cfg)    
+    cfg.fs = 100
+    cfg.xRange = 5
+    cfg.yMin = 0
+    cfg.yMax = 2**16
+    feed = startPlotProcess(cfg)    
        
-    dummyDataSenderLoop(cfg.channelCnt,cfg.yMax)
+    dummyDataSenderLoop(feed,cfg.channelCnt,cfg.yMax)
     
     print "dummy data generation ended"
     time.sleep(5)
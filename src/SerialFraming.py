@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+Incremental parsers for events received on the serial port. Received bytes are
+appended to a bytearray with feed(), which returns the events completed so far.
+Scan positions are kept between calls, so every byte is examined once, and the
+consumed part of the buffer is only dropped from time to time.
+
+Framings:
+    DelimitedFraming       event between optional start sequence and end sequence, e.g. "test message\n" or "#ID:subject\n"
+    LengthPrefixedFraming  binary, length byte(s) followed by the payload, optional sync byte before the length
+    TriggerByteFraming     every byte is an event (trigger codes), e.g. from TTL trigger boxes
+
+createFraming() builds a parser from a settings string, see FRAMING_HELP.
+"""
+
+import struct
+
+COMPACT_SIZE = 4096     #bytes consumed before the buffer is compacted
+MAX_FRAME_LEN = 1024    #bytes, a frame not completed within this length is discarded
+
+FRAMING_HELP = ("newline | startend|<start seq>|<end seq> | length8[|<sync byte>] | length16[|<sync byte>] | trigger\n"
+                "sequences may contain escapes like \\n, e.g. startend|#EV:|\\r\\n")
+
+
+class FramingParser:
+    """
+    Base class. Subclasses implement _parse(), which scans self._buf from self._pos / self._scan
+    and returns the list of completed events.
+    """
+    def __init__(self):
+        self.reset()
+        
+    def reset(self):
+        """discards partially received frames, e.g. after reconnecting
+        """
+        self._buf = bytearray()
+        self._pos = 0       #start of data not consumed yet
+        self._scan = 0      #position to continue scanning at
+        self.discardedBytes = 0     #bytes not belonging to any valid frame
+        
+    def feed(self, data):
+        """appends received bytes, returns a list of the event strings completed (can be empty)
+        """
+        self._buf.extend(data)
+        events = self._parse()
+        
+        if self._pos >= len(self._buf) or self._pos >= COMPACT_SIZE:
+            self._compact(self._pos)
+        return events
+    
+    def _compact(self, n):
+        del self._buf[:n]
+        self._pos -= n
+        self._scan -= n
+        
+    def _parse(self):
+        raise NotImplementedError()
+
+
+class DelimitedFraming(FramingParser):
+    def __init__(self, startSeq=None, endSeq="\n", maxFrameLen=MAX_FRAME_LEN):
+        """event strings are returned without startSeq and endSeq. Without startSeq an event starts after the previous one.
+        """
+        self.startSeq = bytearray(startSeq) if startSeq else None
+        self.endSeq = bytearray(endSeq)
+        self.maxFrameLen = maxFrameLen
+        FramingParser.__init__(self)
+        
+    def reset(self):
+        FramingParser.reset(self)
+        self._frameStart = None     #start of current event string, None while searching for startSeq
+        
+    def _compact(self, n):
+        FramingParser._compact(self, n)
+        if self._frameStart is not None:
+            self._frameStart -= n
+        
+    def _parse(self):
+        events = []
+        buf = self._buf
+        
+        while True:
+            if self._frameStart is None:
+                if self.startSeq:
+                    i = buf.find(self.startSeq, self._scan)
+                    if i < 0:
+                        #data before start sequence is discarded, the tail could be the beginning of startSeq
+                        keepFrom = max(self._pos, len(buf) - len(self.startSeq) + 1)
+                        self.discardedBytes += keepFrom - self._pos
+                        self._pos = self._scan = keepFrom
+                        break
+                    self.discardedBytes += i - self._pos
+                    self._frameStart = self._scan = i + len(self.startSeq)
+                else:
+                    self._frameStart = self._pos
+            
+            j = buf.find(self.endSeq, self._scan)
+            if j < 0:
+                if len(buf) - self._frameStart > self.maxFrameLen:     #no end sequence, discard
+                    self.discardedBytes += len(buf) - self._pos
+                    self._pos = self._scan = len(buf)
+                    self._frameStart = None
+                else:
+                    self._scan = max(self._frameStart, len(buf) - len(self.endSeq) + 1)    #end sequence can be split
+                break
+            
+            events.append(str(buf[self._frameStart:j]))
+            self._pos = self._scan = j + len(self.endSeq)
+            self._frameStart = None
+            
+        return events
+        
+
+class LengthPrefixedFraming(FramingParser):
+    def __init__(self, lengthBytes=1, syncByte=None):
+        """length field of 1 or 2 bytes (little endian) followed by the payload, optionally preceded by syncByte
+        """
+        self.lengthStruct = struct.Struct('<B' if lengthBytes == 1 else '<H')
+        self.syncByte = bytearray(syncByte) if syncByte else None
+        FramingParser.__init__(self)
+        
+    def _parse(self):
+        events = []
+        buf = self._buf
+        hdrLen = self.lengthStruct.size + (1 if self.syncByte else 0)
+        
+        while True:
+            if self.syncByte:
+                i = buf.find(self.syncByte, self._pos)
+                if i < 0:
+                    self.discardedBytes += len(buf) - self._pos
+                    self._pos = len(buf)
+                    break
+                self.discardedBytes += i - self._pos
+                self._pos = i
+            
+            if len(buf) - self._pos < hdrLen:
+                break
+            (n,) = self.lengthStruct.unpack_from(buf, self._pos + hdrLen - self.lengthStruct.size)
+            if len(buf) - self._pos - hdrLen < n:
+                break       #payload not complete
+            
+            events.append(str(buf[self._pos+hdrLen:self._pos+hdrLen+n]))
+            self._pos += hdrLen + n
+            
+        self._scan = self._pos
+        return events
+
+
+class TriggerByteFraming(FramingParser):
+    def __init__(self, names=None, ignore=(0,)):
+        """
+        every byte not in ignore is an event, e.g. 0 is sent by many trigger boxes to reset the lines.
+        names: dict of byte value: event string, default event string is the decimal value
+        """
+        self.names = names or {}
+        self.ignore = set(ignore)
+        FramingParser.__init__(self)
+        
+    def _parse(self):
+        events = [self.names.get(b, str(b)) for b in self._buf[self._pos:] if b not in self.ignore]
+        self._pos = self._scan = len(self._buf)
+        return events
+
+
+def createFraming(spec):
+    """returns a parser for the settings string spec (see FRAMING_HELP), raises ValueError if invalid
+    """
+    parts = spec.strip().split('|')
+    parts = [parts[0]] + [p.decode('string_escape') for p in parts[1:]]
+    name = parts[0].lower()
+    
+    if name == "newline" and len(parts) == 1:
+        return DelimitedFraming(None, "\n")
+    elif name == "startend" and len(parts) == 3 and parts[2] != "":
+        return DelimitedFraming(parts[1], parts[2])
+    elif name in ("length8", "length16") and len(parts) <= 2:
+        syncByte = parts[1] if len(parts) == 2 else None
+        if syncByte is not None and len(syncByte) != 1:
+            raise ValueError("Serial framing: sync byte must be a single byte.")
+        return LengthPrefixedFraming(1 if name == "length8" else 2, syncByte)
+    elif name == "trigger" and len(parts) == 1:
+        return TriggerByteFraming()
+    
+    raise ValueError("Invalid serial framing '" + spec + "', expected: " + FRAMING_HELP)
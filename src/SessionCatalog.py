@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+Local SQLite catalog of the sessions in a log directory, built from the '.json' header
+and the event tables of every log. It is updated incrementally: only sessions whose
+log or header changed since the last update are read again. ExpController adds every
+session it saves (see ExpController._saverThreadFnc).
+
+usage: python SessionCatalog.py [--logdir DIR] [-e EXPERIMENT] [-s SUBJECT] [--event LABEL] [--rebuild]
+LABEL may contain '%' as wildcard, e.g. --event 'stim%'
+"""
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+CATALOG_FILE = "BioLink_Catalog.sqlite"
+LOG_SUFFIXES = (".blc", ".npz")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    baseName TEXT UNIQUE,       -- path without extension
+    logFile TEXT,
+    fileMtime REAL,             -- newest modification time of log and header when read
+    subjectId TEXT,
+    experimentId TEXT,
+    startTime TEXT,             -- 'YYYY-MM-DD HH:MM', sortable
+    duration_sec REAL,
+    frameCnt INTEGER,
+    fs REAL,
+    channels TEXT,              -- comma separated
+    extension TEXT,
+    serialEventCnt INTEGER,
+    extEventCnt INTEGER
+);
+CREATE TABLE IF NOT EXISTS events (
+    sessionId INTEGER REFERENCES sessions(id) ON DELETE CASCADE,
+    source TEXT,                -- 'serial' or 'extension'
+    label TEXT,
+    count INTEGER
+);
+CREATE INDEX IF NOT EXISTS sessionsExperiment ON sessions(experimentId);
+CREATE INDEX IF NOT EXISTS sessionsSubject ON sessions(subjectId);
+CREATE INDEX IF NOT EXISTS eventsLabel ON events(label);
+CREATE INDEX IF NOT EXISTS eventsSession ON events(sessionId);
+"""
+
+
+def _logFile(baseName):
+    for suffix in LOG_SUFFIXES:
+        if os.path.isfile(baseName + suffix):
+            return baseName + suffix
+    return None
+
+def _fileMtime(baseName):
+    return max(os.path.getmtime(_logFile(baseName)), os.path.getmtime(baseName + '.json'))
+
+def _startTime(dateStr):
+    """'dd/mm/YYYY HH:MM' of the log header as sortable 'YYYY-MM-DD HH:MM', None if not readable
+    """
+    try:
+        return time.strftime("%Y-%m-%d %H:%M", time.strptime(str(dateStr), "%d/%m/%Y %H:%M"))
+    except ValueError:
+        return None
+
+def _eventCounts(eventData):
+    """returns [(label, count)] of the event strings
+    """
+    if len(eventData) == 0:
+        return []
+    (labels, counts) = np.unique(eventData[eventData.dtype.names[1]], return_counts=True)
+    return [(str(label), int(count)) for (label, count) in zip(labels, counts)]
+
+
+class SessionCatalog:
+    def __init__(self, logDir, path=None):
+        """opens (creates) the catalog, CATALOG_FILE in logDir by default
+        """
+        self.logDir = logDir
+        self.path = path if path else os.path.join(logDir, CATALOG_FILE)
+        self.db = sqlite3.connect(self.path, timeout=10)   #the saver thread may write at the same time
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def addSession(self, baseName, fileMtime=None):
+        """reads header and event tables of the session and (re)places its entry
+        """
+        import LogTools     #loaded on first use
+        baseName = os.path.abspath(baseName)
+        if fileMtime is None:
+            fileMtime = _fileMtime(baseName)
+        with open(baseName + '.json', 'r') as f:
+            hdr = json.load(f)
+        (channelHeader, bioData, serialEventData, extEventData) = LogTools.loadBioLinkData(baseName, lazy=True)   #bio data is not read
+        
+        with self.db:   #one transaction
+            self.db.execute("DELETE FROM sessions WHERE baseName = ?", (baseName,))
+            cur = self.db.execute("INSERT INTO sessions (baseName, logFile, fileMtime, subjectId, experimentId, startTime, duration_sec, "
+                                  "frameCnt, fs, channels, extension, serialEventCnt, extEventCnt) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                                  (baseName, os.path.basename(_logFile(baseName)), fileMtime, hdr.get('subjectId'), hdr.get('experimentId'),
+                                   _startTime(hdr.get('dateStr')), hdr.get('duration_sec'), hdr.get('frameCnt', len(bioData)), hdr.get('fs'),
+                                   ",".join(str(ch) for ch in channelHeader), hdr.get('extension'), len(serialEventData), len(extEventData)))
+            sessionId = cur.lastrowid
+            for (source, eventData) in (('serial', serialEventData), ('extension', extEventData)):
+                self.db.executemany("INSERT INTO events (sessionId, source, label, count) VALUES (?,?,?,?)",
+                                    [(sessionId, source, label, count) for (label, count) in _eventCounts(eventData)])
+
+    def update(self, rebuild=False):
+        """
+        adds new and changed sessions of the log directory, removes sessions whose files are gone
+        returns (sessions added or updated, sessions removed, errors as list of (base name, message))
+        """
+        if rebuild:
+            with self.db:
+                self.db.execute("DELETE FROM sessions")
+        known = dict((row['baseName'], row['fileMtime']) for row in self.db.execute("SELECT baseName, fileMtime FROM sessions"))
+        
+        found = set()
+        for jsonPath in glob.glob(os.path.join(self.logDir, "*.json")):
+            baseName = os.path.abspath(jsonPath[:-len('.json')])
+            if _logFile(baseName):
+                found.add(baseName)
+        
+        updated = 0
+        errors = []
+        for baseName in sorted(found):
+            fileMtime = _fileMtime(baseName)
+            if known.get(baseName) != fileMtime:
+                try:
+                    self.addSession(baseName, fileMtime)
+                    updated += 1
+                except Exception as e:
+                    errors.append((baseName, str(e)))
+        
+        removed = [b for b in known if b not in found]
+        with self.db:
+            self.db.executemany("DELETE FROM sessions WHERE baseName = ?", [(b,) for b in removed])
+        return (updated, len(removed), errors)
+
+    def find(self, experimentId=None, subjectId=None, event=None, dateFrom=None, dateTo=None):
+        """
+        returns the matching sessions as list of dicts, ordered by start time
+        event: label of a serial or extension event the session has to contain, '%' is a wildcard
+        dateFrom, dateTo: 'YYYY-MM-DD' (inclusive)
+        """
+        where = []
+        args = []
+        if experimentId is not None:
+            where.append("experimentId = ?")
+            args.append(experimentId)
+        if subjectId is not None:
+            where.append("subjectId = ?")
+            args.append(subjectId)
+        if event is not None:
+            where.append("id IN (SELECT sessionId FROM events WHERE label " + ("LIKE" if '%' in event else "=") + " ?)")
+            args.append(event)
+        if dateFrom is not None:
+            where.append("startTime >= ?")
+            args.append(dateFrom)
+        if dateTo is not None:
+            where.append("startTime < ?")
+            args.append(dateTo + "~")     #sorts after 'YYYY-MM-DD HH:MM' of the same day
+        sql = "SELECT * FROM sessions" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY startTime, baseName"
+        return [dict(row) for row in self.db.execute(sql, args)]
+
+    def events(self, baseName):
+        """returns [(source, label, count)] of the session
+        """
+        return [tuple(row) for row in self.db.execute("SELECT e.source, e.label, e.count FROM events e JOIN sessions s ON e.sessionId = s.id "
+                                                      "WHERE s.baseName = ? ORDER BY e.source, e.label", (os.path.abspath(baseName),))]
+
+
+def catalogSession(baseName):
+    """adds a saved session to the catalog of its log directory
+    """
+    catalog = SessionCatalog(os.path.dirname(os.path.abspath(baseName)))
+    try:
+        catalog.addSession(baseName)
+    finally:
+        catalog.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="BioLink session catalog")
+    parser.add_argument("--logdir", default="../log/", help="log directory (default: %(default)s)")
+    parser.add_argument("-e", "--experiment", help="experiment id")
+    parser.add_argument("-s", "--subject", help="subject id")
+    parser.add_argument("--event", help="event label, '%%' as wildcard")
+    parser.add_argument("--from", dest="dateFrom", help="first date, YYYY-MM-DD")
+    parser.add_argument("--to", dest="dateTo", help="last date, YYYY-MM-DD")
+    parser.add_argument("--rebuild", action="store_true", help="read all sessions again")
+    parser.add_argument("--events", action="store_true", help="list the event labels of every session")
+    args = parser.parse_args(argv)
+    
+    catalog = SessionCatalog(args.logdir)
+    (updated, removed, errors) = catalog.update(args.rebuild)
+    for (baseName, msg) in errors:
+        print "Error reading '" + baseName + "': " + msg
+    if updated or removed:
+        print "Catalog updated: %d sessions added or changed, %d removed" % (updated, removed)
+    
+    sessions = catalog.find(args.experiment, args.subject, args.event, args.dateFrom, args.dateTo)
+    for s in sessions:
+        print "%s  %-12s %-12s %8.1f s  %s  serial: %d, extension: %d events  %s" % (s['startTime'], s['experimentId'], s['subjectId'],
+              s['duration_sec'] or 0, s['channels'], s['serialEventCnt'], s['extEventCnt'], s['logFile'])
+        if args.events:
+            for (source, label, count) in catalog.events(s['baseName']):
+                print "        %-9s %5d x %s" % (source, count, label)
+    print len(sessions), "session(s)"
+    catalog.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+The session journal is an append-only file written during the experiment.
+It contains the log header, all frame blocks and all serial and extension events
+with their frame nr. It is synced to disk every fsyncInterval seconds by its own
+writer thread, so after a crash or power loss the session can be rebuilt from it
+(see ExpController.recoverJournals).
+
+Record layout: type (1 byte), payload length (uint32), crc32 of payload (int32), payload
+A partially written record at the end of the file is ignored when reading.
+"""
+
+import os
+import json
+import struct
+import zlib
+import threading
+import Queue
+import time
+
+import numpy as np
+
+import MsgLogger
+
+JOURNAL_SUFFIX = ".journal"
+
+REC_HEADER = 'H'        #json of log header
+REC_FRAMES = 'F'        #frame count, channel count, frame nrs (uint32), data (uint16)
+REC_SERIAL_EVENT = 'S'  #frame nr (uint32), event string
+REC_EXT_EVENT = 'X'     #frame nr (uint32), event string
+
+_recStruct = struct.Struct('<cIi')
+_framesStruct = struct.Struct('<II')
+_eventStruct = struct.Struct('<I')
+
+
+class SessionJournal:
+    """
+    Writer side. Append methods are not blocking, records are written by a separate thread.
+    """
+    def __init__(self, path, hdrDict, fsyncInterval=1.0):
+        self.path = path
+        self.fsyncInterval = fsyncInterval
+        self._queue = Queue.Queue()
+        self._file = open(path, 'wb')
+        self._writerThread = threading.Thread(target=self._writerLoop)
+        self._writerThread.setDaemon(True)
+
+        self._append(REC_HEADER, json.dumps(hdrDict))
+        self._writerThread.start()
+
+    def _append(self, recType, payload):
+        self._queue.put(_recStruct.pack(recType, len(payload), zlib.crc32(payload)) + payload)
+
+    def appendFrames(self, frameNrArr, dataBlock):
+        """frameNrArr and dataBlock are copied, views into the ring buffer can be passed
+        """
+        payload = _framesStruct.pack(dataBlock.shape[0], dataBlock.shape[1]) + \
+                  frameNrArr.astype('<u4').tostring() + dataBlock.astype('<u2').tostring()
+        self._append(REC_FRAMES, payload)
+
+    def appendSerialEvent(self, frameNr, eventStr):
+        self._append(REC_SERIAL_EVENT, _eventStruct.pack(frameNr) + str(eventStr))
+
+    def appendExtensionEvent(self, frameNr, eventStr):
+        self._append(REC_EXT_EVENT, _eventStruct.pack(frameNr) + str(eventStr))
+
+    def _writerLoop(self):
+        lastSync = time.time()
+        running = True
+        try:
+            while running:
+                try:
+                    rec = self._queue.get(True, self.fsyncInterval)
+                    if rec is None:     #close request
+                        running = False
+                    else:
+                        self._file.write(rec)
+                except Queue.Empty:
+                    pass
+
+                if not running or time.time() - lastSync >= self.fsyncInterval:    #batch fsync
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                    lastSync = time.time()
+        except Exception as e:
+            MsgLogger.append("Error writing journal '" + self.path + "': " + str(e))
+        finally:
+            self._file.close()
+
+    def close(self, delete=False):
+        """writes all pending records and closes the file, delete it if the session was saved properly
+        """
+        self._queue.put(None)
+        self._writerThread.join()
+        if delete:
+            os.remove(self.path)
+
+
+def readJournal(path):
+    """
+    generator yielding (recType, content) for every complete record
+    content: hdrDict for REC_HEADER, (frameNrArr, dataBlock) for REC_FRAMES, (frameNr, eventStr) for events
+    """
+    with open(path, 'rb') as f:
+        while True:
+            recHdr = f.read(_recStruct.size)
+            if len(recHdr) < _recStruct.size:
+                break
+            (recType, length, crc) = _recStruct.unpack(recHdr)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break       #record was not written completely
+
+            if recType == REC_HEADER:
+                yield (recType, json.loads(payload))
+            elif recType == REC_FRAMES:
+                (frameCnt, channelCnt) = _framesStruct.unpack_from(payload)
+                offset = _framesStruct.size
+                frameNrArr = np.frombuffer(payload, '<u4', frameCnt, offset)
+                offset += frameCnt * 4
+                dataBlock = np.frombuffer(payload, '<u2', frameCnt * channelCnt, offset).reshape((frameCnt, channelCnt))
+                yield (recType, (frameNrArr, dataBlock))
+            elif recType in (REC_SERIAL_EVENT, REC_EXT_EVENT):
+                (frameNr,) = _eventStruct.unpack_from(payload)
+                yield (recType, (frameNr, payload[_eventStruct.size:]))
+
+
+def findJournals(logDir):
+    """returns paths of all journals in logDir, i.e. sessions that were not saved properly
+    """
+    return sorted(os.path.join(logDir, f) for f in os.listdir(logDir) if f.endswith(JOURNAL_SUFFIX))
+
+
+if __name__ == '__main__':
+    #recovery tool: python SessionJournal.py [logDir or journal file]
+    import sys
+    import ExpController
+
+    MsgLogger.init(os.devnull)
+    target = sys.argv[1] if len(sys.argv) > 1 else ExpController.logDir
+    if os.path.isdir(target):
+        ExpController.recoverJournals(target)
+    else:
+        ExpController.recoverJournal(target)
+    MsgLogger.close()
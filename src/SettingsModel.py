@@ -27,6 +27,7 @@ import json
 import MsgLogger
 from __builtin__ import False
 from ExpController import MAX_CHANNEL_CNT
+import PluxInterface
 import os
 
 
@@ -50,13 +51,21 @@ class SettingsModel:
         self.settingsDict = dict(serialPort = DEFAULT_SERIAL_PORT,
                         pluxMac = "xx:xx:xx:xx:xx:xx",
                         channelNames = ("ECG","EDA","BVP"),
+                        extraChannelNames = [],     #channel names of additional Plux devices
                         experimentId = "test",
                         sampleRate = 1000,
                         maxDuration = 60,
                         useSerial = True,
                         useLifePlot = True,
                         reopenLifePlot = True,
-                        extension = "None")
+                        extension = "None",
+                        frameBlockSize = 50,        #frames sent from device thread to logging thread at once
+                        frameBlockMaxDelayMs = 50,  #max delay until a partially filled frame block is sent
+                        streamToDisk = False,       #write bio data to a memory-mapped file during the experiment
+                        logFormat = "blc",          #"blc": chunked native format, "npz": numpy archive, see ChunkedLog
+                        useJournal = True,          #crash-safe journal of frames and events
+                        journalFsyncSec = 1.0,      #interval to sync the journal to disk
+                        serialFraming = "newline")  #see SerialFraming.FRAMING_HELP
 
     def updateSettings(self, setDict):
         """
@@ -72,11 +81,17 @@ class SettingsModel:
     
         
     def getChannelNamesStr(self):
+        """channel names of several devices are separated by ';'
+        """
+        groups = [self.settingsDict['channelNames']] + list(self.settingsDict['extraChannelNames'])
+        return "; ".join([self._getChannelGroupStr(g) for g in groups])
+    
+    def _getChannelGroupStr(self,channelNames):
         s = ""
         i = 1
         firstCh = True
         
-        for ch in self.settingsDict['channelNames']:
+        for ch in channelNames:
             if len(ch) > 0:     #empty string means channel not used
                 if not firstCh:   #second cycle
                     s = s + ", "
@@ -88,6 +103,23 @@ class SettingsModel:
     
     def setChannelNamesStr(self,s):
         """returns True on success
+        channel names of several devices are separated by ';'
+        """
+        success = True
+        groups = []
+        
+        for groupStr in s.split(';'):
+            groupSuccess, chTuple = self._parseChannelGroupStr(groupStr)
+            success = success and groupSuccess
+            groups.append(chTuple)
+            
+        self.settingsDict['channelNames'] = groups[0]
+        self.settingsDict['extraChannelNames'] = groups[1:]
+        
+        return success
+    
+    def _parseChannelGroupStr(self,s):
+        """returns (success, tuple of channel names)
         """
         success =  True
         chList = [""] * MAX_CHANNEL_CNT
@@ -116,9 +148,7 @@ class SettingsModel:
             else:
                 break
             
-        self.settingsDict['channelNames'] = tuple(chList)
-                
-        return success
+        return (success, tuple(chList))
 
     def setSampleRateStr(self,sampleRateStr):
         """returns True on success
@@ -126,14 +156,22 @@ class SettingsModel:
         success = False
         try:
             sampleRate = int(sampleRateStr)
+            
+            #dummy devices support higher rates for load testing
+            macList = [mac.strip() for mac in self.settingsDict['pluxMac'].split(';') if mac.strip() != ""]
+            if len(macList) > 0 and all(PluxInterface.isSyntheticAddr(mac) for mac in macList):
+                maxSampleRate = PluxInterface.SYNTHETIC_MAX_FS
+            else:
+                maxSampleRate = 1000
+            
             if sampleRate >= 100:
-                if sampleRate <= 1000:
+                if sampleRate <= maxSampleRate:
                     if sampleRate % 100 == 0:   #is multiple of 100
                         success = True
                     else:
                         sampleRate = (sampleRate + 50) / 100 * 100
                 else:
-                    sampleRate = 1000
+                    sampleRate = maxSampleRate
             else:
                 sampleRate = 100
                 
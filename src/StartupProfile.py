@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+This module measures how long BioLink takes to start: the import time of every
+module loaded and the time until the main window is shown, both relative to
+install() (first statement of main.py). Start with 'python main.py --profile-startup'.
+Modules are listed in the order their import finished, indented by nesting level,
+with self time (without nested imports) and cumulative time, like 'python3 -X importtime'.
+Imports of modules already loaded are not listed.
+"""
+
+import __builtin__
+import sys
+import time
+
+#TimeBase is not used as it imports numpy, which would be loaded before profiling started
+monotonic = time.clock if sys.platform == 'win32' else time.time
+
+REPORT_TOP_CNT = 10     #slowest modules listed in the message log
+
+active = False
+startTime = None
+records = []        #[nesting level, module name, self time, cumulative time] per import, in the order imports finished
+marks = []          #(label, time since install) e.g. window shown
+_pending = []       #[name, time spent in listed nested imports] per import in progress
+_knownModules = set()
+_origImport = __builtin__.__import__
+
+
+def _isPending(module):
+    """True if module belongs to an import still in progress, it is listed with that import
+    """
+    for (name, childTime) in _pending:
+        if module == name or module.endswith('.' + name) or name.startswith(module + '.'):
+            return True
+    return False
+
+def _newModules():
+    """names of modules loaded since the last call, None entries (failed implicit relative imports in python 2) are skipped
+    """
+    new = [m for m in sys.modules if m not in _knownModules and not _isPending(m)]
+    _knownModules.update(new)
+    return sorted(m for m in new if sys.modules[m] is not None)
+
+def _profilingImport(name, *args, **kwargs):
+    moduleCnt = len(sys.modules)
+    level = len(_pending)
+    _pending.append([name, 0.0])
+    t0 = monotonic()
+    try:
+        return _origImport(name, *args, **kwargs)
+    finally:
+        cumTime = monotonic() - t0
+        childTime = _pending.pop()[1]
+        loaded = _newModules() if len(sys.modules) > moduleCnt else []    #nested imports already took their modules
+        if loaded:
+            records.append([level, ", ".join(loaded), cumTime - childTime, cumTime])
+            if _pending:
+                _pending[-1][1] += cumTime
+
+def install():
+    """replaces the import function, to be called before all other imports
+    """
+    global active, startTime
+    if not active:
+        startTime = monotonic()
+        _knownModules.update(sys.modules)
+        __builtin__.__import__ = _profilingImport
+        active = True
+
+def uninstall():
+    global active
+    if active:
+        __builtin__.__import__ = _origImport
+        active = False
+
+def mark(label):
+    marks.append((label, monotonic() - startTime))
+
+def reportLines():
+    lines = ["import time: self [ms] | cumulative [ms] | module"]
+    for (level, name, selfTime, cumTime) in records:
+        lines.append("%12.1f | %16.1f | %s%s" % (selfTime * 1000, cumTime * 1000, "  " * level, name))
+    lines.append("")
+    for (label, t) in marks:
+        lines.append("%s: %.3f sec" % (label, t))
+    return lines
+
+def summaryLines():
+    """time of every mark and the modules with the longest cumulative import time on the top level
+    """
+    lines = ["Startup: %s after %.3f sec" % (label, t) for (label, t) in marks]
+    topLevel = sorted((r for r in records if r[0] == 0), key=lambda r: r[3], reverse=True)
+    for (level, name, selfTime, cumTime) in topLevel[:REPORT_TOP_CNT]:
+        lines.append("  import %s: %.1f ms" % (name, cumTime * 1000))
+    return lines
+
+def finish(reportPath, label="main window shown"):
+    """
+    ends profiling, writes the full report to reportPath and the summary to the message log
+    returns False, so it can be passed to GLib.idle_add directly
+    """
+    import MsgLogger
+    
+    if active:
+        mark(label)
+        uninstall()
+        with open(reportPath, 'w') as f:
+            f.write("\n".join(reportLines()) + "\n")
+        for line in summaryLines():
+            MsgLogger.append(line)
+        MsgLogger.append("Startup profile written to '" + reportPath + "'")
+    return False
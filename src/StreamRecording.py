@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+StreamRecording writes bio data to disk while the experiment runs instead of
+keeping the whole session in memory. The file is a plain '.npy' file that grows in
+chunks of fixed size. Only the chunk currently written is memory-mapped, so resident
+memory does not depend on the max. duration of the experiment.
+On finalize the file is truncated to the recorded frames and the '.npy' header is
+updated, afterwards it can be opened with np.load(path, mmap_mode='r').
+"""
+
+import os
+import numpy as np
+
+HEADER_LEN = 128    #bytes, fixed so the header can be rewritten with the final shape
+NPY_MAGIC = "\x93NUMPY\x01\x00"
+
+
+def _npyHeader(frameCnt, channelCnt):
+    hdr = "{'descr': '<u2', 'fortran_order': False, 'shape': (%d, %d), }" % (frameCnt, channelCnt)
+    hdrLen = HEADER_LEN - len(NPY_MAGIC) - 2        #2 bytes header length field
+    hdr = hdr.ljust(hdrLen - 1) + "\n"
+    return NPY_MAGIC + chr(hdrLen & 0xff) + chr(hdrLen >> 8) + hdr
+
+
+class StreamRecording:
+    """
+    Used by ExpController like the preallocated bioData array: bioData[frameNrArr] = dataBlock
+    Frames are written to a memory-mapped chunk of chunkFrames frames. The file is extended chunk by chunk.
+    """
+    def __init__(self, path, channelCnt, chunkFrames):
+        self.path = path
+        self.channelCnt = channelCnt
+        self.chunkFrames = int(chunkFrames)
+        self.rowBytes = channelCnt * np.dtype(np.uint16).itemsize
+
+        self._file = open(path, 'w+b')
+        self._file.write(_npyHeader(0, channelCnt))
+        self._fileChunks = 0        #chunks the file is currently extended to
+        self._chunkIndex = -1
+        self._chunk = None          #np.memmap of current chunk
+
+    def _mapChunk(self, chunkIndex):
+        if chunkIndex == self._chunkIndex:
+            return self._chunk
+
+        self._unmapChunk()
+
+        if chunkIndex >= self._fileChunks:     #extend file, new space reads as zeros like np.zeros did
+            self._fileChunks = chunkIndex + 1
+            self._file.truncate(HEADER_LEN + self._fileChunks * self.chunkFrames * self.rowBytes)
+
+        self._chunk = np.memmap(self._file, np.uint16, 'r+', HEADER_LEN + chunkIndex * self.chunkFrames * self.rowBytes,
+                                (self.chunkFrames, self.channelCnt))
+        self._chunkIndex = chunkIndex
+        return self._chunk
+
+    def _unmapChunk(self):
+        if self._chunk is not None:
+            self._chunk.flush()
+            self._chunk = None      #memory is unmapped when the last reference is gone
+            self._chunkIndex = -1
+
+    def __setitem__(self, frameNrArr, dataBlock):
+        chunkIndexArr = frameNrArr // self.chunkFrames
+        firstChunk = int(chunkIndexArr[0])
+
+        if firstChunk == chunkIndexArr[-1]:   #usually the whole block fits into one chunk
+            chunk = self._mapChunk(firstChunk)
+            chunk[frameNrArr - firstChunk * self.chunkFrames] = dataBlock
+        else:
+            for chunkIndex in np.unique(chunkIndexArr):
+                inChunk = chunkIndexArr == chunkIndex
+                chunk = self._mapChunk(int(chunkIndex))
+                chunk[frameNrArr[inChunk] - chunkIndex * self.chunkFrames] = dataBlock[inChunk]
+
+    def finalize(self, frameCnt):
+        """
+        cuts the file to frameCnt frames and writes the final header. No more frames can be written afterwards.
+        returns the file path
+        """
+        if self._file:
+            self._unmapChunk()
+            self._file.truncate(HEADER_LEN + frameCnt * self.rowBytes)
+            self._file.seek(0)
+            self._file.write(_npyHeader(frameCnt, self.channelCnt))
+            self._file.close()
+            self._file = None
+        return self.path
+
+    def fileName(self):
+        return os.path.basename(self.path)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+BioLink - Tool for synchronized psycho-physiological and behavioural data acquisition
+Copyright (C) 2017  Julian Schneider, Department of Internal Medicine,
+                    University Hospital Zurich, Zurich, Switzerland.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+-----------------------------------------------------------------
+Monotonic clock for time stamps that must not jump when the system time is
+adjusted (NTP, daylight saving). Python 2.7 has no time.monotonic, so the
+clock of the operating system is used directly:
+Linux: clock_gettime(CLOCK_MONOTONIC), Windows: time.clock (performance counter).
+Other systems fall back to time.time.
+
+SampleClockModel maps host time to the sample clock of the device (frame nrs).
+"""
+
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+
+import numpy as np
+
+CLOCK_MONOTONIC = 1     #linux/time.h
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _initMonotonic():
+    if sys.platform.startswith('linux'):
+        try:
+            librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno=True)
+            clockGettime = librt.clock_gettime
+            clockGettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+            
+            def monotonicLinux():
+                ts = _Timespec()    #per call, used by several threads
+                if clockGettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+                    raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+                return ts.tv_sec + ts.tv_nsec * 1e-9
+            
+            monotonicLinux()    #test
+            return monotonicLinux
+        except (OSError, AttributeError):
+            pass
+    elif os.name == 'nt':
+        return time.clock   #QueryPerformanceCounter on Windows
+    return time.time
+
+monotonic = _initMonotonic()     #monotonic() returns seconds, only differences are meaningful
+
+
+class SampleClockModel:
+    """
+    Linear model of host time over frame nr: t = t0 + (frameNr - f0) / fs, fitted by least squares
+    to the arrival times of frame blocks (frame nr of the last frame in a block, host time).
+    Times include the transmission latency of the device, so frame positions of host events are
+    the frames arriving at that time. The running fit uses sums only, every update is O(1).
+    Memory is bounded: at most MAX_POINTS points are kept for dataArray and the residual statistics,
+    when they are full every other point is dropped and only every 2nd point is kept from then on.
+    """
+    MIN_POINTS = 10     #blocks needed before the model is used
+    MAX_POINTS = 4096   #points kept, 12 h at 20 blocks/s are kept as every 256th point
+    
+    def __init__(self, nominalFs):
+        self.nominalFs = float(nominalFs)
+        self._points = np.empty((self.MAX_POINTS, 2), np.float64)    #frame nr, host time
+        self._kept = 0
+        self._keepEvery = 1     #point i is kept if i % _keepEvery == 0
+        self._n = 0
+        self._x0 = None     #first point, sums are relative to it for numeric stability
+        self._y0 = None
+        self._sx = self._sy = self._sxx = self._sxy = 0.0
+        
+    def update(self, frameNr, t):
+        """adds the arrival time t [sec] of frame frameNr
+        """
+        if self._x0 is None:
+            self._x0 = float(frameNr)
+            self._y0 = float(t)
+        x = frameNr - self._x0
+        y = t - self._y0
+        self._n += 1
+        self._sx += x
+        self._sy += y
+        self._sxx += x*x
+        self._sxy += x*y
+        
+        i = self._n - 1
+        if i % self._keepEvery == 0 and self._kept == self.MAX_POINTS:
+            self._points[:self.MAX_POINTS//2] = self._points[::2]
+            self._kept = self.MAX_POINTS//2
+            self._keepEvery *= 2
+        if i % self._keepEvery == 0:
+            self._points[self._kept] = (frameNr, t)
+            self._kept += 1
+    
+    def ready(self):
+        return self._n >= self.MIN_POINTS and self._n * self._sxx - self._sx * self._sx > 0
+        
+    def _fit(self):
+        """returns (slope [sec per frame], intercept [sec at x = 0]) of the running fit
+        """
+        slope = (self._n * self._sxy - self._sx * self._sy) / (self._n * self._sxx - self._sx * self._sx)
+        intercept = (self._sy - slope * self._sx) / self._n
+        return (slope, intercept)
+    
+    def frameAt(self, t):
+        """returns the fractional frame nr arriving at host time t, None if the model is not ready
+        """
+        if not self.ready():
+            return None
+        (slope, intercept) = self._fit()
+        return self._x0 + (t - self._y0 - intercept) / slope
+    
+    def dataArray(self):
+        """returns the points kept (see MAX_POINTS) as array with columns frame nr, host time
+        """
+        return self._points[:self._kept].copy()
+    
+    def summary(self):
+        """dict for the log header: fitted sample rate, host time of frame 0 and residual jitter of block arrivals (points kept)
+        """
+        summ = {'nominalFs': self.nominalFs, 'points': self._n, 'pointsKept': self._kept}
+        if self.ready():
+            (slope, intercept) = self._fit()
+            (frameNrs, times) = self._points[:self._kept].T
+            residuals = times - (self._y0 + intercept + (frameNrs - self._x0) * slope)
+            summ.update({'fittedFs': 1.0 / slope,
+                         'drift_ppm': (1.0 / slope / self.nominalFs - 1.0) * 1e6,
+                         'timeOfFrame0_sec': self._y0 + intercept - self._x0 * slope,
+                         'residualStd_ms': float(np.std(residuals)) * 1000,
+                         'residualMax_ms': float(np.max(np.abs(residuals))) * 1000})
+        return summ
@@ -24,7 +24,14 @@ main was not integrated in BioLinkView because the module called as main gets ca
 Therefore, a module variable like BioLinkView.view (class instance in this case) is not shared by __main__ as __main__ sees the variable as
 __main__.view whereas other modules importing BioLinkView see it as BioLinkView.view.
 With this separate module as main, BioLinkView gets imported also by main.py and therefore the global module variables are shared by all importing modules.
+
+Start with argument --profile-startup to log import times and the time until the window is shown (see StartupProfile).
 '''
+import sys
+import StartupProfile
+if "--profile-startup" in sys.argv:
+    StartupProfile.install()    #before all other imports
+
 import gi
 import ExpController
 gi.require_version('Gtk', '3.0')
@@ -58,6 +65,9 @@ if __name__ == '__main__':
     
     view.setWindowTitle(wndTitle)
     view.show()     
+    if StartupProfile.active:
+        #idle callback runs once the window is drawn
+        GLib.idle_add(StartupProfile.finish, logDir + "BioLink_StartupProfile_" + time.strftime("%Y%m%d_%H%M") + ".txt")
     Gtk.main()      #does not return until window is closed 
      
     MsgLogger.viewAppendFnc = None